@@ -14,7 +14,8 @@ function App() {
     isProcessing, 
     sendPrompt,
     socketError,
-    resetResponse 
+    resetResponse,
+    canRefine
   } = useWebSocketConnection('ws://localhost:8000/ws');
   
   useEffect(() => {
@@ -29,6 +30,7 @@ function App() {
       <CollaborativeCanvas 
         isSidePanelOpen={isSidePanelOpen}
         aiData={aiResponse?.shapes}
+        aiOps={aiResponse?.ops}
       />
       
       <div className={`connection-status ${isConnected ? 'connected' : 'disconnected'}`}>
@@ -53,6 +55,7 @@ function App() {
         isLoading={isProcessing}
         isConnected={isConnected}
         socketError={socketError}
+        canRefine={canRefine}
       />
     </div>
   );
@@ -6,6 +6,7 @@ export interface AIResponse {
   text: string;
   shapes: any[];
   id: string;
+  ops?: any[];
 }
 
 interface AISidePanelProps {
@@ -18,6 +19,7 @@ interface AISidePanelProps {
   isLoading: boolean;
   isConnected: boolean;
   socketError: string | null;
+  canRefine: boolean;
 }
 
 export const AISidePanel = ({ 
@@ -29,7 +31,8 @@ export const AISidePanel = ({
   aiResponse,
   isLoading,
   isConnected,
-  socketError
+  socketError,
+  canRefine
 }: AISidePanelProps) => {
   const [prompt, setPrompt] = useState('');
   const [generationMode, setGenerationMode] = useState('text_to_flowchart');
@@ -138,6 +141,17 @@ export const AISidePanel = ({
               />
               Mind Map
             </label>
+            <label>
+              <input
+                type="radio"
+                name="generation"
+                value="refine"
+                checked={generationMode === 'refine'}
+                onChange={() => setGenerationMode('refine')}
+                disabled={!canRefine}
+              />
+              Refine Last Diagram
+            </label>
           </div>
         </div>
         
@@ -169,7 +183,11 @@ export const AISidePanel = ({
             ) : (
               <div className="output-content">
                 {aiResponse?.text}
-                {aiResponse?.shapes && (
+                {aiResponse?.ops ? (
+                  <div className="shape-info">
+                    <p>✓ {aiResponse.ops.length} shapes changed</p>
+                  </div>
+                ) : aiResponse?.shapes && (
                   <div className="shape-info">
                     <p>✓ {aiResponse.shapes.length} shapes generated</p>
                   </div>
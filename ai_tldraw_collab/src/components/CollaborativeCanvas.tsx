@@ -7,6 +7,7 @@ import {
   useEditor,
   Editor,
   createShapeId,
+  TLShapeId,
 } from 'tldraw';
 import { useSyncDemo } from '@tldraw/sync';
 import 'tldraw/tldraw.css';
@@ -95,14 +96,97 @@ const CollaborationInfoPanel = track(() => {
   }
 });
 
+// Convert a shape from the backend into a TLDraw shape
+const toTLShape = (shape: any): any => {
+  // Use the stable ID from the backend, or create a unique one
+  const id = (shape.id as TLShapeId) || createShapeId();
+  
+  // The base shape structure
+  const baseShape = {
+    id,
+    type: shape.type || 'geo',
+    x: shape.x || 100,
+    y: shape.y || 100,
+  };
+  
+  // Different shape types need different prop structures
+  if (shape.type === 'text') {
+    // For text shapes we need to use w and h but no text property
+    return {
+      ...baseShape,
+      props: {
+        w: shape.props?.w || 200,
+        h: shape.props?.h || 100,
+        color: shape.props?.color || 'black',
+        size: shape.props?.size || 'm',
+        font: shape.props?.font || 'draw',
+        align: shape.props?.align || 'middle',
+        verticalAlign: shape.props?.verticalAlign || 'middle',
+        growY: shape.props?.growY || 0,
+        text: shape.props?.text || 'AI Generated',
+      }
+    };
+  } else if (shape.type === 'geo') {
+    // For geo shapes with labels
+    return {
+      ...baseShape,
+      props: {
+        w: shape.props?.w || 100,
+        h: shape.props?.h || 100,
+        geo: shape.props?.geo || 'rectangle',
+        color: shape.props?.color || 'blue',
+        fill: shape.props?.fill || 'none',
+        dash: shape.props?.dash || 'draw',
+        size: shape.props?.size || 'm',
+        labelColor: shape.props?.labelColor || 'black',
+        text: shape.props?.text || '',  // This is valid for geo shapes
+      }
+    };
+  } else {
+    // Default for other shapes
+    return {
+      ...baseShape,
+      props: shape.props || {
+        w: 100,
+        h: 100,
+        color: 'blue',
+      }
+    };
+  }
+};
+
+// Create shapes, setting the text of text shapes separately to avoid the validation error
+const createAIShapes = (editor: Editor, shapes: any[]) => {
+  editor.createShapes(shapes.map(shape =>
+    shape.type === 'text' ? { ...shape, props: { ...shape.props, text: '' } } : shape
+  ));
+  
+  shapes.forEach(shape => {
+    if (shape.type === 'text' && shape.props) {
+      // Using updateShapes to set text for text shapes
+      editor.updateShapes([
+        {
+          id: shape.id,
+          type: 'text',
+          props: {
+            text: shape.props.text
+          }
+        }
+      ]);
+    }
+  });
+};
+
 interface CollaborativeCanvasProps {
   isSidePanelOpen: boolean;
   aiData?: any[]; // Shapes generated by the AI
+  aiOps?: any[]; // Changes to the last AI diagram
 }
 
 export const CollaborativeCanvas = ({ 
   isSidePanelOpen,
-  aiData
+  aiData,
+  aiOps
 }: CollaborativeCanvasProps) => {
   const editorRef = useRef<Editor | null>(null);
   
@@ -154,85 +238,15 @@ export const CollaborativeCanvas = ({
     try {
       // Start a batch update
       editor.batch(() => {
-        // Create shapes based on AI data
-        const shapesToCreate = aiData.map(shape => {
-          // Create a unique ID for this shape
-          const id = createShapeId();
-          
-          // The base shape structure
-          const baseShape = {
-            id,
-            type: shape.type || 'geo',
-            x: shape.x || 100,
-            y: shape.y || 100,
-          };
-          
-          // Different shape types need different prop structures
-          if (shape.type === 'text') {
-            // For text shapes we need to use w and h but no text property
-            return {
-              ...baseShape,
-              props: {
-                w: shape.props?.w || 200,
-                h: shape.props?.h || 100,
-                color: shape.props?.color || 'black',
-                size: shape.props?.size || 'm',
-                font: shape.props?.font || 'draw',
-                align: shape.props?.align || 'middle',
-                verticalAlign: shape.props?.verticalAlign || 'middle',
-                growY: shape.props?.growY || 0,
-                text: '', // Initialize with empty string
-              }
-            };
-          } else if (shape.type === 'geo') {
-            // For geo shapes with labels
-            return {
-              ...baseShape,
-              props: {
-                w: shape.props?.w || 100,
-                h: shape.props?.h || 100,
-                geo: shape.props?.geo || 'rectangle',
-                color: shape.props?.color || 'blue',
-                fill: shape.props?.fill || 'none',
-                dash: shape.props?.dash || 'draw',
-                size: shape.props?.size || 'm',
-                labelColor: shape.props?.labelColor || 'black',
-                text: shape.props?.text || '',  // This is valid for geo shapes
-              }
-            };
-          } else {
-            // Default for other shapes
-            return {
-              ...baseShape,
-              props: shape.props || {
-                w: 100,
-                h: 100,
-                color: 'blue',
-              }
-            };
-          }
-        });
+        // Every diagram has its own shape IDs; one already on the canvas (e.g. a frame
+        // received twice) is updated in place rather than created again
+        const shapes = aiData.map(toTLShape);
+        const shapesToCreate = shapes.filter(shape => !editor.getShape(shape.id));
+        const shapesToUpdate = shapes.filter(shape => editor.getShape(shape.id));
         
         // Create all shapes at once
-        editor.createShapes(shapesToCreate);
-        
-        // After creating shapes, set text for text shapes separately
-        // This avoids the validation error
-        shapesToCreate.forEach(shape => {
-          if (shape.type === 'text' && shape.props) {
-            const textContent = shape.props.text || 'AI Generated';
-            // Using updateShapes to set text for text shapes
-            editor.updateShapes([
-              {
-                id: shape.id,
-                type: 'text',
-                props: {
-                  text: textContent
-                }
-              }
-            ]);
-          }
-        });
+        createAIShapes(editor, shapesToCreate);
+        editor.updateShapes(shapesToUpdate);
         
         // Zoom to fit all shapes
         setTimeout(() => editor.zoomToFit(), 100);
@@ -243,6 +257,31 @@ export const CollaborativeCanvas = ({
     }
   }, [aiData]);
   
+  // Apply refinements: only the shapes that changed
+  useEffect(() => {
+    if (!aiOps || aiOps.length === 0 || !editorRef.current) return;
+    
+    const editor = editorRef.current;
+    
+    try {
+      editor.batch(() => {
+        const deletes = aiOps
+          .filter(op => op.op === 'delete' && editor.getShape(op.id))
+          .map(op => op.id as TLShapeId);
+        const creates = aiOps.filter(op => op.op === 'create').map(op => toTLShape(op.shape));
+        const updates = aiOps
+          .filter(op => op.op === 'update' && editor.getShape(op.shape.id))
+          .map(op => op.shape);
+        
+        editor.deleteShapes(deletes);
+        createAIShapes(editor, creates);
+        editor.updateShapes(updates);
+      });
+    } catch (error) {
+      console.error("Error applying AI changes:", error);
+    }
+  }, [aiOps]);
+  
   return (
     <div className={`canvas-container ${isSidePanelOpen ? 'with-panel' : ''}`}>
       <Tldraw
@@ -8,6 +8,8 @@ export interface AIResponse {
   type: string;
   title?: string;
   description?: string;
+  diagram_id?: string;
+  ops?: any[]; // create/update/delete operations, for refinements
 }
 
 export function useWebSocketConnection(url: string) {
@@ -15,7 +17,9 @@ export function useWebSocketConnection(url: string) {
   const [isProcessing, setIsProcessing] = useState(false);
   const [aiResponse, setAiResponse] = useState<AIResponse | null>(null);
   const [socketError, setSocketError] = useState<string | null>(null);
+  const [diagramId, setDiagramId] = useState<string | null>(null);
   const socketRef = useRef<WebSocket | null>(null);
+  const diagramIdRef = useRef<string | null>(null);
 
   // Setup WebSocket connection
   useEffect(() => {
@@ -57,6 +61,17 @@ export function useWebSocketConnection(url: string) {
                 ...data,
                 text: responseText
               });
+              // The latest generated diagram is the one refinements apply to
+              diagramIdRef.current = data.diagram_id || null;
+              setDiagramId(diagramIdRef.current);
+              setIsProcessing(false);
+            } else if (data.type === 'delta') {
+              // A refinement of the current diagram: only the changed shapes
+              setAiResponse({
+                ...data,
+                text: data.text || '',
+                shapes: []
+              });
               setIsProcessing(false);
             } else if (data.type === 'error') {
               setSocketError(data.message);
@@ -107,7 +122,11 @@ export function useWebSocketConnection(url: string) {
       setIsProcessing(true);
       socketRef.current.send(JSON.stringify({
         prompt,
-        mode
+        mode,
+        // Refinements apply to the most recently generated diagram
+        ...(mode === 'refine' ? { diagram_id: diagramIdRef.current } : {}),
+        // The side panel shows the raw model output, which is only sent on request
+        include_text: true
       }));
     } else {
       setSocketError('WebSocket is not connected');
@@ -126,6 +145,7 @@ export function useWebSocketConnection(url: string) {
     aiResponse,
     sendPrompt,
     socketError,
-    resetResponse
+    resetResponse,
+    canRefine: diagramId !== null
   };
 }
\ No newline at end of file
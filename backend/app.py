@@ -1,15 +1,43 @@
 # backend/app.py
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import asyncio
 import json
 import logging
-from typing import Dict, List, Any, Optional
+import os
+import time
+from typing import Dict, List, Any, Optional, Set, Tuple, Callable
 import uuid
 
 # Import our services
-from models.llm import get_llm_response
-from services.tldraw import generate_flowchart, generate_process_diagram, generate_mind_map
+from models.llm import (
+    get_llm_response, stream_llm_response, validate_llm_response, record_llm_outcome,
+    get_cached_llm_response, cache_llm_response, init_llm_client, close_llm_client,
+    warm_up_llm, coalescing_stats, cancel_stats, repair_stats, prompt_stats, prompt_eval_summary,
+    LLMError, OLLAMA_WARM_UP
+)
+from services.tldraw import (
+    generate_flowchart, generate_layered_flowchart, generate_process_diagram, generate_layered_process_diagram,
+    generate_mind_map, generate_radial_mind_map, FLOWCHART_LAYOUTS
+)
+from models.diagram import DiagramModel, load_diagram
+from models.backends import backend_pool
+from models.scheduler import scheduler, scheduler_client, QueueFullError
+from services.streaming import ProgressiveDiagram
+from services.shapes import Shape
+from services.diagrams import (
+    Diagram, UnknownDiagramError, diagram_store, diagram_namespace, index_shapes, diff_shapes
+)
+from services.layout import FlowchartLayout, LayoutEditError, graph_edits
+from services.serializer import EncodedFrame, encode_frame
+from services.bus import message_bus, room_channel
+from services.cache import cached_layout, get_cache_stats, close_caches, llm_cache, layout_cache, route_cache
+from services.workers import run_layout, start_layout_pool, shutdown_layout_pool
+from services.metrics import (
+    registry, Counter, Gauge, time_stage, observe_stage, render_metrics,
+    requests_total, responses_total, errors_total, requests_in_flight, slow_consumers_total
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,8 +54,153 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Store for active WebSocket connections
-active_connections: Dict[str, WebSocket] = {}
+# Flowchart layout: "grid" fills rows of up to three nodes, "layered" ranks nodes along the connections
+FLOWCHART_LAYOUT = os.getenv("FLOWCHART_LAYOUT", "grid")
+LAYERED = FLOWCHART_LAYOUT == "layered"
+# Mind map layout: "classic" puts branches on one circle, "radial" sizes sectors by subtree to any depth
+MIND_MAP_LAYOUT = os.getenv("MIND_MAP_LAYOUT", "classic")
+
+# Diagram type and shape generator for each request mode
+DIAGRAM_MODES: Dict[str, Tuple[str, Callable[[Any, str], List[Shape]]]] = {
+    "text_to_flowchart": ("flowchart", generate_layered_flowchart if LAYERED else generate_flowchart),
+    "process_diagram": ("process", generate_layered_process_diagram if LAYERED else generate_process_diagram),
+    "mind_map": ("mindmap", generate_radial_mind_map if MIND_MAP_LAYOUT == "radial" else generate_mind_map),
+}
+DEFAULT_MODE = ("general", DIAGRAM_MODES["text_to_flowchart"][1])
+# Changes an earlier diagram (by diagram_id) and responds with a delta
+REFINE_MODE = "refine"
+# Applies graph edits (by diagram_id) without the LLM and responds with a delta
+EDIT_MODE = "edit"
+# Modes that get their own metric labels; anything else a client sends is "unknown"
+METRIC_MODES = {*DIAGRAM_MODES, DEFAULT_MODE[0], REFINE_MODE, EDIT_MODE}
+# Exception types unexpected failures are counted under; others are "internal".
+# Failed generations have their own "llm_error" label
+METRIC_ERRORS = (ValueError, RuntimeError)
+
+# Maximum number of requests a single connection may have in flight
+WS_MAX_CONCURRENT_REQUESTS = int(os.getenv("WS_MAX_CONCURRENT_REQUESTS", "4"))
+# Frames queued for a socket before the client is disconnected as too slow to keep up
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# Collaboration rooms a connection may be in at once, and the longest room name
+WS_MAX_ROOMS = int(os.getenv("WS_MAX_ROOMS", "8"))
+WS_MAX_ROOM_NAME = 128
+# Close code for a client that fell behind ("try again later")
+WS_CLOSE_TOO_SLOW = 1013
+# Least seconds between partial frames of a streamed diagram; each one lays out
+# and sends the whole diagram so far, so they are not sent for every object
+STREAM_PARTIAL_INTERVAL = float(os.getenv("STREAM_PARTIAL_INTERVAL", "0.1"))
+# Seconds a request may take, queueing included, before it is abandoned (0 for no limit);
+# clients may ask for less with "timeout" in the request
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+@app.on_event("startup")
+async def startup():
+    # Open the pooled Ollama client once for the lifetime of the app
+    await init_llm_client()
+    # Frames for sockets held by other workers go through the message bus
+    await message_bus.start()
+    if OLLAMA_WARM_UP:
+        # In the background, so the app serves requests while the model loads
+        app.state.warm_up = asyncio.create_task(warm_up_llm())
+    start_layout_pool()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_llm_client()
+    await message_bus.stop()
+    shutdown_layout_pool()
+    close_caches()
+
+class ClientConnection:
+    """
+    A WebSocket client, the requests it currently has in flight and the rooms it is in.
+    
+    Frames for the client wait in its own send queue and one writer task
+    writes them out, so a room's frames reach every member at once and a slow
+    client holds up nobody but itself.
+    """
+    
+    def __init__(self, connection_id: str, websocket: WebSocket):
+        self.id = connection_id
+        self.websocket = websocket
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.rooms: Set[str] = set()
+        self.closed = False
+        self._queue: "asyncio.Queue[EncodedFrame]" = asyncio.Queue(WS_SEND_QUEUE_SIZE)
+        self._writer = asyncio.create_task(self._write_frames())
+    
+    def forget_task(self, request_id: str, task: asyncio.Task) -> None:
+        # Only drop the entry if a newer request has not reused the ID
+        if self.tasks.get(request_id) is task:
+            del self.tasks[request_id]
+    
+    async def send_json(self, message: Dict[str, Any]) -> None:
+        with time_stage("serialize"):
+            frame = encode_frame(message)
+        await self.send_frame(frame)
+    
+    async def send_frame(self, frame: EncodedFrame) -> None:
+        # Through the bus, which queues it straight away when the socket is ours
+        await message_bus.send(self.id, frame)
+    
+    async def share_frame(self, room: Optional[str], frame: EncodedFrame) -> None:
+        """Send a result to every member of a room, or only to this client outside one"""
+        if room is None or room not in self.rooms:
+            await self.send_frame(frame)
+        else:
+            await message_bus.publish(room_channel(room), frame)
+    
+    async def deliver(self, frame: EncodedFrame) -> None:
+        """Queue a frame for the socket; the message bus calls this for every frame the client gets"""
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Skipping frames would leave the client's board out of step, so it has to reconnect
+            logger.warning(f"Disconnecting {self.id}: {WS_SEND_QUEUE_SIZE} frames are waiting to be sent")
+            slow_consumers_total.inc()
+            self.close()
+            asyncio.create_task(self._close_socket(WS_CLOSE_TOO_SLOW))
+    
+    async def _write_frames(self) -> None:
+        while True:
+            frame = await self._queue.get()
+            try:
+                with time_stage("send"):
+                    await self.websocket.send_text(frame.text)
+            except Exception as e:
+                # Nothing more can reach the socket, so drop its frames and leave its rooms
+                # now rather than when the endpoint notices the disconnect
+                logger.info(f"Stopped writing to {self.id}: {e}")
+                self.closed = True
+                for room in list(self.rooms):
+                    await self.leave(room)
+                self.close()
+                return
+    
+    async def _close_socket(self, code: int) -> None:
+        try:
+            await self.websocket.close(code)
+        except Exception:
+            pass
+    
+    async def join(self, room: str) -> None:
+        if self.closed:
+            return
+        self.rooms.add(room)
+        await message_bus.subscribe(self.id, room_channel(room))
+    
+    async def leave(self, room: str) -> None:
+        self.rooms.discard(room)
+        await message_bus.unsubscribe(self.id, room_channel(room))
+    
+    def close(self) -> None:
+        """Stop writing to the socket and abandon the unfinished requests"""
+        self.closed = True
+        self._writer.cancel()
+        for task in list(self.tasks.values()):
+            task.cancel()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -36,11 +209,17 @@ async def websocket_endpoint(websocket: WebSocket):
     
     # Generate a unique connection ID
     connection_id = str(uuid.uuid4())
-    active_connections[connection_id] = websocket
+    connection = ClientConnection(connection_id, websocket)
+    await message_bus.register(connection_id, connection.deliver)
     
     logger.info(f"New WebSocket connection: {connection_id}")
     
     try:
+        # Clients can join a room as they connect, with /ws?room=<name>
+        room = websocket.query_params.get("room")
+        if room:
+            await join_room(connection, room)
+        
         while True:
             # Receive a message from the client
             data = await websocket.receive_text()
@@ -49,61 +228,558 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 # Parse the JSON data
                 parsed_data = json.loads(data)
-                prompt = parsed_data.get("prompt", "")
-                mode = parsed_data.get("mode", "text_to_flowchart")
-                
-                # Send processing notification
-                await websocket.send_json({
-                    "type": "processing",
-                    "message": "Processing your request..."
-                })
-                
-                # Generate shapes based on the LLM response
-                if mode == "text_to_flowchart":
-                    llm_response = await get_llm_response(prompt, "flowchart")
-                    shapes = generate_flowchart(llm_response)
-                elif mode == "process_diagram":
-                    llm_response = await get_llm_response(prompt, "process")
-                    shapes = generate_process_diagram(llm_response)
-                elif mode == "mind_map":
-                    llm_response = await get_llm_response(prompt, "mindmap")
-                    llm_response = llm_response.strip().replace("```json", "").replace("```", "").strip()
-                    shapes = generate_mind_map(llm_response)
-                else:
-                    llm_response = await get_llm_response(prompt, "general")
-                    shapes = generate_flowchart(llm_response)
-                
-                # Send the response back to the client
-                await websocket.send_json({
-                    "type": "response",
-                    "id": str(uuid.uuid4()),
-                    "text": llm_response,
-                    "shapes": shapes
-                })
-                
             except json.JSONDecodeError as e:
                 logger.error(f"Invalid JSON: {e}")
-                await websocket.send_json({
+                errors_total.inc(mode="unknown", error="invalid_json")
+                await connection.send_json({
                     "type": "error",
                     "message": "Invalid JSON format"
                 })
-            except Exception as e:
-                logger.error(f"Error processing request: {e}")
-                await websocket.send_json({
+                continue
+            
+            if not isinstance(parsed_data, dict):
+                logger.error(f"Message from {connection_id} is not a JSON object")
+                errors_total.inc(mode="unknown", error="invalid_json")
+                await connection.send_json({
                     "type": "error",
-                    "message": f"Error: {str(e)}"
+                    "message": "Invalid message format"
                 })
+                continue
+            
+            message_type = parsed_data.get("type", "generate")
+            request_id = str(parsed_data.get("request_id") or uuid.uuid4())
+            
+            if message_type == "cancel":
+                task = connection.tasks.pop(request_id, None)
+                if task is None:
+                    await connection.send_json({
+                        "type": "error",
+                        "request_id": request_id,
+                        "message": "No request in progress with this ID"
+                    })
+                else:
+                    task.cancel()
+                    await connection.send_json({
+                        "type": "cancelled",
+                        "request_id": request_id
+                    })
+                continue
+            
+            if message_type == "join":
+                await join_room(connection, parsed_data.get("room"))
+                continue
+            
+            if message_type == "leave":
+                room = str(parsed_data.get("room") or "")
+                if room in connection.rooms:
+                    await connection.leave(room)
+                await connection.send_json({"type": "left", "room": room})
+                continue
+            
+            if parsed_data.get("room") is not None and str(parsed_data["room"]) not in connection.rooms:
+                await connection.send_json({
+                    "type": "error",
+                    "request_id": request_id,
+                    "code": "not_in_room",
+                    "message": "Join the room before sharing requests with it"
+                })
+                continue
+            
+            if request_id in connection.tasks:
+                await connection.send_json({
+                    "type": "error",
+                    "request_id": request_id,
+                    "message": "A request with this ID is already in progress"
+                })
+                continue
+            
+            if len(connection.tasks) >= WS_MAX_CONCURRENT_REQUESTS:
+                errors_total.inc(mode=mode_label(parsed_data.get("mode")), error="too_many_requests")
+                await connection.send_json({
+                    "type": "error",
+                    "request_id": request_id,
+                    "message": f"Too many concurrent requests (limit is {WS_MAX_CONCURRENT_REQUESTS})"
+                })
+                continue
+            
+            # Run each request as its own task so the socket keeps reading
+            task = asyncio.create_task(handle_request(connection, request_id, parsed_data))
+            connection.tasks[request_id] = task
+            task.add_done_callback(lambda t, rid=request_id: connection.forget_task(rid, t))
                 
     except WebSocketDisconnect:
-        # Remove the connection when it's closed
-        if connection_id in active_connections:
-            del active_connections[connection_id]
         logger.info(f"WebSocket connection closed: {connection_id}")
+    finally:
+        # Remove the connection and abandon its unfinished requests
+        connection.close()
+        await message_bus.unregister(connection_id)
+
+async def join_room(connection: ClientConnection, room: Any) -> None:
+    """Add a connection to a collaboration room, whose members all receive the diagrams any of them generate"""
+    room = str(room or "")
+    if not room or len(room) > WS_MAX_ROOM_NAME:
+        message = f"A room name must have 1 to {WS_MAX_ROOM_NAME} characters"
+    elif room not in connection.rooms and len(connection.rooms) >= WS_MAX_ROOMS:
+        message = f"Too many rooms (limit is {WS_MAX_ROOMS})"
+    else:
+        await connection.join(room)
+        await connection.send_json({"type": "joined", "room": room})
+        return
+    await connection.send_json({"type": "error", "code": "invalid_room", "message": message})
+
+def request_room(connection: ClientConnection, parsed_data: Dict[str, Any]) -> Optional[str]:
+    """The room a request's results are shared with: the one it names, else the connection's only room"""
+    if parsed_data.get("room") is not None:
+        return str(parsed_data["room"])
+    if len(connection.rooms) == 1:
+        return next(iter(connection.rooms))
+    return None
+
+async def handle_request(connection: ClientConnection, request_id: str, parsed_data: Dict[str, Any]) -> None:
+    """Generate a diagram for one client request and send the result back"""
+    prompt = parsed_data.get("prompt", "")
+    mode = parsed_data.get("mode", "text_to_flowchart")
+    # The mode comes from the client, so it is only used as a label once checked
+    label = mode_label(mode)
+    # Results go to the whole room; progress and errors only to the requester
+    room = request_room(connection, parsed_data)
+    
+    async def report_queue_position(position: int, estimated_wait: float) -> None:
+        await connection.send_json({
+            "type": "queued",
+            "request_id": request_id,
+            "position": position,
+            "estimated_wait": round(estimated_wait, 1)
+        })
+    
+    # Let the inference scheduler know who this request belongs to
+    scheduler_client.set((connection.id, report_queue_position))
+    
+    # Past the deadline the request is cancelled like one the client gave up
+    # on, which also abandons its queue slot or upstream generation
+    timeout = request_timeout(parsed_data)
+    task = asyncio.current_task()
+    expired = False
+    
+    def expire() -> None:
+        nonlocal expired
+        expired = True
+        task.cancel()
+    
+    timer = asyncio.get_running_loop().call_later(timeout, expire) if timeout else None
+    
+    requests_total.inc(mode=label)
+    requests_in_flight.inc()
+    try:
+        # Send processing notification; edits are answered right away
+        if mode != EDIT_MODE:
+            await connection.send_json({
+                "type": "processing",
+                "request_id": request_id,
+                "message": "Processing your request..."
+            })
+        
+        response_id = str(uuid.uuid4())
+        if mode == REFINE_MODE or mode == EDIT_MODE:
+            diagram = diagram_store.get(str(parsed_data.get("diagram_id", "")))
+            if mode == REFINE_MODE:
+                llm_response, ops = await refine_diagram(diagram, prompt)
+            else:
+                ops = await edit_diagram(diagram, parsed_data.get("edits") or [])
+                # The JSON is only rebuilt from the layout when the client asks for it
+                llm_response = diagram.layout.to_data() if parsed_data.get("include_text") else None
+            text = llm_response.to_dict() if parsed_data.get("include_text") else None
+            await send_delta(connection, room, request_id, response_id, diagram.id, ops, text)
+            responses_total.inc(mode=label)
+            return
+        
+        # Generate shapes based on the LLM response
+        diagram_type, generator = DIAGRAM_MODES.get(mode, DEFAULT_MODE)
+        namespace = diagram_namespace(response_id)
+        if parsed_data.get("stream"):
+            llm_response, shapes = await stream_diagram(
+                connection, room, request_id, response_id, prompt, diagram_type, generator, namespace
+            )
+        else:
+            llm_response = await get_llm_response(prompt, diagram_type)
+            shapes = await cached_layout(generator, llm_response, namespace)
+        
+        # Send the response back to the client; the raw LLM output only when asked for
+        message = {
+            "type": "response",
+            "id": response_id,
+            "request_id": request_id,
+        }
+        if room is not None:
+            message["room"] = room
+        if isinstance(llm_response, DiagramModel):
+            # Keep structured diagrams so they can be refined with deltas later
+            diagram_store.put(Diagram(response_id, mode, diagram_type, namespace, llm_response))
+            message["diagram_id"] = response_id
+        if parsed_data.get("include_text"):
+            message["text"] = llm_response.to_dict() if isinstance(llm_response, DiagramModel) else llm_response
+        # Encoded once however many members the room has
+        with time_stage("serialize"):
+            frame = encode_frame(message, shapes)
+        await connection.share_frame(room, frame)
+        responses_total.inc(mode=label)
+    
+    except asyncio.CancelledError:
+        if not expired:
+            reason = "disconnected" if connection.closed else "cancelled"
+            logger.info(f"Request {request_id} on {connection.id} was {reason}")
+            errors_total.inc(mode=label, error=reason)
+            raise
+        logger.warning(f"Request {request_id} from {connection.id} passed its {timeout:g}s deadline")
+        errors_total.inc(mode=label, error="deadline_exceeded")
+        if not connection.closed:
+            await connection.send_json({
+                "type": "error",
+                "request_id": request_id,
+                "code": "deadline_exceeded",
+                "message": f"The request did not finish within {timeout:g} seconds, please try again"
+            })
+    except QueueFullError as e:
+        logger.warning(f"Rejected request {request_id} from {connection.id}: {e}")
+        errors_total.inc(mode=label, error="queue_full")
+        await connection.send_json({
+            "type": "error",
+            "request_id": request_id,
+            "code": "queue_full",
+            "message": "The server is busy, please try again shortly"
+        })
+    except UnknownDiagramError as e:
+        logger.warning(f"Cannot refine for {connection.id}: {e}")
+        errors_total.inc(mode=label, error="unknown_diagram")
+        await connection.send_json({
+            "type": "error",
+            "request_id": request_id,
+            "code": "unknown_diagram",
+            "message": "That diagram is no longer available to refine, please generate it again"
+        })
+    except LayoutEditError as e:
+        logger.warning(f"Rejected edit {request_id} from {connection.id}: {e}")
+        errors_total.inc(mode=label, error="invalid_edit")
+        if e.ops:
+            # The edits before the invalid one were applied; keep the client in step
+            await send_delta(
+                connection, room, request_id, str(uuid.uuid4()), str(parsed_data.get("diagram_id", "")), e.ops
+            )
+        await connection.send_json({
+            "type": "error",
+            "request_id": request_id,
+            "code": "invalid_edit",
+            "message": str(e)
+        })
+    except LLMError as e:
+        logger.warning(f"LLM failed request {request_id} from {connection.id}: {e}")
+        errors_total.inc(mode=label, error="llm_error")
+        if not connection.closed:
+            await connection.send_json({
+                "type": "error",
+                "request_id": request_id,
+                "code": "llm_error",
+                "message": str(e)
+            })
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        errors_total.inc(mode=label, error=error_label(e))
+        if not connection.closed:
+            await connection.send_json({
+                "type": "error",
+                "request_id": request_id,
+                "message": f"Error: {str(e)}"
+            })
+    finally:
+        if timer is not None:
+            timer.cancel()
+        requests_in_flight.dec()
+
+def mode_label(mode: Any) -> str:
+    """The request mode as a metric label, from a fixed set however many modes clients invent"""
+    if mode is None:
+        return "text_to_flowchart"
+    return mode if isinstance(mode, str) and mode in METRIC_MODES else "unknown"
+
+def error_label(error: BaseException) -> str:
+    """The type of an unexpected error as a metric label, from the fixed set METRIC_ERRORS"""
+    for error_type in METRIC_ERRORS:
+        if isinstance(error, error_type):
+            return error_type.__name__
+    return "internal"
+
+def request_timeout(parsed_data: Dict[str, Any]) -> Optional[float]:
+    """Seconds a request may take: REQUEST_TIMEOUT, or less if the client asks for it; None for no limit"""
+    timeout = REQUEST_TIMEOUT if REQUEST_TIMEOUT > 0 else None
+    try:
+        requested = float(parsed_data.get("timeout") or 0)
+    except (TypeError, ValueError):
+        requested = 0
+    if requested > 0:
+        timeout = min(timeout, requested) if timeout else requested
+    return timeout
+
+async def stream_diagram(
+    connection: ClientConnection,
+    room: Optional[str],
+    request_id: str,
+    response_id: str,
+    prompt: str,
+    diagram_type: str,
+    generator: Callable[[Any, str], List[Shape]],
+    namespace: str,
+) -> Tuple[Any, bytes]:
+    """
+    Stream the LLM output and push partial shapes as diagram objects complete,
+    at most one frame every STREAM_PARTIAL_INTERVAL seconds.
+    
+    Returns:
+        The parsed LLM response and the final shapes, encoded as a JSON array
+    """
+    # A cached response is complete already, so there is nothing to stream
+    cached_response = await get_cached_llm_response(prompt, diagram_type)
+    if cached_response is not None:
+        return cached_response, await cached_layout(generator, cached_response, namespace)
+    
+    diagram = ProgressiveDiagram()
+    changed = False
+    # Counted from when the last partial went out, so slow layouts space them out further
+    next_partial = 0.0
+    async for chunk in stream_llm_response(prompt, diagram_type):
+        changed = diagram.feed(chunk) or changed
+        if changed and time.perf_counter() >= next_partial:
+            changed = False
+            partial = load_diagram(diagram.snapshot(), diagram_type)
+            if partial is None:
+                continue
+            partial_shapes = await run_layout(generator, partial, namespace)
+            message = {
+                "type": "partial",
+                "id": response_id,
+                "request_id": request_id,
+                "shapes": partial_shapes
+            }
+            if room is not None:
+                message["room"] = room
+            with time_stage("serialize"):
+                frame = encode_frame(message)
+            await connection.share_frame(room, frame)
+            next_partial = time.perf_counter() + STREAM_PARTIAL_INTERVAL
+    
+    # The stream parser has already decoded the JSON when it was complete
+    llm_response = load_diagram(diagram.parser.result, diagram_type) if diagram.parser.result else None
+    observe_stage("parse", diagram.parse_seconds)
+    if llm_response is None or llm_response.problem() is not None:
+        llm_response = await validate_llm_response(diagram.text, diagram_type)
+    cache_llm_response(prompt, diagram_type, llm_response)
+    record_llm_outcome(prompt, diagram_type, llm_response)
+    return llm_response, await cached_layout(generator, llm_response, namespace)
+
+async def send_delta(
+    connection: ClientConnection,
+    room: Optional[str],
+    request_id: str,
+    response_id: str,
+    diagram_id: str,
+    ops: List[Dict[str, Any]],
+    text: Optional[Any] = None,
+) -> None:
+    """Send the shape operations that bring the clients' copies of a diagram up to date"""
+    message = {
+        "type": "delta",
+        "id": response_id,
+        "request_id": request_id,
+        "diagram_id": diagram_id,
+        "ops": ops,
+    }
+    if room is not None:
+        message["room"] = room
+    if text is not None:
+        message["text"] = text
+    with time_stage("serialize"):
+        frame = encode_frame(message)
+    await connection.share_frame(room, frame)
+
+def diagram_layout(diagram: Diagram) -> Optional[FlowchartLayout]:
+    """The editable layout of a flowchart-like diagram, built on first use; None for other diagrams"""
+    if diagram.layout is None:
+        _, generator = DIAGRAM_MODES.get(diagram.mode, DEFAULT_MODE)
+        if generator not in FLOWCHART_LAYOUTS:
+            return None
+        theme, layered = FLOWCHART_LAYOUTS[generator]
+        try:
+            with time_stage("layout"):
+                diagram.layout = FlowchartLayout(diagram.llm_response, diagram.namespace, theme, layered)
+        except Exception as e:
+            logger.warning(f"Diagram {diagram.id} cannot be laid out incrementally: {e}")
+            return None
+    return diagram.layout
+
+async def refine_diagram(diagram: Diagram, prompt: str) -> Tuple[DiagramModel, List[Dict[str, Any]]]:
+    """
+    Apply a change request to a stored diagram.
+    
+    Returns:
+        The updated LLM response and the create/update/delete operations
+        that turn the previous shapes into the new ones
+    """
+    _, generator = DIAGRAM_MODES.get(diagram.mode, DEFAULT_MODE)
+    async with diagram.lock:
+        layout = diagram_layout(diagram)
+        if layout is None and diagram.shapes is None:
+            diagram.shapes = index_shapes(await run_layout(generator, diagram.llm_response, diagram.namespace))
+        
+        # Edits may have changed a laid out diagram since it was generated
+        current = layout.to_data() if layout is not None else diagram.llm_response
+        llm_response = await get_llm_response(prompt, diagram.diagram_type, current=current)
+        if not isinstance(llm_response, DiagramModel):
+            raise ValueError("The model did not return an updated diagram")
+        
+        if layout is not None:
+            # Only the nodes and connections that changed are laid out again
+            with time_stage("layout"):
+                ops = layout.apply(graph_edits(current, llm_response))
+            layout.description = llm_response.description or layout.description
+            diagram.llm_response = llm_response
+            return llm_response, ops
+        
+        shapes = index_shapes(await run_layout(generator, llm_response, diagram.namespace))
+        ops = diff_shapes(diagram.shapes, shapes)
+        diagram.llm_response = llm_response
+        diagram.shapes = shapes
+    return llm_response, ops
+
+async def edit_diagram(diagram: Diagram, edits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Apply graph edits to a stored flowchart, keeping the nodes they do not touch in place.
+    
+    Returns:
+        The create/update/delete operations for the shapes that changed
+    """
+    async with diagram.lock:
+        layout = diagram_layout(diagram)
+        if layout is None:
+            raise ValueError("Only flowcharts and process diagrams can be edited")
+        with time_stage("layout"):
+            return layout.apply(edits)
 
 @app.get("/")
 async def root():
     return {"message": "TLDraw AI Backend is running"}
 
+# Gauges and counters read from live state when /metrics is scraped
+registry.register(Gauge(
+    "tldraw_active_connections", "Open WebSocket connections",
+    callback=lambda: {(): len(message_bus.connections)},
+))
+registry.register(Counter(
+    "tldraw_bus_frames_total", "Frames through the message bus: published, written to sockets, failed to write, or lost between workers",
+    ["result"],
+    callback=lambda: {
+        ("published",): message_bus.published,
+        ("delivered",): message_bus.delivered,
+        ("failed",): message_bus.failed,
+        ("dropped",): message_bus.dropped,
+    },
+))
+registry.register(Gauge(
+    "tldraw_scheduler_slots", "Inference scheduler slots by state", ["state"],
+    callback=lambda: {("active",): scheduler.active, ("queued",): scheduler.queued},
+))
+registry.register(Counter(
+    "tldraw_scheduler_rejected_total", "Requests rejected because the inference queue was full",
+    callback=lambda: {(): scheduler.rejected},
+))
+registry.register(Counter(
+    "tldraw_llm_generations_total", "LLM calls, by whether they started an upstream generation or joined one",
+    ["kind"],
+    callback=lambda: {(kind,): count for kind, count in coalescing_stats.items()},
+))
+registry.register(Gauge(
+    "tldraw_llm_backend_outstanding", "Generations in flight on each Ollama backend", ["backend"],
+    callback=lambda: {(backend.name,): backend.outstanding for backend in backend_pool.backends},
+))
+registry.register(Gauge(
+    "tldraw_llm_backend_available", "Whether each Ollama backend is healthy and not ejected", ["backend"],
+    callback=lambda: {(backend.name,): int(backend.available()) for backend in backend_pool.backends},
+))
+registry.register(Counter(
+    "tldraw_llm_backend_requests_total", "Requests sent to each Ollama backend, by result", ["backend", "result"],
+    callback=lambda: {
+        (backend.name, result): getattr(backend, result)
+        for backend in backend_pool.backends
+        for result in ("successes", "errors")
+    },
+))
+registry.register(Counter(
+    "tldraw_llm_failovers_total", "LLM calls retried on another backend after one failed",
+    callback=lambda: {(): backend_pool.failovers},
+))
+registry.register(Counter(
+    "tldraw_llm_cancelled_generations_total",
+    "LLM generations abandoned because their clients disconnected, cancelled or passed their deadline",
+    callback=lambda: {(): cancel_stats["generations"]},
+))
+registry.register(Counter(
+    "tldraw_llm_wasted_seconds_total", "Seconds Ollama backends spent on generations that were abandoned",
+    callback=lambda: {(): cancel_stats["wasted_seconds"]},
+))
+registry.register(Counter(
+    "tldraw_llm_invalid_outputs_total", "LLM generations whose JSON did not validate against the diagram schema",
+    callback=lambda: {(): repair_stats["invalid"]},
+))
+registry.register(Counter(
+    "tldraw_llm_repairs_total", "Repair requests for invalid generations, by whether they produced a usable diagram",
+    ["result"],
+    callback=lambda: {("repaired",): repair_stats["repaired"], ("failed",): repair_stats["unrepaired"]},
+))
+registry.register(Counter(
+    "tldraw_llm_user_retries_total", "Requests repeating one that recently returned an unusable diagram",
+    callback=lambda: {(): repair_stats["user_retries"]},
+))
+registry.register(Counter(
+    "tldraw_llm_prompt_evals_total", "Finished LLM generations whose prompt evaluation Ollama reported",
+    callback=lambda: {(): prompt_stats["generations"]},
+))
+registry.register(Counter(
+    "tldraw_llm_prompt_tokens_total",
+    "Prompt tokens Ollama evaluated, and those it reused from its prompt cache",
+    ["kind"],
+    callback=lambda: {("evaluated",): prompt_stats["evaluated_tokens"], ("reused",): prompt_stats["reused_tokens"]},
+))
+registry.register(Counter(
+    "tldraw_llm_prompt_eval_saved_seconds_total",
+    "Prompt evaluation time Ollama's prompt cache saved, at the average evaluation speed",
+    callback=lambda: {(): prompt_stats["saved_seconds"]},
+))
+registry.register(Counter(
+    "tldraw_cache_lookups_total", "Cache lookups by cache level and result", ["cache", "result"],
+    callback=lambda: {
+        (cache.name, result): getattr(cache, result)
+        for cache in (llm_cache, layout_cache, route_cache)
+        for result in ("hits", "disk_hits", "misses")
+    },
+))
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return get_cache_stats()
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return {
+        **scheduler.stats(),
+        "coalescing": coalescing_stats,
+        "cancellations": cancel_stats,
+        "repairs": repair_stats,
+        "prompt_eval": prompt_eval_summary(),
+        "llm_backends": backend_pool.stats(),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
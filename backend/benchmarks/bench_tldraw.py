@@ -0,0 +1,182 @@
+# backend/benchmarks/bench_tldraw.py
+"""
+Microbenchmarks for the layout generators in services/tldraw.py.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_tldraw --output results.json
+    python -m benchmarks.bench_tldraw --baseline results.json --threshold 0.2
+
+Each case measures wall time (median and best of several runs), peak memory
+with tracemalloc, and the size of the generated shapes. Every run starts with
+an empty edge route cache, so repeats measure cold layouts like the first. With --baseline the
+run exits non-zero if any case got slower or larger by more than the threshold.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks import synthetic
+from models.diagram import load_diagram
+from services.cache import route_cache
+from services.shapes import encode_shape
+from services.tldraw import (
+    generate_flowchart, generate_layered_flowchart, generate_process_diagram, generate_layered_process_diagram,
+    generate_mind_map, generate_radial_mind_map
+)
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+# name -> (generator, input builder, diagram type the JSON is validated as)
+CASES: Dict[str, Tuple[Callable[[Any], List[Any]], Callable[[int, int], Any], str]] = {
+    "flowchart": (generate_flowchart, synthetic.make_flowchart, "flowchart"),
+    "flowchart_dense": (generate_flowchart, synthetic.make_dense_flowchart, "flowchart"),
+    "flowchart_layered": (generate_layered_flowchart, synthetic.make_flowchart, "flowchart"),
+    "flowchart_dense_layered": (generate_layered_flowchart, synthetic.make_dense_flowchart, "flowchart"),
+    "process": (generate_process_diagram, synthetic.make_process, "process"),
+    "process_layered": (generate_layered_process_diagram, synthetic.make_process, "process"),
+    "mind_map": (generate_mind_map, synthetic.make_mind_map, "mindmap"),
+    "mind_map_deep": (generate_mind_map, synthetic.make_deep_mind_map, "mindmap"),
+    "mind_map_wide": (generate_mind_map, synthetic.make_wide_mind_map, "mindmap"),
+    "mind_map_radial": (generate_radial_mind_map, synthetic.make_mind_map, "mindmap"),
+    "mind_map_deep_radial": (generate_radial_mind_map, synthetic.make_deep_mind_map, "mindmap"),
+    "mind_map_wide_radial": (generate_radial_mind_map, synthetic.make_wide_mind_map, "mindmap"),
+    "flowchart_text": (generate_flowchart, synthetic.make_flowchart_text, "flowchart"),
+    "mind_map_text": (generate_mind_map, synthetic.make_mind_map_text, "mindmap"),
+}
+
+def measure(generator: Callable[[Any], List[Any]], data: Any, repeat: int) -> Dict[str, Any]:
+    """
+    Time a generator on one input and record its memory use and output size.
+
+    Args:
+        generator: The shape generator to measure
+        data: The input passed to the generator
+        repeat: Number of timed runs
+
+    Returns:
+        A dict of measurements
+    """
+    timings = []
+    shapes: List[Any] = []
+    for _ in range(repeat):
+        # Otherwise every repeat after the first reuses the routes the first one cached
+        route_cache.clear()
+        start = time.perf_counter()
+        shapes = generator(data)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate run because tracing slows everything down
+    route_cache.clear()
+    tracemalloc.start()
+    generator(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    encoded = json.dumps(shapes, default=encode_shape)
+    return {
+        "wall_ms_median": statistics.median(timings) * 1000,
+        "wall_ms_min": min(timings) * 1000,
+        "peak_kib": peak / 1024,
+        "shapes": len(shapes),
+        "output_bytes": len(encoded.encode("utf-8")),
+    }
+
+def run(case_names: List[str], sizes: List[int], repeat: int, seed: int) -> Dict[str, Any]:
+    results = []
+    for name in case_names:
+        generator, builder, diagram_type = CASES[name]
+        for size in sizes:
+            data = builder(size, seed)
+            # The generators take validated diagrams, as parsed from the LLM output
+            if isinstance(data, dict):
+                data = load_diagram(data, diagram_type)
+            # Fewer repeats for the largest inputs keeps the full suite quick
+            runs = max(1, repeat if size <= 1000 else repeat // 3)
+            result = {"case": name, "size": size, **measure(generator, data, runs)}
+            results.append(result)
+            print(
+                f"{name:<24} {size:>6}  {result['wall_ms_median']:>10.2f} ms  "
+                f"{result['peak_kib']:>10.1f} KiB  {result['shapes']:>7} shapes  "
+                f"{result['output_bytes']:>10} bytes",
+                file=sys.stderr,
+            )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+            min_delta_ms: float = 0.5) -> List[str]:
+    """
+    Compare a run against a stored baseline, using the best wall time to damp noise.
+
+    Timing changes smaller than min_delta_ms are ignored, since sub-millisecond
+    cases are dominated by noise.
+
+    Returns:
+        A list of human-readable regressions; empty when nothing regressed
+    """
+    previous = {(r["case"], r["size"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get((result["case"], result["size"]))
+        if before is None:
+            continue
+        for metric in ("wall_ms_min", "peak_kib", "output_bytes"):
+            old, new = before.get(metric), result[metric]
+            if metric == "wall_ms_min" and new - (old or 0) < min_delta_ms:
+                continue
+            if old and new > old * (1 + threshold):
+                regressions.append(
+                    f"{result['case']}[{result['size']}] {metric}: {old:.2f} -> {new:.2f} "
+                    f"(+{(new / old - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the TLDraw layout generators")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results stored by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed relative slowdown or growth before a case counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="Ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    results = run(args.cases, args.sizes, args.repeat, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
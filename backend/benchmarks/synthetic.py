@@ -0,0 +1,140 @@
+# backend/benchmarks/synthetic.py
+"""
+Seeded synthetic diagram data in the same JSON shape the LLM prompts ask for.
+"""
+import random
+from typing import Any, Dict, List
+
+NODE_TYPES = ["process", "process", "process", "decision", "input"]
+COLORS = ["blue", "green", "red", "yellow", "purple", "orange", "teal", "pink"]
+WORDS = [
+    "validate", "user", "input", "check", "payment", "send", "email", "update",
+    "record", "approve", "request", "review", "order", "ship", "notify", "store",
+]
+
+def _text(rng: random.Random, words: int = 3) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+def make_flowchart(num_nodes: int, seed: int = 0, extra_edges: float = 0.2) -> Dict[str, Any]:
+    """
+    Flowchart JSON with a start node, an end node and a chain of steps between them.
+
+    Args:
+        num_nodes: Total number of nodes
+        seed: Random seed
+        extra_edges: Additional random connections per node, on top of the main chain
+    """
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(num_nodes):
+        if i == 0:
+            node_type = "start"
+        elif i == num_nodes - 1:
+            node_type = "end"
+        else:
+            node_type = rng.choice(NODE_TYPES)
+        text = _text(rng) + ("?" if node_type == "decision" else "")
+        nodes.append({"id": str(i + 1), "text": text, "type": node_type})
+
+    connections = [{"from": str(i + 1), "to": str(i + 2), "label": ""} for i in range(num_nodes - 1)]
+    for _ in range(int(num_nodes * extra_edges)):
+        a, b = rng.randrange(num_nodes), rng.randrange(num_nodes)
+        if a != b:
+            label = rng.choice(["Yes", "No", ""])
+            connections.append({"from": str(a + 1), "to": str(b + 1), "label": label})
+
+    return {"title": "Synthetic flowchart", "description": f"{num_nodes} nodes", "nodes": nodes, "connections": connections}
+
+def make_dense_flowchart(num_nodes: int, seed: int = 0) -> Dict[str, Any]:
+    """Flowchart with several connections per node"""
+    return make_flowchart(num_nodes, seed, extra_edges=3.0)
+
+def make_process(num_steps: int, seed: int = 0, steps_per_phase: int = 5) -> Dict[str, Any]:
+    """Process diagram JSON with steps grouped into phases and chained in order"""
+    rng = random.Random(seed)
+    phases: List[Dict[str, Any]] = []
+    step_ids: List[str] = []
+    for i in range(num_steps):
+        phase_index = i // steps_per_phase
+        if phase_index == len(phases):
+            phases.append({"name": f"Phase {phase_index + 1}: {_text(rng, 1)}", "steps": []})
+        step_id = f"{phase_index + 1}.{i % steps_per_phase + 1}"
+        step_type = rng.choice(NODE_TYPES + ["document"])
+        phases[-1]["steps"].append({"id": step_id, "text": _text(rng), "type": step_type})
+        step_ids.append(step_id)
+
+    connections = [{"from": a, "to": b, "label": ""} for a, b in zip(step_ids, step_ids[1:])]
+    return {"title": "Synthetic process", "description": f"{num_steps} steps", "phases": phases, "connections": connections}
+
+def make_mind_map(num_nodes: int, seed: int = 0, branching: int = 5, depth: int = 2,
+                  cross_connections: float = 0.05) -> Dict[str, Any]:
+    """
+    Mind map JSON with about num_nodes nodes below the central node.
+
+    Args:
+        num_nodes: Approximate number of nodes below the central node
+        seed: Random seed
+        branching: Number of main branches
+        depth: Levels per branch, counting the branch itself; deeper levels nest under "nodes"
+        cross_connections: Cross-connections per node
+    """
+    rng = random.Random(seed)
+    branching = max(1, min(branching, num_nodes))
+    all_ids: List[str] = []
+    counter = [0]
+
+    def make_node(prefix: str, level: int, budget: int, color: str) -> Dict[str, Any]:
+        counter[0] += 1
+        node_id = f"{prefix}.{counter[0]}"
+        all_ids.append(node_id)
+        node: Dict[str, Any] = {"id": node_id, "text": _text(rng, 2), "color": color}
+        remaining = budget - 1
+        if remaining > 0 and level < depth - 1:
+            # The last level holds all remaining nodes as leaves
+            fanout = remaining if level == depth - 2 else max(1, min(remaining, rng.randint(2, 4)))
+            share, extra = divmod(remaining, fanout)
+            node["nodes"] = [
+                make_node(node_id, level + 1, share + (1 if i < extra else 0), color)
+                for i in range(fanout)
+            ]
+        return node
+
+    per_branch, extra = divmod(num_nodes, branching)
+    branches = []
+    for i in range(branching):
+        color = COLORS[i % len(COLORS)]
+        branches.append(make_node(f"branch{i + 1}", 0, per_branch + (1 if i < extra else 0), color))
+
+    connections = []
+    for _ in range(int(num_nodes * cross_connections)):
+        a, b = rng.choice(all_ids), rng.choice(all_ids)
+        if a != b:
+            connections.append({"from": a, "to": b, "label": _text(rng, 1)})
+
+    return {
+        "title": "Synthetic mind map",
+        "description": f"{num_nodes} nodes",
+        "centralNode": {"id": "center", "text": "Central concept", "color": "blue"},
+        "branches": branches,
+        "connections": connections,
+    }
+
+def make_deep_mind_map(num_nodes: int, seed: int = 0) -> Dict[str, Any]:
+    """Few branches, many levels"""
+    return make_mind_map(num_nodes, seed, branching=3, depth=6)
+
+def make_wide_mind_map(num_nodes: int, seed: int = 0) -> Dict[str, Any]:
+    """Many branches with one level of sub-topics each"""
+    return make_mind_map(num_nodes, seed, branching=max(1, num_nodes // 4), depth=2)
+
+def make_flowchart_text(num_lines: int, seed: int = 0) -> str:
+    """Free-form text for the regex flowchart fallback"""
+    rng = random.Random(seed)
+    return "\n".join(f"Step: {_text(rng, 4)}" for _ in range(num_lines))
+
+def make_mind_map_text(num_lines: int, seed: int = 0) -> str:
+    """Free-form text for the regex mind map fallback"""
+    rng = random.Random(seed)
+    lines = [f"Central concept: {_text(rng, 2)}"]
+    lines += [f"- {_text(rng, 3)}" for _ in range(num_lines - 1)]
+    return "\n".join(lines)
@@ -0,0 +1,220 @@
+# backend/loadtest/mock_ollama.py
+"""
+A local stand-in for Ollama's /api/generate and /api/tags endpoints, for load
+testing without a model.
+
+Run from the backend directory, then point the app at it with OLLAMA_URLS:
+
+    python -m loadtest.mock_ollama --port 11435 --ttft 0.3 --tokens-per-second 80
+    OLLAMA_URLS=http://localhost:11435 uvicorn app:app
+
+Start several on different ports and list them all in OLLAMA_URLS to test the
+backend pool. POST /admin/down and /admin/up take a mock out of service and
+back (generations fail and its health check reports the error), e.g.
+
+    curl -X POST localhost:11435/admin/down
+
+Responses are canned flowchart, process or mind map JSON picked from the prompt
+text, delivered at the configured speed in streaming or non-streaming form.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CANNED_RESPONSES: Dict[str, Dict[str, Any]] = {
+    "flowchart": {
+        "title": "User Login Flow",
+        "description": "How a user signs in",
+        "nodes": [
+            {"id": "1", "text": "Start", "type": "start"},
+            {"id": "2", "text": "Enter credentials", "type": "input"},
+            {"id": "3", "text": "Validate credentials", "type": "process"},
+            {"id": "4", "text": "Credentials valid?", "type": "decision"},
+            {"id": "5", "text": "Show error", "type": "process"},
+            {"id": "6", "text": "Open dashboard", "type": "process"},
+            {"id": "7", "text": "End", "type": "end"},
+        ],
+        "connections": [
+            {"from": "1", "to": "2", "label": ""},
+            {"from": "2", "to": "3", "label": ""},
+            {"from": "3", "to": "4", "label": ""},
+            {"from": "4", "to": "6", "label": "Yes"},
+            {"from": "4", "to": "5", "label": "No"},
+            {"from": "5", "to": "2", "label": ""},
+            {"from": "6", "to": "7", "label": ""},
+        ],
+    },
+    "process": {
+        "title": "Project Plan",
+        "description": "Phases of a small project",
+        "phases": [
+            {"name": "Phase 1: Planning", "steps": [
+                {"id": "1.1", "text": "Define requirements", "type": "process"},
+                {"id": "1.2", "text": "Establish timeline", "type": "process"},
+            ]},
+            {"name": "Phase 2: Execution", "steps": [
+                {"id": "2.1", "text": "Implementation", "type": "process"},
+                {"id": "2.2", "text": "Quality approved?", "type": "decision"},
+            ]},
+            {"name": "Phase 3: Delivery", "steps": [
+                {"id": "3.1", "text": "Release", "type": "process"},
+                {"id": "3.2", "text": "Write handover notes", "type": "document"},
+            ]},
+        ],
+        "connections": [
+            {"from": "1.1", "to": "1.2", "label": ""},
+            {"from": "1.2", "to": "2.1", "label": ""},
+            {"from": "2.1", "to": "2.2", "label": ""},
+            {"from": "2.2", "to": "2.1", "label": "No"},
+            {"from": "2.2", "to": "3.1", "label": "Yes"},
+            {"from": "3.1", "to": "3.2", "label": ""},
+        ],
+    },
+    "mindmap": {
+        "title": "Machine Learning",
+        "description": "Main areas of machine learning",
+        "centralNode": {"id": "center", "text": "Machine Learning", "color": "blue"},
+        "branches": [
+            {"id": "branch1", "text": "Supervised", "color": "green", "nodes": [
+                {"id": "node1.1", "text": "Classification", "color": "green"},
+                {"id": "node1.2", "text": "Regression", "color": "green"},
+            ]},
+            {"id": "branch2", "text": "Unsupervised", "color": "red", "nodes": [
+                {"id": "node2.1", "text": "Clustering", "color": "red"},
+                {"id": "node2.2", "text": "Dimensionality reduction", "color": "red"},
+            ]},
+            {"id": "branch3", "text": "Reinforcement", "color": "purple", "nodes": [
+                {"id": "node3.1", "text": "Policies", "color": "purple"},
+                {"id": "node3.2", "text": "Rewards", "color": "purple"},
+            ]},
+            {"id": "branch4", "text": "Evaluation", "color": "orange", "nodes": [
+                {"id": "node4.1", "text": "Cross-validation", "color": "orange"},
+                {"id": "node4.2", "text": "Metrics", "color": "orange"},
+            ]},
+        ],
+        "connections": [
+            {"from": "node1.1", "to": "node4.2", "label": "measured by"},
+        ],
+    },
+}
+
+def pick_response(prompt: str) -> str:
+    """Choose the canned JSON that matches the prompt template"""
+    lowered = prompt.lower()
+    if "mind map" in lowered:
+        key = "mindmap"
+    elif "process diagram" in lowered:
+        key = "process"
+    else:
+        key = "flowchart"
+    return json.dumps(CANNED_RESPONSES[key], indent=2)
+
+def tokenize(text: str, chars_per_token: int) -> List[str]:
+    return [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+
+class MockOllama:
+    """Serves /api/generate with configurable latency, speed and failure rate"""
+
+    def __init__(self, ttft: float, tokens_per_second: float, error_rate: float,
+                 chars_per_token: int, seed: int, model: str = "gemma3:1b"):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.chars_per_token = chars_per_token
+        self.rng = random.Random(seed)
+        self.model = model
+        self.down = False
+        self.requests = 0
+        self.in_flight = 0
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            if self.down:
+                return web.json_response({"error": "mock is down"}, status=503)
+            if self.rng.random() < self.error_rate:
+                await asyncio.sleep(self.ttft)
+                return web.json_response({"error": "mock failure"}, status=500)
+            if not payload.get("prompt"):
+                # Ollama only loads the model for a request without a prompt
+                return web.json_response({"model": payload.get("model", "mock"), "response": "", "done": True,
+                                          "done_reason": "load"})
+
+            # The template is in the system prompt, the request in the prompt
+            text = pick_response(payload.get("system", "") + payload.get("prompt", ""))
+            tokens = tokenize(text, self.chars_per_token)
+            delay = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+            base = {"model": payload.get("model", "mock"), "created_at": "1970-01-01T00:00:00Z"}
+
+            if not payload.get("stream", True):
+                await asyncio.sleep(self.ttft + delay * len(tokens))
+                return web.json_response({**base, "response": text, "done": True,
+                                          "eval_count": len(tokens)})
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            await asyncio.sleep(self.ttft)
+            for token in tokens:
+                line = json.dumps({**base, "response": token, "done": False}) + "\n"
+                await response.write(line.encode("utf-8"))
+                if delay:
+                    await asyncio.sleep(delay)
+            done = json.dumps({**base, "response": "", "done": True, "eval_count": len(tokens)}) + "\n"
+            await response.write(done.encode("utf-8"))
+            await response.write_eof()
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def tags(self, request: web.Request) -> web.Response:
+        if self.down:
+            return web.json_response({"error": "mock is down"}, status=503)
+        return web.json_response({"models": [{"name": self.model, "model": self.model}]})
+
+    async def set_down(self, request: web.Request) -> web.Response:
+        self.down = request.match_info["state"] == "down"
+        logger.info(f"Mock Ollama is {'down' if self.down else 'up'}")
+        return web.json_response({"down": self.down})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "in_flight": self.in_flight, "down": self.down})
+
+def create_app(ttft: float = 0.2, tokens_per_second: float = 100.0, error_rate: float = 0.0,
+               chars_per_token: int = 4, seed: int = 0, model: str = "gemma3:1b") -> web.Application:
+    mock = MockOllama(ttft, tokens_per_second, error_rate, chars_per_token, seed, model)
+    app = web.Application()
+    app.router.add_post("/api/generate", mock.generate)
+    app.router.add_get("/api/tags", mock.tags)
+    app.router.add_post("/admin/{state:up|down}", mock.set_down)
+    app.router.add_get("/stats", mock.stats)
+    return app
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock Ollama server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with HTTP 500")
+    parser.add_argument("--chars-per-token", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="gemma3:1b", help="Model name listed by /api/tags")
+    args = parser.parse_args()
+
+    app = create_app(args.ttft, args.tokens_per_second, args.error_rate, args.chars_per_token, args.seed, args.model)
+    logger.info(f"Mock Ollama listening on http://{args.host}:{args.port}/api/generate")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
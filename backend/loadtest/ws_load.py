@@ -0,0 +1,203 @@
+# backend/loadtest/ws_load.py
+"""
+Load generator for the /ws endpoint.
+
+Opens N concurrent WebSocket clients, each sending prompts drawn from a
+configurable mode mix, and reports latency percentiles, throughput and error
+counts per mode. Run from the backend directory:
+
+    python -m loadtest.ws_load --url ws://localhost:8000/ws --clients 50 --requests 10 \\
+        --mix text_to_flowchart=0.5,mind_map=0.3,process_diagram=0.2 --stream 0.5
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+PROMPTS: Dict[str, List[str]] = {
+    "text_to_flowchart": ["user login flow", "password reset", "order checkout", "bug triage"],
+    "process_diagram": ["project plan", "hiring process", "release process", "onboarding"],
+    "mind_map": ["machine learning", "healthy habits", "marketing strategy", "space exploration"],
+}
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    """Parse "mode=weight,mode=weight" into a list of (mode, weight)"""
+    mix = []
+    for part in spec.split(","):
+        mode, _, weight = part.partition("=")
+        mix.append((mode.strip(), float(weight or 1)))
+    return mix
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+class LoadStats:
+    """Per-mode latency samples and outcome counters"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_shapes: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.completed: Dict[str, int] = defaultdict(int)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        modes = sorted(set(self.completed) | set(self.errors))
+        per_mode = {}
+        for mode in modes:
+            samples = self.latencies[mode]
+            first = self.first_shapes[mode]
+            per_mode[mode] = {
+                "completed": self.completed[mode],
+                "errors": dict(self.errors[mode]),
+                "throughput_rps": self.completed[mode] / elapsed if elapsed else 0.0,
+                "latency_ms": {
+                    "p50": percentile(samples, 50) * 1000,
+                    "p95": percentile(samples, 95) * 1000,
+                    "p99": percentile(samples, 99) * 1000,
+                    "max": max(samples) * 1000 if samples else 0.0,
+                },
+                "first_shapes_ms": {
+                    "p50": percentile(first, 50) * 1000,
+                    "p95": percentile(first, 95) * 1000,
+                    "p99": percentile(first, 99) * 1000,
+                },
+            }
+        total = sum(self.completed.values())
+        return {
+            "elapsed_s": elapsed,
+            "completed": total,
+            "errors": sum(sum(counts.values()) for counts in self.errors.values()),
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "modes": per_mode,
+        }
+
+async def run_client(session: aiohttp.ClientSession, url: str, requests: int, mix: List[Tuple[str, float]],
+                     stream_fraction: float, unique_fraction: float, timeout: float,
+                     rng: random.Random, stats: LoadStats) -> None:
+    modes = [mode for mode, _ in mix]
+    weights = [weight for _, weight in mix]
+    try:
+        ws = await session.ws_connect(url)
+    except aiohttp.ClientError as e:
+        stats.errors["connect"][type(e).__name__] += requests
+        return
+
+    async with ws:
+        for _ in range(requests):
+            mode = rng.choices(modes, weights)[0]
+            prompt = rng.choice(PROMPTS.get(mode, PROMPTS["text_to_flowchart"]))
+            if rng.random() < unique_fraction:
+                # Unique prompts bypass the response cache and request coalescing
+                prompt = f"{prompt} {uuid.uuid4().hex[:8]}"
+            request_id = uuid.uuid4().hex
+            message = {"prompt": prompt, "mode": mode, "request_id": request_id,
+                       "stream": rng.random() < stream_fraction}
+
+            started = time.perf_counter()
+            await ws.send_str(json.dumps(message))
+            outcome = await wait_for_result(ws, request_id, started, timeout)
+            kind, detail, first_shapes = outcome
+            if kind == "response":
+                stats.completed[mode] += 1
+                stats.latencies[mode].append(time.perf_counter() - started)
+                stats.first_shapes[mode].append(first_shapes or time.perf_counter() - started)
+            else:
+                stats.errors[mode][detail] += 1
+                if kind == "closed":
+                    return
+
+async def wait_for_result(ws: aiohttp.ClientWebSocketResponse, request_id: str, started: float,
+                          timeout: float) -> Tuple[str, str, Optional[float]]:
+    """Read frames until the request finishes; returns (kind, detail, time to first shapes)"""
+    first_shapes = None
+    deadline = started + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return "error", "timeout", first_shapes
+        try:
+            msg = await ws.receive(timeout=remaining)
+        except asyncio.TimeoutError:
+            return "error", "timeout", first_shapes
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            return "closed", "connection_closed", first_shapes
+
+        frame = json.loads(msg.data)
+        if frame.get("request_id") not in (None, request_id):
+            continue
+        frame_type = frame.get("type")
+        if frame_type == "partial" and first_shapes is None:
+            first_shapes = time.perf_counter() - started
+        elif frame_type == "response":
+            return "response", "", first_shapes
+        elif frame_type == "error":
+            return "error", frame.get("code") or "error", first_shapes
+
+async def run_load(url: str, clients: int, requests: int, mix: List[Tuple[str, float]], stream_fraction: float,
+                   unique_fraction: float, timeout: float, ramp_up: float, seed: int) -> Dict[str, Any]:
+    stats = LoadStats()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def start_client(index: int) -> None:
+            if ramp_up and clients > 1:
+                await asyncio.sleep(ramp_up * index / (clients - 1))
+            rng = random.Random(seed + index)
+            await run_client(session, url, requests, mix, stream_fraction, unique_fraction, timeout, rng, stats)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(start_client(i) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+    return stats.report(elapsed)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="WebSocket load generator for the TLDraw AI backend")
+    parser.add_argument("--url", default="ws://localhost:8000/ws")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent WebSocket clients")
+    parser.add_argument("--requests", type=int, default=5, help="Requests sent by each client, one at a time")
+    parser.add_argument("--mix", default="text_to_flowchart=0.5,mind_map=0.3,process_diagram=0.2",
+                        help="Mode weights as mode=weight,mode=weight")
+    parser.add_argument("--stream", type=float, default=0.0, help="Fraction of requests that use streaming")
+    parser.add_argument("--unique", type=float, default=1.0,
+                        help="Fraction of prompts made unique to avoid cache hits")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which clients connect")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(
+        args.url, args.clients, args.requests, parse_mix(args.mix), args.stream,
+        args.unique, args.timeout, args.ramp_up, args.seed,
+    ))
+
+    for mode, result in report["modes"].items():
+        latency = result["latency_ms"]
+        print(
+            f"{mode:<18} ok={result['completed']:<6} errors={sum(result['errors'].values()):<5} "
+            f"p50={latency['p50']:.0f}ms p95={latency['p95']:.0f}ms p99={latency['p99']:.0f}ms "
+            f"{result['throughput_rps']:.2f} req/s",
+            file=sys.stderr,
+        )
+    print(f"total: {report['completed']} ok, {report['errors']} errors, "
+          f"{report['throughput_rps']:.2f} req/s in {report['elapsed_s']:.1f}s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0 if report["errors"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+# backend/models/backends.py
+"""
+Pool of Ollama servers that LLM calls are spread over.
+
+Each call goes to the available backend with the fewest requests in flight,
+and no backend is given more than its own concurrency limit. A backend is
+unavailable while its last health check failed (GET /api/tags, which also
+tells whether it has the model) or while it is ejected after several
+failures in a row. When every backend is unavailable the pool routes to all
+of them anyway rather than failing every request outright.
+
+Configured with OLLAMA_URLS, a comma-separated list of server URLs, each
+optionally followed by "|<limit>" to override OLLAMA_BACKEND_CONCURRENCY:
+
+    OLLAMA_URLS="http://gpu1:11434|4,http://gpu2:11434"
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Collection, Deque, Dict, List, Optional
+
+import aiohttp
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Ollama servers; OLLAMA_URL is the single-server setting from before the pool
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
+OLLAMA_URLS = os.getenv("OLLAMA_URLS", OLLAMA_URL)
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:1B")  # Using Gemma 3 1B model
+# Generations each backend runs at once, unless its URL sets its own limit
+OLLAMA_BACKEND_CONCURRENCY = int(os.getenv("OLLAMA_BACKEND_CONCURRENCY", "2"))
+# Active health checks; an interval of 0 turns them off
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+# Failures in a row that eject a backend, and for how many seconds
+OLLAMA_MAX_FAILURES = int(os.getenv("OLLAMA_MAX_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+
+class LLMBackend:
+    """
+    One Ollama server and its routing state.
+
+    Args:
+        url: Base URL of the server; a full /api/generate URL is accepted too
+        max_concurrency: Most generations sent to it at once
+    """
+
+    def __init__(self, url: str, max_concurrency: int):
+        base_url = url.strip().rstrip("/")
+        if base_url.endswith("/api/generate"):
+            base_url = base_url[:-len("/api/generate")]
+        self.base_url = base_url
+        self.name = base_url.split("://", 1)[-1]
+        self.generate_url = f"{base_url}/api/generate"
+        self.tags_url = f"{base_url}/api/tags"
+        self.max_concurrency = max(1, max_concurrency)
+        self.outstanding = 0
+        # Result of the last health check; backends start out trusted
+        self.healthy = True
+        self.health_error = ""
+        # Failures since the last success, and until when the backend is ejected
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_used = 0.0
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+
+    def __repr__(self) -> str:
+        return f"LLMBackend({self.name!r})"
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """Healthy and not ejected"""
+        return self.healthy and self.ejected_until <= (time.monotonic() if now is None else now)
+
+    def record_success(self) -> None:
+        self.successes += 1
+        self.failures = 0
+
+    def record_failure(self, error: BaseException, max_failures: int, eject_seconds: float) -> None:
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= max_failures:
+            self.failures = 0
+            self.ejected_until = time.monotonic() + eject_seconds
+            logger.warning(
+                f"Ejecting LLM backend {self.name} for {eject_seconds:.0f}s after repeated failures: {error}"
+            )
+
+    def record_health(self, healthy: bool, error: str = "") -> None:
+        if healthy != self.healthy:
+            if healthy:
+                logger.info(f"LLM backend {self.name} is healthy again")
+            else:
+                logger.warning(f"LLM backend {self.name} failed its health check: {error}")
+        self.healthy = healthy
+        self.health_error = error
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.base_url,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "healthy": self.healthy,
+            "ejected_for": round(max(0.0, self.ejected_until - now), 1),
+            "requests": self.requests,
+            "successes": self.successes,
+            "errors": self.errors,
+        }
+
+class NoBackendError(RuntimeError):
+    """Raised when every backend has already been tried for a request"""
+
+class BackendPool:
+    """
+    Routes LLM calls to the least busy of several Ollama backends.
+
+    Args:
+        backends: The backends, at least one
+        health_interval: Seconds between health checks, 0 for none
+        health_timeout: Seconds a health check may take
+        max_failures: Failures in a row that eject a backend
+        eject_seconds: How long an ejected backend gets no requests
+        model: The model a backend must have to pass its health check
+    """
+
+    def __init__(self, backends: List[LLMBackend], health_interval: float = 10.0, health_timeout: float = 2.0,
+                 max_failures: int = 3, eject_seconds: float = 30.0, model: str = ""):
+        if not backends:
+            raise ValueError("An LLM backend pool needs at least one backend")
+        self.backends = backends
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.max_failures = max(1, max_failures)
+        self.eject_seconds = eject_seconds
+        self.model = model
+        self.failovers = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def capacity(self) -> int:
+        """Generations the whole pool runs at once"""
+        return sum(backend.max_concurrency for backend in self.backends)
+
+    @asynccontextmanager
+    async def backend(self, exclude: Collection[LLMBackend] = ()) -> AsyncIterator[LLMBackend]:
+        """
+        Hold a request slot on the best backend for the duration of the block.
+
+        An exception escaping the block counts as a failure of the backend.
+
+        Args:
+            exclude: Backends not to use, e.g. those a request already failed on
+
+        Raises:
+            NoBackendError: If every backend is excluded
+        """
+        backend = await self._acquire(exclude)
+        try:
+            yield backend
+        except Exception as e:
+            backend.record_failure(e, self.max_failures, self.eject_seconds)
+            raise
+        else:
+            backend.record_success()
+        finally:
+            backend.outstanding -= 1
+            self._wake()
+
+    def can_fail_over(self, tried: Collection[LLMBackend]) -> bool:
+        """Whether a request that failed on the tried backends has another one to go to"""
+        return len(tried) < len(self.backends)
+
+    async def _acquire(self, exclude: Collection[LLMBackend]) -> LLMBackend:
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            raise NoBackendError("Every LLM backend has been tried")
+        while True:
+            backend = self._pick(candidates)
+            if backend is not None:
+                backend.outstanding += 1
+                backend.requests += 1
+                backend.last_used = time.monotonic()
+                return backend
+            # Every usable backend is at its limit; wait for a release, or for
+            # an ejection to run out
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.eject_seconds or None)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _pick(self, candidates: List[LLMBackend]) -> Optional[LLMBackend]:
+        now = time.monotonic()
+        usable = [backend for backend in candidates if backend.available(now)]
+        if not usable:
+            # Nothing is known to work, so give them all a chance
+            usable = candidates
+        free = [backend for backend in usable if backend.outstanding < backend.max_concurrency]
+        if not free:
+            return None
+        # Fewest requests in flight, then the one that has waited longest
+        return min(free, key=lambda backend: (backend.outstanding, backend.last_used))
+
+    def _wake(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def start(self, session: aiohttp.ClientSession) -> None:
+        """Start the health checks, using the shared client session"""
+        if self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_health(session))
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    async def _check_health(self, session: aiohttp.ClientSession) -> None:
+        while True:
+            await asyncio.gather(*(self._check(session, backend) for backend in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    async def _check(self, session: aiohttp.ClientSession, backend: LLMBackend) -> None:
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.health_timeout)
+            async with session.get(backend.tags_url, timeout=timeout) as response:
+                if response.status != 200:
+                    backend.record_health(False, f"status {response.status}")
+                    return
+                tags = await response.json()
+        except Exception as e:
+            backend.record_health(False, str(e) or type(e).__name__)
+            return
+        names = {_model_name(model.get("name", "")) for model in tags.get("models") or []}
+        if self.model and _model_name(self.model) not in names:
+            backend.record_health(False, f"model {self.model} is not available")
+        else:
+            backend.record_health(True)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "capacity": self.capacity,
+            "failovers": self.failovers,
+            "backends": [backend.stats(now) for backend in self.backends],
+        }
+
+def _model_name(name: str) -> str:
+    # Ollama matches model names case-insensitively, with ":latest" as the default tag
+    name = name.lower()
+    return name if ":" in name else f"{name}:latest"
+
+def parse_backends(urls: str, default_concurrency: int) -> List[LLMBackend]:
+    """Backends from a comma-separated list of URLs, each optionally followed by |<concurrency limit>"""
+    backends = []
+    for entry in urls.split(","):
+        if not entry.strip():
+            continue
+        url, _, limit = entry.partition("|")
+        backends.append(LLMBackend(url, int(limit) if limit.strip() else default_concurrency))
+    return backends
+
+# Shared pool of the configured Ollama servers
+backend_pool = BackendPool(
+    parse_backends(OLLAMA_URLS, OLLAMA_BACKEND_CONCURRENCY),
+    OLLAMA_HEALTH_INTERVAL,
+    OLLAMA_HEALTH_TIMEOUT,
+    OLLAMA_MAX_FAILURES,
+    OLLAMA_EJECT_SECONDS,
+    OLLAMA_MODEL,
+)
@@ -0,0 +1,301 @@
+# backend/models/diagram.py
+"""
+Typed diagram models and the one step that turns LLM text into them.
+
+parse_diagram() finds the JSON object in the raw LLM output, skipping code
+fences, leading prose and trailing junk, and validates it into a Flowchart,
+ProcessDiagram or MindMap. Everything downstream (layout, caches, refinement)
+works on these models; the text is never scanned again.
+
+GENERATION_SCHEMAS holds the stricter JSON schema Ollama is asked to follow
+for each type, and validate_diagram() says what is wrong with output that
+does not fit, so the model can be asked to repair it.
+
+The models are lenient in the ways small models get the format wrong: numeric
+IDs and texts become strings, null lists become empty, and list items that are
+not objects are dropped.
+"""
+import json
+import logging
+from typing import Annotated, Any, Dict, List, Optional, Sequence, Type, Union
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, model_validator
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def _scalar_to_str(value: Any) -> Any:
+    # LLMs often write IDs as numbers ("id": 1)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+def _objects(value: Any) -> Any:
+    # A missing or null list is empty, and stray strings or numbers in it are dropped
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, (dict, BaseModel))]
+    return value
+
+Text = Annotated[Optional[str], BeforeValidator(_scalar_to_str)]
+
+class _Model(BaseModel):
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+
+class Connection(_Model):
+    """A labelled arrow between two nodes"""
+
+    source: Text = Field(None, alias="from")
+    target: Text = Field(None, alias="to")
+    label: Text = ""
+
+class FlowchartNode(_Model):
+    """A flowchart node or process step; missing IDs and texts are filled in by the layout"""
+
+    id: Text = None
+    text: Text = None
+    type: Text = "process"
+
+class DiagramModel(_Model):
+    """Base class of the validated diagrams"""
+
+    title: Text = "Diagram"
+    description: Text = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The diagram as LLM-style JSON, e.g. for caches, prompts and clients"""
+        return self.model_dump(by_alias=True, exclude_none=True)
+
+    def problem(self) -> Optional[str]:
+        """Why the diagram is unusable even though it validated, or None if it is fine"""
+        return None
+
+class Flowchart(DiagramModel):
+    title: Text = "Flowchart"
+    nodes: Annotated[List[FlowchartNode], BeforeValidator(_objects)] = []
+    connections: Annotated[List[Connection], BeforeValidator(_objects)] = []
+
+    def problem(self) -> Optional[str]:
+        return None if self.nodes else '"nodes" is missing or empty'
+
+class Phase(_Model):
+    name: Text = ""
+    steps: Annotated[List[FlowchartNode], BeforeValidator(_objects)] = []
+
+class ProcessDiagram(Flowchart):
+    """A flowchart whose steps are grouped in phases; the steps are also its nodes"""
+
+    phases: Annotated[List[Phase], BeforeValidator(_objects)] = []
+
+    @model_validator(mode="after")
+    def _steps_as_nodes(self) -> "ProcessDiagram":
+        if not self.nodes:
+            self.nodes = [step for phase in self.phases for step in phase.steps]
+        return self
+
+    def problem(self) -> Optional[str]:
+        return None if self.nodes else '"phases" is missing or has no "steps"'
+
+class MindMapNode(_Model):
+    """A branch or sub-topic; sub-topics can nest to any depth under "nodes" """
+
+    id: Text = None
+    text: Text = None
+    color: Text = None
+    nodes: Annotated[List["MindMapNode"], BeforeValidator(_objects)] = []
+
+class MindMap(DiagramModel):
+    title: Text = "Mind Map"
+    central_node: Optional[MindMapNode] = Field(None, alias="centralNode")
+    branches: Annotated[List[MindMapNode], BeforeValidator(_objects)] = []
+    connections: Annotated[List[Connection], BeforeValidator(_objects)] = []
+
+    def problem(self) -> Optional[str]:
+        if self.central_node is None and not self.branches:
+            return '"centralNode" and "branches" are missing'
+        return None
+
+MindMapNode.model_rebuild()
+
+# Model for each structured diagram type
+DIAGRAM_MODELS: Dict[str, Type[DiagramModel]] = {
+    "flowchart": Flowchart,
+    "process": ProcessDiagram,
+    "mindmap": MindMap,
+}
+# Free-form ("general") requests have no model of their own; an answer that
+# holds a JSON object is drawn as a flowchart
+DEFAULT_DIAGRAM_TYPE = "flowchart"
+
+class DiagramParseError(ValueError):
+    """
+    Raised when LLM output holds no usable diagram.
+
+    The message says what is wrong in terms the LLM can act on. If the JSON
+    validated but the diagram is empty, the diagram is kept on the error.
+    """
+
+    def __init__(self, message: str, diagram: Optional[DiagramModel] = None):
+        super().__init__(message)
+        self.diagram = diagram
+
+# Node types and colors the prompts offer
+FLOWCHART_NODE_TYPES = ("start", "end", "process", "decision", "input")
+PROCESS_STEP_TYPES = (*FLOWCHART_NODE_TYPES, "document")
+MIND_MAP_COLORS = ("blue", "green", "red", "yellow", "purple", "orange", "teal", "pink")
+
+def _string(**extra: Any) -> Dict[str, Any]:
+    return {"type": "string", **extra}
+
+def _array(items: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "array", "items": items}
+
+def _object(properties: Dict[str, Any], required: Sequence[str] = ()) -> Dict[str, Any]:
+    return {"type": "object", "properties": properties, "required": list(required or properties)}
+
+_CONNECTIONS = _array(_object({"from": _string(), "to": _string(), "label": _string()}, ("from", "to")))
+
+def _step_schema(types: Sequence[str]) -> Dict[str, Any]:
+    return _object({"id": _string(), "text": _string(), "type": _string(enum=list(types))})
+
+def _topic_schema(subtopics: bool) -> Dict[str, Any]:
+    properties = {"id": _string(), "text": _string(), "color": _string(enum=list(MIND_MAP_COLORS))}
+    if subtopics:
+        properties["nodes"] = _array(_topic_schema(False))
+    return _object(properties)
+
+# JSON schema sent to Ollama as the "format" of each structured diagram type.
+# Stricter than the models: every field is required and IDs are strings, and
+# mind maps stop at the two levels the prompt asks for, which keeps the
+# grammar Ollama builds from the schema small.
+GENERATION_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "flowchart": _object({
+        "title": _string(),
+        "description": _string(),
+        "nodes": _array(_step_schema(FLOWCHART_NODE_TYPES)),
+        "connections": _CONNECTIONS,
+    }),
+    "process": _object({
+        "title": _string(),
+        "description": _string(),
+        "phases": _array(_object({"name": _string(), "steps": _array(_step_schema(PROCESS_STEP_TYPES))})),
+        "connections": _CONNECTIONS,
+    }),
+    "mindmap": _object({
+        "title": _string(),
+        "description": _string(),
+        "centralNode": _topic_schema(False),
+        "branches": _array(_topic_schema(True)),
+        "connections": _CONNECTIONS,
+    }),
+}
+
+# Validation errors quoted in a repair request
+MAX_REPORTED_ERRORS = 5
+
+_decoder = json.JSONDecoder()
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    The first JSON object in a piece of LLM output.
+
+    Tries each '{' in turn and decodes a whole object from it, ignoring
+    whatever follows. After a failed attempt the search resumes where the
+    decoder gave up rather than inside the failed object, so the text is
+    scanned once.
+
+    Args:
+        text: The raw LLM output
+
+    Returns:
+        The decoded object, or None if the text holds no complete JSON object
+    """
+    start = text.find("{")
+    while start >= 0:
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+            return value
+        except json.JSONDecodeError as e:
+            start = text.find("{", max(start + 1, e.pos))
+    return None
+
+def load_diagram(data: Any, diagram_type: str) -> Optional[DiagramModel]:
+    """
+    Validate decoded JSON (e.g. from a cache or a stream) into the model for a diagram type.
+
+    Returns:
+        The model, or None if the data does not fit it
+    """
+    model = DIAGRAM_MODELS.get(diagram_type, DIAGRAM_MODELS[DEFAULT_DIAGRAM_TYPE])
+    if not isinstance(data, dict):
+        return None
+    try:
+        return model.model_validate(data)
+    except ValidationError as e:
+        logger.warning(f"LLM JSON does not match the {diagram_type} schema: {e.error_count()} errors")
+        return None
+
+def validate_diagram(text: str, diagram_type: str) -> DiagramModel:
+    """
+    Parse raw LLM output into a diagram, strictly.
+
+    Args:
+        text: The raw text generated by the LLM
+        diagram_type: One of the types in DIAGRAM_MODELS
+
+    Returns:
+        The diagram model
+
+    Raises:
+        DiagramParseError: If the output holds no JSON object, the object does
+            not fit the model, or the diagram has nothing to draw
+    """
+    data = extract_json(text)
+    if data is None:
+        start = text.find("{")
+        if start < 0:
+            raise DiagramParseError("The response contains no JSON object")
+        try:
+            _decoder.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            raise DiagramParseError(f"The response is not valid JSON: {e.msg} at line {e.lineno} column {e.colno}")
+        raise DiagramParseError("The response contains no complete JSON object")
+
+    try:
+        diagram = DIAGRAM_MODELS[diagram_type].model_validate(data)
+    except ValidationError as e:
+        errors = [
+            f'{".".join(str(part) for part in error["loc"]) or "the object"}: {error["msg"]}'
+            for error in e.errors()[:MAX_REPORTED_ERRORS]
+        ]
+        raise DiagramParseError(f"The JSON does not match the {diagram_type} structure: " + "; ".join(errors))
+
+    problem = diagram.problem()
+    if problem is not None:
+        raise DiagramParseError(f"The {diagram_type} has nothing to draw: {problem}", diagram)
+    return diagram
+
+def parse_diagram(text: str, diagram_type: str) -> Union[str, DiagramModel]:
+    """
+    Parse raw LLM output into a validated diagram.
+
+    Args:
+        text: The raw text generated by the LLM
+        diagram_type: The type of diagram that was requested
+
+    Returns:
+        The diagram model (a flowchart for types without a model of their
+        own), or the original text when the output holds no usable JSON
+        (generators then fall back to parsing the text as a list)
+    """
+    if diagram_type not in DIAGRAM_MODELS:
+        diagram_type = DEFAULT_DIAGRAM_TYPE
+    try:
+        return validate_diagram(text, diagram_type)
+    except DiagramParseError as e:
+        if e.diagram is not None:
+            # Valid but empty; still better drawn as is than parsed as text
+            return e.diagram
+        logger.warning(f"Could not parse LLM response as JSON, returning as text: {e}")
+        return text
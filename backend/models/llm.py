@@ -3,309 +3,849 @@ import aiohttp
 import asyncio
 import logging
 import json
-from typing import Optional, Dict, Any, Union
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Union, AsyncIterator
+
+from models.diagram import (
+    DIAGRAM_MODELS, GENERATION_SCHEMAS, DiagramModel, DiagramParseError, parse_diagram, load_diagram,
+    validate_diagram
+)
+from services.cache import llm_cache, make_cache_key
+from models.backends import OLLAMA_MODEL, LLMBackend, backend_pool
+from models.scheduler import llm_slot, QueueFullError
+from services.metrics import observe_stage, time_stage
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Ollama URL
-OLLAMA_URL = "http://localhost:11434/api/generate"
+# Ollama servers and the model are configured in models.backends
+OLLAMA_TEMPERATURE = float(os.getenv("OLLAMA_TEMPERATURE", "0.5"))  # Lower temperature for more structured output
+# How long Ollama keeps the model loaded after a request: seconds, or a duration such as "30m"
+# ("-1" keeps it loaded for good)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Load the model when the app starts instead of on the first request
+OLLAMA_WARM_UP = os.getenv("OLLAMA_WARM_UP", "1") == "1"
+# Constrain structured generations to the diagram type's JSON schema ("schema"),
+# to any JSON ("json", for Ollama versions before 0.5) or not at all ("none")
+OLLAMA_FORMAT = os.getenv("OLLAMA_FORMAT", "schema")
+
+# Repair requests made when a generation does not validate, before falling back to parsing it as text
+LLM_REPAIR_ATTEMPTS = int(os.getenv("LLM_REPAIR_ATTEMPTS", "1"))
+# Longest invalid output quoted back in a repair request that cannot continue the generation's context
+REPAIR_MAX_CHARS = int(os.getenv("REPAIR_MAX_CHARS", "4000"))
+# A request repeating one whose result was unusable this many seconds ago counts as a user retry
+LLM_RETRY_WINDOW = float(os.getenv("LLM_RETRY_WINDOW", "600"))
+
+# Connection pool settings for the shared Ollama client
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "100"))
+OLLAMA_POOL_PER_HOST = int(os.getenv("OLLAMA_POOL_PER_HOST", "16"))
+OLLAMA_KEEPALIVE_TIMEOUT = float(os.getenv("OLLAMA_KEEPALIVE_TIMEOUT", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
 
-async def get_llm_response(prompt: str, diagram_type: str = "flowchart") -> Union[str, Dict[str, Any]]:
+# Long-lived client session shared by every LLM call
+_session: Optional[aiohttp.ClientSession] = None
+
+async def init_llm_client() -> aiohttp.ClientSession:
+    """
+    Create the shared Ollama client session. Called on application startup.
+    
+    Returns:
+        The shared aiohttp session
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    
+    connector = aiohttp.TCPConnector(
+        limit=OLLAMA_POOL_SIZE,
+        limit_per_host=OLLAMA_POOL_PER_HOST,
+        keepalive_timeout=OLLAMA_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=OLLAMA_CONNECT_TIMEOUT,
+        sock_read=OLLAMA_READ_TIMEOUT,
+    )
+    _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    backend_pool.start(_session)
+    logger.info(
+        f"Ollama client ready (pool={OLLAMA_POOL_SIZE}, per_host={OLLAMA_POOL_PER_HOST}, "
+        f"connect_timeout={OLLAMA_CONNECT_TIMEOUT}s, read_timeout={OLLAMA_READ_TIMEOUT}s)"
+    )
+    return _session
+
+async def close_llm_client() -> None:
+    """Close the shared Ollama client session. Called on application shutdown."""
+    global _session
+    await backend_pool.stop()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+async def warm_up_llm() -> None:
+    """Load the model into every Ollama backend ahead of the first request, for OLLAMA_KEEP_ALIVE"""
+    session = await get_llm_session()
+    await asyncio.gather(*(_warm_up_backend(session, backend) for backend in backend_pool.backends))
+
+async def _warm_up_backend(session: aiohttp.ClientSession, backend: LLMBackend) -> None:
+    try:
+        # A generate request without a prompt only loads the model
+        payload = {"model": OLLAMA_MODEL, "prompt": "", "keep_alive": keep_alive()}
+        started = time.perf_counter()
+        async with session.post(backend.generate_url, json=payload) as response:
+            if response.status != 200:
+                logger.warning(f"Could not load {OLLAMA_MODEL} on {backend.name}: {await response.text()}")
+                return
+            await response.read()
+        logger.info(f"Loaded {OLLAMA_MODEL} on {backend.name} in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.warning(f"Could not load {OLLAMA_MODEL} on {backend.name}: {e}")
+
+async def get_llm_session() -> aiohttp.ClientSession:
+    """Get the shared Ollama client session, creating it if the app has not started it yet"""
+    if _session is None or _session.closed:
+        return await init_llm_client()
+    return _session
+
+async def get_llm_response(prompt: str, diagram_type: str = "flowchart",
+                           current: Optional[DiagramModel] = None) -> Union[str, DiagramModel]:
     """
     Get a response from the LLM (Ollama) based on the prompt and diagram type.
     
+    Identical requests that are already in flight share one upstream generation.
+    
     Args:
         prompt: The user's prompt
         diagram_type: The type of diagram to generate
+        current: An existing diagram to change as the prompt asks, instead of starting over
     
     Returns:
-        Either a JSON object (for structured responses) or a string (for text responses)
+        Either a validated diagram (for structured responses) or a string (for text responses)
+    
+    Raises:
+        LLMError: If the LLM could not produce a generation
     """
-    # Select the prompt template based on diagram type
-    if diagram_type == "flowchart":
-        enhanced_prompt = create_flowchart_prompt(prompt)
-    elif diagram_type == "process":
-        enhanced_prompt = create_process_diagram_prompt(prompt)
-    elif diagram_type == "mindmap":
-        enhanced_prompt = create_mindmap_prompt(prompt)
+    current_data = current.to_dict() if current is not None else None
+    _note_request(prompt, diagram_type, current_data)
+    cached = await get_cached_llm_response(prompt, diagram_type, current_data)
+    if cached is not None:
+        return cached
+    
+    system, user_prompt = build_prompt(prompt, diagram_type, current_data)
+    payload = build_payload(user_prompt, diagram_type, stream=False, system=system)
+    
+    key = make_cache_key(payload)
+    shared = _inflight.get(key)
+    if shared is None:
+        shared = _SharedGeneration(asyncio.create_task(_generate(payload, diagram_type)))
+        _inflight[key] = shared
+        shared.task.add_done_callback(lambda _: _forget_inflight(_inflight, key, shared))
     else:
-        enhanced_prompt = prompt
+        coalescing_stats["coalesced"] += 1
+        logger.info("Joining an identical LLM generation already in flight")
     
+    shared.waiters += 1
     try:
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "model": "gemma3:1B",  # Using Gemma 3 1B model
-                "prompt": enhanced_prompt,
-                "stream": False,
-                "temperature": 0.5,  # Lower temperature for more structured output
-            }
-            
-            async with session.post(OLLAMA_URL, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"Error from Ollama: {error_text}")
-                    return f"Error communicating with LLM: {response.status}"
-                
-                result = await response.json()
-                llm_response = result.get("response", "No response from LLM")
-                
-                # Try to parse as JSON if it looks like JSON
-                if diagram_type in ["mindmap", "flowchart", "process"] and (
-                    llm_response.strip().startswith("{") or llm_response.strip().startswith("[")
-                ):
-                    try:
-                        # Find JSON in the response (sometimes LLMs add explanatory text)
-                        json_start = llm_response.find('{')
-                        json_end = llm_response.rfind('}') + 1
-                        if json_start >= 0 and json_end > json_start:
-                            json_str = llm_response[json_start:json_end]
-                            return json.loads(json_str)
-                    except json.JSONDecodeError:
-                        logger.warning("Could not parse LLM response as JSON, returning as text")
-                
-                return llm_response
+        # Shield the shared task so cancelling this caller does not cancel it for the others
+        parsed = await asyncio.shield(shared.task)
+    finally:
+        shared.waiters -= 1
+        if shared.waiters == 0 and not shared.task.done():
+            # Nobody is waiting for the result any more
+            _forget_inflight(_inflight, key, shared)
+            shared.task.cancel()
+    
+    cache_llm_response(prompt, diagram_type, parsed, current_data)
+    record_llm_outcome(prompt, diagram_type, parsed, current_data)
+    return parsed
+
+class LLMError(RuntimeError):
+    """Raised when the LLM could not produce a generation"""
+
+class LLMStatusError(LLMError):
+    """Raised when Ollama answers a generation request with an error status"""
+
+async def _generate(payload: Dict[str, Any], diagram_type: str) -> Union[str, DiagramModel]:
+    """Run one non-streaming generation against Ollama"""
+    coalescing_stats["upstream"] += 1
+    try:
+        result = await _ollama_generate(payload)
+        return await validate_llm_response(
+            result.get("response", "No response from LLM"), diagram_type, result.get("context"), payload.get("system")
+        )
     
+    except (QueueFullError, LLMError):
+        raise
     except Exception as e:
         logger.error(f"Error calling Ollama: {e}")
-        return f"Error: {str(e)}"
+        raise LLMError(f"Error: {str(e)}") from e
 
-def create_flowchart_prompt(prompt: str) -> str:
-    """Create a prompt for flowchart generation"""
-    return f"""
-    You are a diagram generation assistant that creates structured flowcharts for TLDraw.
-    
-    TASK: Generate a flowchart based on this request: "{prompt}"
-    
-    IMPORTANT: Return your response as a JSON object with the following structure:
-    
-    {{
-        "title": "The main title of the flowchart",
-        "description": "A brief description of what this flowchart represents",
-        "nodes": [
-            {{
-                "id": "1",
-                "text": "Start",
-                "type": "start"
-            }},
-            {{
-                "id": "2",
-                "text": "Process Step 1",
-                "type": "process"
-            }},
-            {{
-                "id": "3",
-                "text": "Decision?",
-                "type": "decision"
-            }},
-            {{
-                "id": "4",
-                "text": "End",
-                "type": "end"
-            }}
-        ],
-        "connections": [
-            {{
-                "from": "1",
-                "to": "2",
-                "label": ""
-            }},
-            {{
-                "from": "2",
-                "to": "3",
-                "label": ""
-            }},
-            {{
-                "from": "3",
-                "to": "4",
-                "label": "Yes"
-            }},
-            {{
-                "from": "3",
-                "to": "2",
-                "label": "No"
-            }}
-        ]
-    }}
-    
-    NODE TYPES:
-    - "start": Oval shape representing the start of the flowchart
-    - "end": Oval shape representing the end of the flowchart
-    - "process": Rectangle shape representing a process or action
-    - "decision": Diamond shape representing a decision point (always phrase as a question)
-    - "input": Parallelogram shape representing input/output
-    
-    GUIDELINES:
-    1. Use clear, concise text for each node (under 10 words if possible)
-    2. Ensure logical flow from start to end
-    3. Decisions should always have at least two connections (typically "Yes" and "No")
-    4. All nodes must be connected
-    5. Make sure all node IDs are unique
-    
-    ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation.
+async def _ollama_generate(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Make one non-streaming /api/generate call and return Ollama's reply.
+    
+    A call that fails on one backend is retried on the next least busy one.
     """
+    session = await get_llm_session()
+    
+    # Wait for a free generation slot before calling Ollama
+    async with llm_slot():
+        started = time.perf_counter()
+        tried: List[LLMBackend] = []
+        while True:
+            try:
+                async with backend_pool.backend(exclude=tried) as backend:
+                    tried.append(backend)
+                    sent = time.perf_counter()
+                    try:
+                        async with session.post(backend.generate_url, json=payload) as response:
+                            if response.status != 200:
+                                error_text = await response.text()
+                                logger.error(f"Error from Ollama at {backend.name}: {error_text}")
+                                raise LLMStatusError(f"Error communicating with LLM: {response.status}")
+                            result = await response.json()
+                    except asyncio.CancelledError:
+                        # aiohttp closes the connection of a request cancelled
+                        # mid-flight, which stops the generation in Ollama
+                        _record_cancelled(backend, sent)
+                        raise
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, LLMStatusError) as e:
+                if not backend_pool.can_fail_over(tried):
+                    raise
+                _fail_over(tried[-1], e)
+        observe_stage("llm_total", time.perf_counter() - started)
+    record_prompt_eval(result)
+    return result
 
-def create_process_diagram_prompt(prompt: str) -> str:
-    """Create a prompt for process diagram generation"""
-    return f"""
-    You are a diagram generation assistant that creates structured process diagrams for TLDraw.
-    
-    TASK: Generate a process diagram based on this request: "{prompt}"
-    
-    IMPORTANT: Return your response as a JSON object with the following structure:
-    
-    {{
-        "title": "The main title of the process diagram",
-        "description": "A brief description of what this process represents",
-        "phases": [
-            {{
-                "name": "Phase 1: Planning",
-                "steps": [
-                    {{
-                        "id": "1.1",
-                        "text": "Define Requirements",
-                        "type": "process"
-                    }},
-                    {{
-                        "id": "1.2",
-                        "text": "Establish Timeline",
-                        "type": "process"
-                    }}
-                ]
-            }},
-            {{
-                "name": "Phase 2: Execution",
-                "steps": [
-                    {{
-                        "id": "2.1",
-                        "text": "Implementation",
-                        "type": "process"
-                    }},
-                    {{
-                        "id": "2.2",
-                        "text": "Quality approved?",
-                        "type": "decision"
-                    }}
-                ]
-            }}
-        ],
-        "connections": [
-            {{
-                "from": "1.1",
-                "to": "1.2",
-                "label": ""
-            }},
-            {{
-                "from": "1.2",
-                "to": "2.1",
-                "label": ""
-            }},
-            {{
-                "from": "2.1",
-                "to": "2.2",
-                "label": ""
-            }},
-            {{
-                "from": "2.2",
-                "to": "2.1",
-                "label": "No"
-            }}
-        ]
-    }}
-    
-    NODE TYPES:
-    - "start": Oval shape representing the start of the process
-    - "end": Oval shape representing the end of the process
-    - "process": Rectangle shape representing a process step or action
-    - "decision": Diamond shape representing a decision point (always phrase as a question)
-    - "input": Parallelogram shape representing input/output
-    - "document": Document shape representing documentation
-    
-    GUIDELINES:
-    1. Organize steps into logical phases
-    2. Use clear, concise text for each step (under 10 words if possible)
-    3. Ensure the process flows logically from start to end
-    4. Decisions should always have at least two connections (typically "Yes" and "No")
-    5. All steps must be connected
-    6. Make sure all step IDs are unique
-    
-    ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation.
+def _record_cancelled(backend: LLMBackend, sent: float) -> None:
+    """Account for a generation abandoned on a backend after it was sent"""
+    wasted = time.perf_counter() - sent
+    cancel_stats["generations"] += 1
+    cancel_stats["wasted_seconds"] += wasted
+    logger.info(f"Cancelled an LLM generation on {backend.name} after {wasted:.2f}s")
+
+def _fail_over(backend: LLMBackend, error: BaseException) -> None:
+    backend_pool.failovers += 1
+    logger.warning(f"LLM backend {backend.name} failed ({str(error) or type(error).__name__}), trying another")
+
+async def validate_llm_response(text: str, diagram_type: str, context: Optional[List[int]] = None,
+                                system: Optional[str] = None) -> Union[str, DiagramModel]:
     """
+    Parse raw LLM output, asking the LLM to repair it when it does not validate.
+    
+    At most LLM_REPAIR_ATTEMPTS repair requests are made. Each sends only the
+    validation error and continues from the generation's context, so the
+    prompt is not evaluated again; without a context the invalid output is
+    quoted back instead.
+    
+    Args:
+        text: The raw text generated by the LLM
+        diagram_type: The type of diagram that was requested
+        context: The context Ollama returned with the generation, if any
+        system: The system prompt of the generation, resent when there is no context
+    
+    Returns:
+        The diagram model, or what parse_llm_response makes of the output if
+        it could not be repaired
+    """
+    if diagram_type not in DIAGRAM_MODELS:
+        # Free-form output is not constrained to a schema, so there is nothing to repair
+        return parse_diagram(text, diagram_type)
+    
+    original = text
+    for attempt in range(LLM_REPAIR_ATTEMPTS + 1):
+        try:
+            with time_stage("parse"):
+                diagram = validate_diagram(text, diagram_type)
+            if attempt > 0:
+                repair_stats["repaired"] += 1
+                logger.info(f"LLM repaired its {diagram_type} after {attempt} attempt(s)")
+            return diagram
+        except DiagramParseError as e:
+            error = e
+        if attempt == 0:
+            repair_stats["invalid"] += 1
+        if attempt == LLM_REPAIR_ATTEMPTS:
+            break
+        
+        logger.info(f"Asking the LLM to repair its {diagram_type}: {error}")
+        try:
+            result = await _ollama_generate(_repair_payload(text, diagram_type, str(error), context, system))
+        except Exception as e:
+            logger.warning(f"Repair request failed: {e}")
+            break
+        text = result.get("response", "")
+        context = result.get("context")
+    
+    if LLM_REPAIR_ATTEMPTS > 0:
+        repair_stats["unrepaired"] += 1
+    if error.diagram is not None:
+        return error.diagram
+    logger.warning(f"Could not parse LLM response as JSON, returning as text: {error}")
+    return original
+
+def _repair_payload(text: str, diagram_type: str, error: str, context: Optional[List[int]],
+                    system: Optional[str]) -> Dict[str, Any]:
+    if context:
+        # The context already holds the system prompt and the invalid output
+        return build_payload(create_repair_prompt(error), diagram_type, stream=False, context=context)
+    return build_payload(
+        create_repair_prompt(error, text[:REPAIR_MAX_CHARS]), diagram_type, stream=False,
+        system=system or SYSTEM_PROMPTS.get(diagram_type),
+    )
+
+async def stream_llm_response(prompt: str, diagram_type: str = "flowchart") -> AsyncIterator[str]:
+    """
+    Stream a response from the LLM (Ollama) token by token.
+    
+    Identical streams that are already in flight share one upstream generation;
+    late joiners first receive the text generated so far.
+    
+    Args:
+        prompt: The user's prompt
+        diagram_type: The type of diagram to generate
+    
+    Yields:
+        Pieces of the generated text as Ollama produces them
+    
+    Raises:
+        LLMError: If the LLM could not produce a generation
+    """
+    _note_request(prompt, diagram_type)
+    system, user_prompt = build_prompt(prompt, diagram_type)
+    payload = build_payload(user_prompt, diagram_type, stream=True, system=system)
+    
+    key = make_cache_key(payload)
+    shared = _inflight_streams.get(key)
+    if shared is None:
+        shared = _SharedStream()
+        shared.task = asyncio.create_task(_produce_stream(payload, shared))
+        _inflight_streams[key] = shared
+        shared.task.add_done_callback(lambda _: _forget_inflight(_inflight_streams, key, shared))
+    else:
+        coalescing_stats["coalesced"] += 1
+        logger.info("Joining an identical LLM stream already in flight")
+    
+    shared.waiters += 1
+    try:
+        async for text in shared.follow():
+            yield text
+    finally:
+        shared.waiters -= 1
+        if shared.waiters == 0 and not shared.task.done():
+            _forget_inflight(_inflight_streams, key, shared)
+            shared.task.cancel()
+
+async def _produce_stream(payload: Dict[str, Any], shared: "_SharedStream") -> None:
+    """Read one streaming generation from Ollama into a shared stream"""
+    coalescing_stats["upstream"] += 1
+    try:
+        session = await get_llm_session()
+        async with llm_slot():
+            started = time.perf_counter()
+            tried: List[LLMBackend] = []
+            while True:
+                try:
+                    async with backend_pool.backend(exclude=tried) as backend:
+                        tried.append(backend)
+                        await _read_stream(session, backend, payload, shared, started)
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    # Once text has gone out, switching backends would repeat or garble it
+                    if shared.chunks or not backend_pool.can_fail_over(tried):
+                        raise
+                    _fail_over(tried[-1], e)
+            observe_stage("llm_total", time.perf_counter() - started)
+        await shared.finish()
+    except asyncio.CancelledError:
+        await shared.finish(RuntimeError("LLM generation was cancelled"))
+        raise
+    except (QueueFullError, LLMError) as e:
+        await shared.finish(e)
+    except Exception as e:
+        logger.error(f"Error streaming from Ollama: {e}")
+        await shared.finish(LLMError(f"Error: {str(e)}"))
+
+async def _read_stream(session: aiohttp.ClientSession, backend: LLMBackend, payload: Dict[str, Any],
+                       shared: "_SharedStream", started: float) -> None:
+    """Stream one generation from a backend into a shared stream"""
+    sent = time.perf_counter()
+    try:
+        async with session.post(backend.generate_url, json=payload) as response:
+            try:
+                await _read_chunks(response, backend, payload, shared, started)
+            except asyncio.CancelledError:
+                # Nobody wants the rest; dropping the connection rather than
+                # returning it to the pool is what makes Ollama stop generating
+                response.close()
+                raise
+    except asyncio.CancelledError:
+        _record_cancelled(backend, sent)
+        raise
+
+async def _read_chunks(response: aiohttp.ClientResponse, backend: LLMBackend, payload: Dict[str, Any],
+                       shared: "_SharedStream", started: float) -> None:
+    """Push the text of Ollama's streamed JSON lines into a shared stream"""
+    if response.status != 200:
+        error_text = await response.text()
+        logger.error(f"Error from Ollama at {backend.name}: {error_text}")
+        raise LLMStatusError(f"Error communicating with LLM: {response.status}")
+    
+    # Ollama streams one JSON object per line
+    first_token = True
+    async for line in response.content:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            chunk = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed stream line from Ollama: {line[:100]!r}")
+            continue
+        
+        if chunk.get("error"):
+            raise LLMStatusError(f"Error from LLM: {chunk['error']}")
+        
+        text = chunk.get("response", "")
+        if text:
+            if first_token:
+                observe_stage("llm_ttft", time.perf_counter() - started)
+                first_token = False
+            await shared.push(text)
+        if chunk.get("done"):
+            record_prompt_eval(chunk)
+            break
+
+class _SharedGeneration:
+    """A non-streaming generation shared by every identical caller"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _SharedStream:
+    """A streaming generation whose chunks are replayed to every identical caller"""
+    
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+    
+    async def push(self, text: str) -> None:
+        async with self._changed:
+            self.chunks.append(text)
+            self._changed.notify_all()
+    
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+    
+    async def follow(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.chunks) > index)
+                pending = self.chunks[index:]
+                finished, error = self.done, self.error
+            for text in pending:
+                yield text
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+# Identical generations currently in flight, keyed on the effective request
+_inflight: Dict[str, _SharedGeneration] = {}
+_inflight_streams: Dict[str, _SharedStream] = {}
+
+# Upstream generations started versus callers that joined one already running
+coalescing_stats: Dict[str, int] = {"upstream": 0, "coalesced": 0}
+
+# Generations abandoned on a backend because nobody was waiting for them any
+# more (the clients disconnected, cancelled or ran out of time), and the
+# seconds the backends had spent on them
+cancel_stats: Dict[str, float] = {"generations": 0, "wasted_seconds": 0.0}
+
+# Generations that failed validation, how many of those a repair request saved
+# or not, and requests users repeated after getting an unusable diagram
+repair_stats: Dict[str, int] = {"invalid": 0, "repaired": 0, "unrepaired": 0, "user_retries": 0}
+
+# Prompt evaluation as Ollama reports it: finished generations, prompt tokens
+# evaluated and the seconds that took. For the generations whose whole prompt
+# length is known ("measured"), the tokens its prompt cache spared it from
+# evaluating, and the seconds that saved at the average evaluation speed
+prompt_stats: Dict[str, float] = {
+    "generations": 0, "evaluated_tokens": 0, "eval_seconds": 0.0,
+    "measured": 0, "reused_tokens": 0, "saved_seconds": 0.0,
+}
+
+def record_prompt_eval(result: Dict[str, Any]) -> None:
+    """
+    Account for the prompt evaluation reported with a finished Ollama generation.
+    
+    Ollama only evaluates the part of a prompt its cache does not already
+    hold. The context it returns is the whole prompt followed by the generated
+    tokens, so the prompt's length, which is what a cold cache evaluates, is
+    known exactly; the tokens reused are that less the tokens evaluated this
+    time. Generations that come back without a context are not measured.
+    """
+    if not result.get("done"):
+        return
+    # Ollama leaves the counts out when they are zero, e.g. for a fully cached prompt
+    evaluated = int(result.get("prompt_eval_count") or 0)
+    seconds = (result.get("prompt_eval_duration") or 0) / 1e9
+    observe_stage("llm_prompt_eval", seconds)
+    if result.get("load_duration"):
+        observe_stage("llm_load", result["load_duration"] / 1e9)
+    prompt_stats["generations"] += 1
+    prompt_stats["evaluated_tokens"] += evaluated
+    prompt_stats["eval_seconds"] += seconds
+    
+    context = result.get("context")
+    if not context:
+        return
+    prompt_tokens = len(context) - int(result.get("eval_count") or 0)
+    if prompt_tokens < evaluated:
+        # Not a context that starts with this prompt
+        return
+    prompt_stats["measured"] += 1
+    reused = prompt_tokens - evaluated
+    if reused > 0 and prompt_stats["evaluated_tokens"]:
+        prompt_stats["reused_tokens"] += reused
+        prompt_stats["saved_seconds"] += reused * prompt_stats["eval_seconds"] / prompt_stats["evaluated_tokens"]
+
+def prompt_eval_summary() -> Dict[str, float]:
+    """prompt_stats plus the prompt evaluation time saved per measured generation"""
+    measured = prompt_stats["measured"]
+    saved = prompt_stats["saved_seconds"] / measured if measured else 0.0
+    return {**prompt_stats, "saved_seconds_per_generation": round(saved, 4)}
+
+# Structured requests whose last result was unusable, by cache key, with when it was returned
+_failed_requests: "OrderedDict[str, float]" = OrderedDict()
+MAX_FAILED_REQUESTS = 1024
+
+def _note_request(prompt: str, diagram_type: str, current: Optional[Dict[str, Any]] = None) -> None:
+    """Count a request as a user retry if the same request recently gave an unusable result"""
+    failed_at = _failed_requests.pop(llm_cache_key(prompt, diagram_type, current), None)
+    if failed_at is not None and time.monotonic() - failed_at < LLM_RETRY_WINDOW:
+        repair_stats["user_retries"] += 1
+
+def record_llm_outcome(prompt: str, diagram_type: str, llm_response: Union[str, DiagramModel],
+                       current: Optional[Dict[str, Any]] = None) -> None:
+    """Remember structured requests that ended in a text fallback or an empty diagram"""
+    if diagram_type not in DIAGRAM_MODELS:
+        return
+    key = llm_cache_key(prompt, diagram_type, current)
+    if isinstance(llm_response, DiagramModel) and llm_response.problem() is None:
+        _failed_requests.pop(key, None)
+        return
+    _failed_requests[key] = time.monotonic()
+    _failed_requests.move_to_end(key)
+    while len(_failed_requests) > MAX_FAILED_REQUESTS:
+        _failed_requests.popitem(last=False)
+
+def _forget_inflight(registry: Dict[str, Any], key: str, shared: Any) -> None:
+    if registry.get(key) is shared:
+        del registry[key]
+
+def parse_llm_response(llm_response: str, diagram_type: str) -> Union[str, DiagramModel]:
+    """
+    Parse the raw LLM text into a validated diagram for structured diagram types.
+    
+    Args:
+        llm_response: The raw text generated by the LLM
+        diagram_type: The type of diagram that was requested
+    
+    Returns:
+        The diagram model, or the original text if it holds no usable JSON
+    """
+    return parse_diagram(llm_response, diagram_type)
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt so trivially different spellings share a cache entry"""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+def llm_cache_key(prompt: str, diagram_type: str, current: Optional[Dict[str, Any]] = None) -> str:
+    if current is not None:
+        return make_cache_key(normalize_prompt(prompt), diagram_type, OLLAMA_MODEL, OLLAMA_TEMPERATURE, current)
+    return make_cache_key(normalize_prompt(prompt), diagram_type, OLLAMA_MODEL, OLLAMA_TEMPERATURE)
+
+async def get_cached_llm_response(prompt: str, diagram_type: str,
+                                  current: Optional[Dict[str, Any]] = None) -> Optional[DiagramModel]:
+    """Get a previously parsed LLM response for the same request, if cached"""
+    cached = await llm_cache.aget(llm_cache_key(prompt, diagram_type, current))
+    # Entries are stored as JSON so they can go to the SQLite tier
+    return load_diagram(cached, diagram_type) if cached is not None else None
+
+def cache_llm_response(prompt: str, diagram_type: str, llm_response: Union[str, DiagramModel],
+                       current: Optional[Dict[str, Any]] = None) -> None:
+    """Cache a parsed LLM response. Plain text responses and errors are not cached."""
+    if isinstance(llm_response, DiagramModel):
+        llm_cache.set(llm_cache_key(prompt, diagram_type, current), llm_response.to_dict())
+
+def response_format(diagram_type: str) -> Optional[Union[str, Dict[str, Any]]]:
+    """The Ollama "format" constraint for a diagram type, or None to leave the output free"""
+    if diagram_type not in GENERATION_SCHEMAS or OLLAMA_FORMAT not in ("schema", "json"):
+        return None
+    return GENERATION_SCHEMAS[diagram_type] if OLLAMA_FORMAT == "schema" else "json"
+
+def keep_alive() -> Union[int, str]:
+    """OLLAMA_KEEP_ALIVE as Ollama expects it: seconds as a number, or a duration string like "30m" """
+    try:
+        return int(OLLAMA_KEEP_ALIVE)
+    except ValueError:
+        return OLLAMA_KEEP_ALIVE
+
+def build_payload(prompt: str, diagram_type: str, stream: bool, system: Optional[str] = None,
+                  **extra: Any) -> Dict[str, Any]:
+    """
+    The /api/generate request body for a prompt.
+    
+    Args:
+        prompt: The variable part of the prompt
+        diagram_type: The type of diagram being generated, for the output format
+        stream: Whether Ollama should stream the output
+        system: The fixed preamble, sent as the system prompt so that it leads
+            every prompt of its kind and Ollama can reuse it from its cache
+        extra: Further request fields, e.g. a context to continue from
+    """
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": keep_alive(),
+        "options": {"temperature": OLLAMA_TEMPERATURE},
+    }
+    if system is not None:
+        payload["system"] = system
+    output_format = response_format(diagram_type)
+    if output_format is not None:
+        payload["format"] = output_format
+    payload.update(extra)
+    return payload
+
+def build_prompt(prompt: str, diagram_type: str,
+                 current: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], str]:
+    """
+    Select the prompt template based on diagram type.
+    
+    Returns:
+        The fixed system preamble (None for free text) and the variable user prompt
+    """
+    if current is not None:
+        system = REFINE_SYSTEM_PROMPTS.get(diagram_type, REFINE_SYSTEM_PROMPTS["diagram"])
+        return system, create_refine_prompt(prompt, current)
+    if diagram_type == "flowchart":
+        return SYSTEM_PROMPTS[diagram_type], create_flowchart_prompt(prompt)
+    elif diagram_type == "process":
+        return SYSTEM_PROMPTS[diagram_type], create_process_diagram_prompt(prompt)
+    elif diagram_type == "mindmap":
+        return SYSTEM_PROMPTS[diagram_type], create_mindmap_prompt(prompt)
+    return None, prompt
+
+# The fixed part of each prompt. It goes first, unchanged from request to
+# request, so Ollama only has to evaluate it again when its cache is cold.
+FLOWCHART_SYSTEM_PROMPT = """You are a diagram generation assistant that creates structured flowcharts for TLDraw.
+
+IMPORTANT: Return your response as a JSON object with the following structure:
+
+{
+  "title": "The main title of the flowchart",
+  "description": "A brief description of what this flowchart represents",
+  "nodes": [
+    {"id": "1", "text": "Start", "type": "start"},
+    {"id": "2", "text": "Process Step 1", "type": "process"},
+    {"id": "3", "text": "Decision?", "type": "decision"},
+    {"id": "4", "text": "End", "type": "end"}
+  ],
+  "connections": [
+    {"from": "1", "to": "2", "label": ""},
+    {"from": "2", "to": "3", "label": ""},
+    {"from": "3", "to": "4", "label": "Yes"},
+    {"from": "3", "to": "2", "label": "No"}
+  ]
+}
+
+NODE TYPES:
+- "start": Oval shape representing the start of the flowchart
+- "end": Oval shape representing the end of the flowchart
+- "process": Rectangle shape representing a process or action
+- "decision": Diamond shape representing a decision point (always phrase as a question)
+- "input": Parallelogram shape representing input/output
+
+GUIDELINES:
+1. Use clear, concise text for each node (under 10 words if possible)
+2. Ensure logical flow from start to end
+3. Decisions should always have at least two connections (typically "Yes" and "No")
+4. All nodes must be connected
+5. Make sure all node IDs are unique
+
+ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation."""
+
+PROCESS_SYSTEM_PROMPT = """You are a diagram generation assistant that creates structured process diagrams for TLDraw.
+
+IMPORTANT: Return your response as a JSON object with the following structure:
+
+{
+  "title": "The main title of the process diagram",
+  "description": "A brief description of what this process represents",
+  "phases": [
+    {
+      "name": "Phase 1: Planning",
+      "steps": [
+        {"id": "1.1", "text": "Define Requirements", "type": "process"},
+        {"id": "1.2", "text": "Establish Timeline", "type": "process"}
+      ]
+    },
+    {
+      "name": "Phase 2: Execution",
+      "steps": [
+        {"id": "2.1", "text": "Implementation", "type": "process"},
+        {"id": "2.2", "text": "Quality approved?", "type": "decision"}
+      ]
+    }
+  ],
+  "connections": [
+    {"from": "1.1", "to": "1.2", "label": ""},
+    {"from": "1.2", "to": "2.1", "label": ""},
+    {"from": "2.1", "to": "2.2", "label": ""},
+    {"from": "2.2", "to": "2.1", "label": "No"}
+  ]
+}
+
+NODE TYPES:
+- "start": Oval shape representing the start of the process
+- "end": Oval shape representing the end of the process
+- "process": Rectangle shape representing a process step or action
+- "decision": Diamond shape representing a decision point (always phrase as a question)
+- "input": Parallelogram shape representing input/output
+- "document": Document shape representing documentation
+
+GUIDELINES:
+1. Organize steps into logical phases
+2. Use clear, concise text for each step (under 10 words if possible)
+3. Ensure the process flows logically from start to end
+4. Decisions should always have at least two connections (typically "Yes" and "No")
+5. All steps must be connected
+6. Make sure all step IDs are unique
+
+ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation."""
+
+MINDMAP_SYSTEM_PROMPT = """You are a diagram generation assistant that creates structured mind maps for TLDraw visualization.
+
+IMPORTANT: Return your response as a JSON object with the following structure:
+
+{
+  "title": "Main Topic",
+  "description": "Brief description of what this mind map represents",
+  "centralNode": {"id": "center", "text": "Central Concept", "color": "blue"},
+  "branches": [
+    {
+      "id": "branch1",
+      "text": "Main Branch 1",
+      "color": "green",
+      "nodes": [
+        {"id": "node1.1", "text": "Sub-topic 1.1", "color": "green"},
+        {"id": "node1.2", "text": "Sub-topic 1.2", "color": "green"}
+      ]
+    },
+    {
+      "id": "branch2",
+      "text": "Main Branch 2",
+      "color": "red",
+      "nodes": [
+        {"id": "node2.1", "text": "Sub-topic 2.1", "color": "red"},
+        {"id": "node2.2", "text": "Sub-topic 2.2", "color": "red"}
+      ]
+    }
+  ],
+  "connections": [
+    {"from": "node1.1", "to": "node2.1", "label": "relates to"}
+  ]
+}
+
+GUIDELINES:
+1. The central node should capture the main concept of the mind map
+2. Create 4-6 main branches that represent primary categories or themes
+3. Each branch should have 2-4 sub-topics that elaborate on the branch theme
+4. Use short, clear text for each node (typically 1-5 words for maximum visual clarity)
+5. Add 1-3 cross-connections between nodes that have meaningful relationships
+6. Use different colors for different branches to make the mind map visually distinct
+7. Ensure all IDs are unique
+8. Make sure the content is accurate and relevant to the topic
+
+COLOR OPTIONS:
+- "blue", "green", "red", "yellow", "purple", "orange", "teal", "pink"
+
+ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation."""
+
+def _refine_system_prompt(name: str) -> str:
+    return f"""You are a diagram generation assistant that edits structured {name}s for TLDraw.
+
+You will be given the current diagram as JSON and a change request.
+
+IMPORTANT: Return the complete updated diagram as a JSON object with exactly the same structure.
+
+GUIDELINES:
+1. Only change what the request asks for
+2. Keep the IDs of every node, branch and step that still exists
+3. Use new unique IDs for anything you add
+4. Remove connections that point to removed nodes
+
+ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation."""
+
+SYSTEM_PROMPTS = {
+    "flowchart": FLOWCHART_SYSTEM_PROMPT,
+    "process": PROCESS_SYSTEM_PROMPT,
+    "mindmap": MINDMAP_SYSTEM_PROMPT,
+}
+
+REFINE_SYSTEM_PROMPTS = {
+    diagram_type: _refine_system_prompt(name)
+    for diagram_type, name in (
+        ("flowchart", "flowchart"), ("process", "process diagram"), ("mindmap", "mind map"), ("diagram", "diagram")
+    )
+}
+
+def create_flowchart_prompt(prompt: str) -> str:
+    """Create the variable part of a flowchart prompt"""
+    return f'TASK: Generate a flowchart based on this request: "{prompt}"'
+
+def create_process_diagram_prompt(prompt: str) -> str:
+    """Create the variable part of a process diagram prompt"""
+    return f'TASK: Generate a process diagram based on this request: "{prompt}"'
 
 def create_mindmap_prompt(prompt: str) -> str:
-    """Create a prompt for mind map generation specifically optimized for TLDraw"""
-    return f"""
-    You are a diagram generation assistant that creates structured mind maps for TLDraw visualization.
-    
-    TASK: Generate a detailed mind map based on this request: "{prompt}"
-    
-    IMPORTANT: Return your response as a JSON object with the following structure:
-    
-    {{
-        "title": "Main Topic",
-        "description": "Brief description of what this mind map represents",
-        "centralNode": {{
-            "id": "center",
-            "text": "Central Concept",
-            "color": "blue"
-        }},
-        "branches": [
-            {{
-                "id": "branch1",
-                "text": "Main Branch 1",
-                "color": "green",
-                "nodes": [
-                    {{
-                        "id": "node1.1",
-                        "text": "Sub-topic 1.1",
-                        "color": "green"
-                    }},
-                    {{
-                        "id": "node1.2",
-                        "text": "Sub-topic 1.2",
-                        "color": "green"
-                    }}
-                ]
-            }},
-            {{
-                "id": "branch2",
-                "text": "Main Branch 2",
-                "color": "red",
-                "nodes": [
-                    {{
-                        "id": "node2.1",
-                        "text": "Sub-topic 2.1",
-                        "color": "red"
-                    }},
-                    {{
-                        "id": "node2.2",
-                        "text": "Sub-topic 2.2",
-                        "color": "red"
-                    }}
-                ]
-            }}
-        ],
-        "connections": [
-            {{
-                "from": "node1.1",
-                "to": "node2.1",
-                "label": "relates to"
-            }}
-        ]
-    }}
-    
-    GUIDELINES:
-    1. The central node should capture the main concept of the mind map
-    2. Create 4-6 main branches that represent primary categories or themes
-    3. Each branch should have 2-4 sub-topics that elaborate on the branch theme
-    4. Use short, clear text for each node (typically 1-5 words for maximum visual clarity)
-    5. Add 1-3 cross-connections between nodes that have meaningful relationships
-    6. Use different colors for different branches to make the mind map visually distinct
-    7. Ensure all IDs are unique
-    8. Make sure the content is accurate and relevant to the topic
-    
-    COLOR OPTIONS:
-    - "blue", "green", "red", "yellow", "purple", "orange", "teal", "pink"
-    
-    ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation.
-    """
\ No newline at end of file
+    """Create the variable part of a mind map prompt"""
+    return f'TASK: Generate a detailed mind map based on this request: "{prompt}"'
+
+def create_refine_prompt(prompt: str, current: Dict[str, Any]) -> str:
+    """Create the variable part of a prompt that changes an existing diagram"""
+    return f"""CURRENT DIAGRAM:
+{json.dumps(current, indent=2)}
+
+TASK: Change the diagram as requested: "{prompt}\""""
+
+def create_repair_prompt(error: str, output: Optional[str] = None) -> str:
+    """Create a prompt that asks for invalid JSON to be fixed, quoting it only when the context is lost"""
+    quoted = f"""
+YOUR RESPONSE:
+{output}
+""" if output is not None else ""
+    return f"""Your response could not be used: {error}
+{quoted}
+Fix the problem and return the complete corrected JSON object with the structure you were asked for.
+
+ONLY RESPOND WITH THE JSON OBJECT. Do not include any other text or explanation."""
@@ -0,0 +1,187 @@
+# backend/models/scheduler.py
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from models.backends import backend_pool
+from services.metrics import observe_stage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Scheduler settings; by default there is a slot for every generation the Ollama backends can run at once
+LLM_SCHEDULER_SLOTS = int(os.getenv("LLM_SCHEDULER_SLOTS", "0")) or backend_pool.capacity
+LLM_SCHEDULER_MAX_QUEUE = int(os.getenv("LLM_SCHEDULER_MAX_QUEUE", "32"))
+LLM_QUEUE_UPDATE_INTERVAL = float(os.getenv("LLM_QUEUE_UPDATE_INTERVAL", "2.0"))
+
+# Called while a request waits with (queue position, estimated wait in seconds)
+QueueCallback = Callable[[int, float], Awaitable[None]]
+
+# Identifies who is asking for the current LLM call: (client ID, queue callback).
+# Set by the WebSocket request task so models.llm can schedule without extra arguments.
+scheduler_client: ContextVar[Tuple[str, Optional[QueueCallback]]] = ContextVar(
+    "scheduler_client", default=("anonymous", None)
+)
+
+class QueueFullError(Exception):
+    """Raised when the inference queue is full and the request is rejected"""
+
+class InferenceScheduler:
+    """
+    Limits concurrent LLM generations and queues the rest fairly.
+
+    Waiting requests are grouped per client and served round-robin across
+    clients, so one client with many queued prompts cannot starve the others.
+    """
+
+    def __init__(self, slots: int, max_queue: int, update_interval: float = 2.0):
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.update_interval = update_interval
+        self.active = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        # Clients with waiting requests, in the order they will be served
+        self._rotation: Deque[str] = deque()
+        # Moving average of how long a generation holds a slot
+        self.avg_service_time = 5.0
+        self.rejected = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, on_queued: Optional[QueueCallback] = None) -> AsyncIterator[float]:
+        """
+        Hold one generation slot for the duration of the block.
+
+        Args:
+            client_id: The client the request belongs to, used for fairness
+            on_queued: Optional callback for queue position updates while waiting
+
+        Yields:
+            The number of seconds spent waiting in the queue
+
+        Raises:
+            QueueFullError: If the queue is full
+        """
+        queued_at = time.monotonic()
+        await self._acquire(client_id, on_queued)
+        started_at = time.monotonic()
+        observe_stage("queue_wait", started_at - queued_at)
+        try:
+            yield started_at - queued_at
+        finally:
+            elapsed = time.monotonic() - started_at
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+            self._release()
+
+    async def _acquire(self, client_id: str, on_queued: Optional[QueueCallback]) -> None:
+        if self.active < self.slots and not self._rotation:
+            self.active += 1
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_queue} waiting)")
+
+        waiter = asyncio.get_running_loop().create_future()
+        if client_id not in self._queues:
+            self._queues[client_id] = deque()
+            self._rotation.append(client_id)
+        self._queues[client_id].append(waiter)
+
+        try:
+            while True:
+                if on_queued is not None:
+                    await self._notify(on_queued, client_id, waiter)
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), self.update_interval)
+                    return
+                except asyncio.TimeoutError:
+                    continue
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self._release()
+            else:
+                waiter.cancel()
+                self._remove(client_id, waiter)
+            raise
+
+    def _release(self) -> None:
+        # Hand the slot straight to the next client in round-robin order
+        while self._rotation:
+            client_id = self._rotation.popleft()
+            queue = self._queues[client_id]
+            waiter = queue.popleft()
+            if queue:
+                self._rotation.append(client_id)
+            else:
+                del self._queues[client_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _remove(self, client_id: str, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(client_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[client_id]
+            self._rotation.remove(client_id)
+
+    def position(self, client_id: str, waiter: asyncio.Future) -> int:
+        """1-based position of a waiter in the round-robin service order"""
+        queue = self._queues.get(client_id)
+        if queue is None or waiter not in queue:
+            return 0
+        index = queue.index(waiter)
+        position = index + 1
+        ahead = True
+        for other_id in self._rotation:
+            if other_id == client_id:
+                ahead = False
+                continue
+            other_len = len(self._queues[other_id])
+            # Clients ahead in the rotation are served first within each round
+            position += min(other_len, index + 1 if ahead else index)
+        return position
+
+    def estimated_wait(self, position: int) -> float:
+        return math.ceil(position / self.slots) * self.avg_service_time
+
+    async def _notify(self, on_queued: QueueCallback, client_id: str, waiter: asyncio.Future) -> None:
+        position = self.position(client_id, waiter)
+        if position <= 0:
+            return
+        try:
+            await on_queued(position, self.estimated_wait(position))
+        except Exception as e:
+            logger.debug(f"Queue update for {client_id} failed: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "avg_service_time": round(self.avg_service_time, 3),
+        }
+
+# Shared scheduler in front of the Ollama backends
+scheduler = InferenceScheduler(LLM_SCHEDULER_SLOTS, LLM_SCHEDULER_MAX_QUEUE, LLM_QUEUE_UPDATE_INTERVAL)
+
+def llm_slot():
+    """Hold a scheduler slot on behalf of the client set in scheduler_client"""
+    client_id, on_queued = scheduler_client.get()
+    return scheduler.slot(client_id, on_queued)
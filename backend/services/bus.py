@@ -0,0 +1,392 @@
+# backend/services/bus.py
+"""
+Connection registry and message bus for the WebSocket tier.
+
+Every worker registers the sockets it holds here and sends frames through the
+bus instead of writing to a socket directly, so a frame reaches its client
+whichever worker (or host) the client is connected to. Frames are published
+to channels: each connection listens on its own channel, and connections can
+subscribe to shared channels as well.
+
+MESSAGE_BUS picks the backend:
+
+- "memory" (the default) only reaches sockets in this process, which is all a
+  single worker needs.
+- "unix" relays frames between workers through a broker listening on the Unix
+  socket MESSAGE_BUS_SOCKET. Start one broker per host before the workers:
+
+      python -m services.bus --socket /tmp/tldraw-bus.sock
+
+Frames for sockets in the same process never leave it, and frames travel as
+the bytes they were encoded to once (see services.serializer).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from services.serializer import EncodedFrame
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# "memory" for one worker, "unix" to share a broker between workers
+MESSAGE_BUS = os.getenv("MESSAGE_BUS", "memory").lower()
+MESSAGE_BUS_SOCKET = os.getenv("MESSAGE_BUS_SOCKET", "/tmp/tldraw-bus.sock")
+# Seconds to wait between attempts to reach the broker, and at startup before serving without it
+MESSAGE_BUS_RECONNECT_DELAY = float(os.getenv("MESSAGE_BUS_RECONNECT_DELAY", "1"))
+MESSAGE_BUS_CONNECT_TIMEOUT = float(os.getenv("MESSAGE_BUS_CONNECT_TIMEOUT", "5"))
+# Frames the broker buffers for a worker that is slow to read before it drops them
+MESSAGE_BUS_MAX_PENDING = int(os.getenv("MESSAGE_BUS_MAX_PENDING", "1024"))
+
+# Hands a frame to one of this process's sockets. Called for each listener of
+# a channel in turn, so it should queue the frame rather than wait on the socket
+Deliver = Callable[[EncodedFrame], Awaitable[None]]
+
+def connection_channel(connection_id: str) -> str:
+    """The channel a connection receives its own frames on"""
+    return f"connection:{connection_id}"
+
+def room_channel(room: str) -> str:
+    """The channel every member of a collaboration room receives its frames on"""
+    return f"room:{room}"
+
+class MessageBus:
+    """
+    Registry of the sockets open in this process, and channels between them.
+
+    The base class is the in-memory backend; subclasses pass published frames
+    on to other processes through the _watch, _unwatch and _forward hooks.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        # Sockets open in this process, by connection ID
+        self.connections: Dict[str, Deliver] = {}
+        # Local connections listening on each channel, and the reverse
+        self._channels: Dict[str, Set[str]] = {}
+        self._subscriptions: Dict[str, Set[str]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+        # Frames that could not be passed on to the other processes
+        self.dropped = 0
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def register(self, connection_id: str, deliver: Deliver) -> None:
+        """Make a socket of this process reachable by its connection ID"""
+        self.connections[connection_id] = deliver
+        await self.subscribe(connection_id, connection_channel(connection_id))
+
+    async def unregister(self, connection_id: str) -> None:
+        """Forget a closed socket and its subscriptions"""
+        self.connections.pop(connection_id, None)
+        for channel in list(self._subscriptions.get(connection_id, ())):
+            await self.unsubscribe(connection_id, channel)
+
+    async def subscribe(self, connection_id: str, channel: str) -> None:
+        members = self._channels.setdefault(channel, set())
+        if connection_id in members:
+            return
+        members.add(connection_id)
+        self._subscriptions.setdefault(connection_id, set()).add(channel)
+        if len(members) == 1:
+            await self._watch(channel)
+
+    async def unsubscribe(self, connection_id: str, channel: str) -> None:
+        members = self._channels.get(channel)
+        if members is None or connection_id not in members:
+            return
+        members.discard(connection_id)
+        channels = self._subscriptions[connection_id]
+        channels.discard(channel)
+        if not channels:
+            del self._subscriptions[connection_id]
+        if not members:
+            del self._channels[channel]
+            await self._unwatch(channel)
+
+    async def send(self, connection_id: str, frame: EncodedFrame) -> None:
+        """
+        Send a frame to one connection, wherever it is connected.
+
+        A socket in this process is written to directly, and its errors are
+        raised to the caller as if it had written to the socket itself.
+        """
+        deliver = self.connections.get(connection_id)
+        if deliver is None:
+            await self.publish(connection_channel(connection_id), frame)
+            return
+        await deliver(frame)
+        self.delivered += 1
+
+    async def publish(self, channel: str, frame: EncodedFrame) -> None:
+        """Send a frame to every connection subscribed to a channel, in any process"""
+        self.published += 1
+        await self._forward(channel, frame)
+        await self.deliver(channel, frame)
+
+    async def deliver(self, channel: str, frame: EncodedFrame) -> None:
+        """Write a frame to the sockets in this process that listen on a channel"""
+        for connection_id in list(self._channels.get(channel, ())):
+            deliver = self.connections.get(connection_id)
+            if deliver is None:
+                continue
+            try:
+                await deliver(frame)
+                self.delivered += 1
+            except Exception as e:
+                # One broken socket must not keep the frame from the others
+                self.failed += 1
+                logger.warning(f"Could not deliver a frame on {channel} to {connection_id}: {e}")
+
+    async def _watch(self, channel: str) -> None:
+        """Called when a channel gets its first listener in this process"""
+
+    async def _unwatch(self, channel: str) -> None:
+        """Called when a channel loses its last listener in this process"""
+
+    async def _forward(self, channel: str, frame: EncodedFrame) -> None:
+        """Called to pass a published frame on to the other processes"""
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": len(self.connections),
+            "channels": len(self._channels),
+            "published": self.published,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+def _encode(op: str, channel: str, data: bytes = b"") -> bytes:
+    # A JSON header line, followed by the frame's bytes as they are
+    header = json.dumps({"op": op, "channel": channel, "size": len(data)}, separators=(",", ":"))
+    return header.encode("utf-8") + b"\n" + data
+
+async def _read_message(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError("The other end closed the connection")
+    header = json.loads(line)
+    size = int(header.get("size", 0))
+    data = await reader.readexactly(size) if size else b""
+    return header["op"], header["channel"], data
+
+class UnixBrokerBus(MessageBus):
+    """
+    Message bus whose channels span every worker connected to one broker.
+
+    The worker tells the broker which channels it has listeners on, and
+    publishes through it to the other workers. When the broker is unreachable
+    the worker keeps serving its own sockets, drops frames for the others, and
+    reconnects in the background.
+
+    Args:
+        path: The broker's Unix socket
+        reconnect_delay: Seconds between attempts to reach the broker
+        connect_timeout: Seconds start() waits for the broker
+    """
+
+    name = "unix"
+
+    def __init__(self, path: str, reconnect_delay: float = 1.0, connect_timeout: float = 5.0):
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._write_lock = asyncio.Lock()
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Message broker at {self.path} is not reachable yet; only local sockets will get frames")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                logger.debug(f"Cannot reach the message broker at {self.path}: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            try:
+                # A new broker connection knows nothing of this worker's channels yet.
+                # Channels watched from here on go through _send, which queues behind
+                # this lock, so every one is either in the list below or sent after it
+                self._writer = writer
+                async with self._write_lock:
+                    for channel in list(self._channels):
+                        writer.write(_encode("sub", channel))
+                    await writer.drain()
+                self._connected.set()
+                logger.info(f"Connected to the message broker at {self.path}")
+                while True:
+                    op, channel, data = await _read_message(reader)
+                    if op == "msg":
+                        await self.deliver(channel, EncodedFrame(data))
+            except (OSError, asyncio.IncompleteReadError, ValueError, KeyError) as e:
+                logger.warning(f"Lost the message broker at {self.path}: {str(e) or type(e).__name__}")
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _send(self, message: bytes) -> bool:
+        writer = self._writer
+        if writer is None:
+            return False
+        try:
+            async with self._write_lock:
+                writer.write(message)
+                await writer.drain()
+            return True
+        except OSError as e:
+            # The reader notices too and reconnects
+            logger.warning(f"Could not write to the message broker: {e}")
+            return False
+
+    async def _watch(self, channel: str) -> None:
+        # Channels watched while disconnected are sent when the connection comes back
+        await self._send(_encode("sub", channel))
+
+    async def _unwatch(self, channel: str) -> None:
+        await self._send(_encode("unsub", channel))
+
+    async def _forward(self, channel: str, frame: EncodedFrame) -> None:
+        if not await self._send(_encode("pub", channel, frame.data)):
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {**super().stats(), "broker_connected": int(self._connected.is_set())}
+
+class _Peer:
+    """A worker connected to the broker, with its own queue so a slow reader does not hold up the others"""
+
+    def __init__(self, writer: asyncio.StreamWriter, max_pending: int):
+        self.writer = writer
+        self.channels: Set[str] = set()
+        self.dropped = 0
+        self._queue: "asyncio.Queue[bytes]" = asyncio.Queue(max_pending)
+        self._task = asyncio.create_task(self._write())
+
+    def send(self, message: bytes) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                self.writer.write(await self._queue.get())
+                await self.writer.drain()
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self._task.cancel()
+        self.writer.close()
+
+class Broker:
+    """Relays frames published by one worker to the other workers listening on the channel"""
+
+    def __init__(self, max_pending: int = 1024):
+        self.max_pending = max_pending
+        self._subscribers: Dict[str, Set[_Peer]] = {}
+
+    async def serve(self, path: str) -> None:
+        if os.path.exists(path):
+            # Left behind by a broker that did not shut down cleanly
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self._handle, path)
+        logger.info(f"Message broker listening on {path}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = _Peer(writer, self.max_pending)
+        logger.info("Worker connected")
+        try:
+            while True:
+                op, channel, data = await _read_message(reader)
+                if op == "sub":
+                    peer.channels.add(channel)
+                    self._subscribers.setdefault(channel, set()).add(peer)
+                elif op == "unsub":
+                    self._leave(peer, channel)
+                elif op == "pub":
+                    message = _encode("msg", channel, data)
+                    for subscriber in self._subscribers.get(channel, ()):
+                        # The publisher has delivered to its own sockets already
+                        if subscriber is not peer:
+                            subscriber.send(message)
+        except (OSError, asyncio.IncompleteReadError, ValueError, KeyError) as e:
+            if not isinstance(e, ConnectionResetError):
+                logger.warning(f"Dropping a worker that sent an invalid message: {e}")
+        finally:
+            for channel in list(peer.channels):
+                self._leave(peer, channel)
+            peer.close()
+            logger.info(f"Worker disconnected ({peer.dropped} frames dropped for it)")
+
+    def _leave(self, peer: _Peer, channel: str) -> None:
+        peer.channels.discard(channel)
+        subscribers = self._subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(peer)
+            if not subscribers:
+                del self._subscribers[channel]
+
+def create_bus(kind: str = MESSAGE_BUS) -> MessageBus:
+    """The message bus backend for a MESSAGE_BUS setting"""
+    if kind == "unix":
+        return UnixBrokerBus(MESSAGE_BUS_SOCKET, MESSAGE_BUS_RECONNECT_DELAY, MESSAGE_BUS_CONNECT_TIMEOUT)
+    if kind != "memory":
+        logger.warning(f"Unknown MESSAGE_BUS '{kind}', using the in-memory bus")
+    return MessageBus()
+
+# Shared by every connection in this process
+message_bus = create_bus()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Message broker shared by the backend's workers")
+    parser.add_argument("--socket", default=MESSAGE_BUS_SOCKET, help="Unix socket to listen on")
+    parser.add_argument("--max-pending", type=int, default=MESSAGE_BUS_MAX_PENDING,
+                        help="Frames buffered for a slow worker before they are dropped")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(Broker(args.max_pending).serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
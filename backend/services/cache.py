@@ -0,0 +1,314 @@
+# backend/services/cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from models.diagram import DiagramModel
+from services.metrics import time_stage
+from services.serializer import dumps
+from services.shapes import Shape
+from services.workers import run_layout
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cache settings
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", "256"))
+LAYOUT_CACHE_TTL = float(os.getenv("LAYOUT_CACHE_TTL", "3600"))
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "20000"))
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "3600"))
+# Optional SQLite file so cached entries survive restarts
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "")
+
+def make_cache_key(*parts: Any) -> str:
+    """Build a stable hash key from JSON-serializable parts"""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class SQLiteCacheTier:
+    """
+    On-disk cache tier backed by a single SQLite table. Values are stored as JSON,
+    except pre-encoded bytes values, which are stored as-is.
+
+    The methods block on disk I/O, so TTLCache calls them off the event loop.
+    Reads do not write: the access times of the entries they hit are kept
+    in memory and written, for the LRU eviction, along with the next set().
+    """
+
+    def __init__(self, path: str, table: str, maxsize: int):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # Entries read since the last write, with when they were read
+        self._accessed: Dict[str, float] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """The value and its remaining time to live in seconds, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                # Expired rows are deleted by the next write
+                return None
+            self._accessed[key] = now
+        value = row[0] if isinstance(row[0], bytes) else json.loads(row[0])
+        return value, row[1] - now
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        try:
+            encoded = value if isinstance(value, bytes) else json.dumps(value)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Value for {self.table} cache is not JSON-serializable: {e}")
+            return
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+            self._conn.executemany(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                [(at, accessed_key) for accessed_key, at in accessed.items()],
+            )
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, encoded, now + ttl, now),
+            )
+            # Drop expired rows, then the least recently used ones above the size limit
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._accessed.clear()
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class TTLCache:
+    """
+    Bounded in-memory LRU cache with a per-entry time to live and an optional
+    SQLite tier behind it.
+
+    On the event loop, look entries up with aget(), which reads the SQLite
+    tier in a thread. Writes to the tier go to a single background thread in
+    the order they were made, and set() does not wait for them.
+
+    The in-memory part is locked, so layout threads can share a cache (as
+    they do the route cache).
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, sqlite_path: str = ""):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk: Optional[SQLiteCacheTier] = None
+        self._disk_writer: Optional[ThreadPoolExecutor] = None
+        if sqlite_path:
+            try:
+                self.disk = SQLiteCacheTier(sqlite_path, f"{name}_cache", maxsize * 10)
+                self._disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-cache-writer")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open SQLite cache at {sqlite_path}: {e}")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a cached value, or None if it is missing or expired. Blocks on the SQLite tier, if any."""
+        value = self._get_memory(key)
+        if value is None and self.disk is not None:
+            value = self._promote(key, self._read_disk(key))
+        if value is None:
+            with self._lock:
+                self.misses += 1
+        return value
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """Get a cached value like get(), reading the SQLite tier off the event loop"""
+        value = self._get_memory(key)
+        if value is None and self.disk is not None:
+            value = self._promote(key, await asyncio.to_thread(self._read_disk, key))
+        if value is None:
+            with self._lock:
+                self.misses += 1
+        return value
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+            self.expirations += 1
+            return None
+
+    def _read_disk(self, key: str) -> Optional[Tuple[Any, float]]:
+        try:
+            return self.disk.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite {self.name} cache read failed: {e}")
+            return None
+
+    def _promote(self, key: str, found: Optional[Tuple[Any, float]]) -> Optional[Any]:
+        # Into memory for as long as the entry has left on disk, not a fresh TTL
+        if found is None:
+            return None
+        value, ttl = found
+        self._store(key, value, ttl)
+        with self._lock:
+            self.disk_hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value in memory and, when configured, queue it to be written to disk"""
+        self._store(key, value, self.ttl)
+        if self._disk_writer is not None:
+            self._disk_writer.submit(self._write_disk, key, value)
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        try:
+            self.disk.set(key, value, self.ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite {self.name} cache write failed: {e}")
+
+    def _store(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+        if self._disk_writer is not None:
+            # After the writes already queued, so none of them lands afterwards
+            self._disk_writer.submit(self.disk.clear).result()
+
+    def close(self) -> None:
+        if self._disk_writer is not None:
+            # Finish the queued writes first
+            self._disk_writer.shutdown(wait=True)
+            self._disk_writer = None
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "persistent": self.disk is not None,
+        }
+
+# Level one: parsed LLM JSON keyed on prompt, diagram type, model and temperature
+llm_cache = TTLCache("llm", LLM_CACHE_SIZE, LLM_CACHE_TTL, CACHE_SQLITE_PATH)
+
+# Level two: generated shapes, already encoded as JSON, keyed on a hash of the LLM JSON
+layout_cache = TTLCache("layout", LAYOUT_CACHE_SIZE, LAYOUT_CACHE_TTL, CACHE_SQLITE_PATH)
+
+# Arrow routes that had to be searched for, keyed on their ports and the boxes
+# around them; in memory only, since each layout worker routes on its own
+route_cache = TTLCache("route", ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL)
+
+async def cached_layout(
+    generator: Callable[[Any, str], List[Shape]],
+    llm_response: Any,
+    namespace: str = "",
+) -> bytes:
+    """
+    Run a shape generator through the layout cache, off the event loop when large.
+
+    The shapes are cached already encoded, so a cache hit can be spliced into
+    a response frame without running the generator or the encoder. Only
+    validated diagrams are cached; text fallbacks always run the generator.
+
+    Args:
+        generator: One of the generate_* functions from services.tldraw
+        llm_response: The parsed LLM response passed to the generator
+        namespace: Scopes the generated shape IDs to one diagram
+
+    Returns:
+        The TLDraw shapes encoded as a JSON array
+    """
+    if not isinstance(llm_response, DiagramModel):
+        return encode_shapes(await run_layout(generator, llm_response, namespace))
+
+    # Cached without a namespace, so every diagram drawn from the same JSON shares the entry
+    key = make_cache_key(generator.__name__, llm_response.to_dict())
+    encoded = await layout_cache.aget(key)
+    if encoded is None:
+        encoded = encode_shapes(await run_layout(generator, llm_response))
+        layout_cache.set(key, encoded)
+    return scope_shape_ids(encoded, namespace)
+
+def encode_shapes(shapes: List[Shape]) -> bytes:
+    with time_stage("serialize"):
+        return dumps(shapes)
+
+def scope_shape_ids(encoded: bytes, namespace: str) -> bytes:
+    """
+    Move encoded shapes generated without a namespace into one.
+
+    Gives the same IDs as generating with the namespace. The pattern cannot
+    match inside a label, where the quotes would be escaped.
+    """
+    if not namespace:
+        return encoded
+    return encoded.replace(b'"id":"shape:', b'"id":"shape:' + namespace.encode("utf-8") + b":")
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters for both cache levels and the route cache"""
+    return {
+        "llm": llm_cache.stats(),
+        "layout": layout_cache.stats(),
+        "route": route_cache.stats(),
+    }
+
+def close_caches() -> None:
+    llm_cache.close()
+    layout_cache.close()
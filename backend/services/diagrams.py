@@ -0,0 +1,124 @@
+# backend/services/diagrams.py
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from models.diagram import DiagramModel
+from services.shapes import Shape
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of recent diagrams kept so they can be refined
+DIAGRAM_STORE_SIZE = int(os.getenv("DIAGRAM_STORE_SIZE", "256"))
+
+ShapeIndex = Dict[str, Dict[str, Any]]
+
+class UnknownDiagramError(LookupError):
+    """Raised when a refine request names a diagram that is not (or no longer) stored"""
+
+class Diagram:
+    """A generated diagram that later requests can refine"""
+
+    def __init__(self, diagram_id: str, mode: str, diagram_type: str, namespace: str, llm_response: DiagramModel):
+        self.id = diagram_id
+        self.mode = mode
+        self.diagram_type = diagram_type
+        # Shape IDs are scoped to the namespace, which stays the same across refinements
+        self.namespace = namespace
+        self.llm_response = llm_response
+        # Wire shapes by ID; filled in lazily on the first refinement
+        self.shapes: Optional[ShapeIndex] = None
+        # Editable layout state of flowchart-like diagrams, also built lazily;
+        # once it exists it holds the current version of the diagram
+        self.layout: Optional[Any] = None
+        # Refinements of one diagram are applied one at a time
+        self.lock = asyncio.Lock()
+
+class DiagramStore:
+    """Bounded LRU of recently generated diagrams, keyed on diagram ID"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._diagrams: "OrderedDict[str, Diagram]" = OrderedDict()
+
+    def get(self, diagram_id: str) -> Diagram:
+        diagram = self._diagrams.get(diagram_id)
+        if diagram is None:
+            raise UnknownDiagramError(f"Unknown diagram: {diagram_id}")
+        self._diagrams.move_to_end(diagram_id)
+        return diagram
+
+    def put(self, diagram: Diagram) -> None:
+        self._diagrams[diagram.id] = diagram
+        self._diagrams.move_to_end(diagram.id)
+        while len(self._diagrams) > self.maxsize:
+            self._diagrams.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._diagrams)
+
+diagram_store = DiagramStore(DIAGRAM_STORE_SIZE)
+
+def diagram_namespace(diagram_id: str) -> str:
+    """
+    Shape ID namespace for a new diagram.
+
+    Derived from the diagram's own ID, so a repeated prompt draws new shapes
+    next to the earlier diagram instead of overwriting it. It is known before
+    streaming starts, and the layout cache stores shapes without a namespace,
+    so repeated prompts still share its entries.
+    """
+    return diagram_id.replace("-", "")[:16]
+
+def index_shapes(shapes: List[Shape]) -> ShapeIndex:
+    """Wire shapes keyed on their stable ID"""
+    return {shape.id: shape.to_wire() for shape in shapes}
+
+def diff_shapes(old: ShapeIndex, new: ShapeIndex) -> List[Dict[str, Any]]:
+    """
+    Operations that turn one version of a diagram into the next.
+
+    Args:
+        old: Wire shapes of the version the client has
+        new: Wire shapes of the updated version
+
+    Returns:
+        A list of {"op": "delete", "id"}, {"op": "create", "shape"} and
+        {"op": "update", "shape"} operations; updates only carry changed fields
+    """
+    deletes = []
+    creates = []
+    updates = []
+    for shape_id, before in old.items():
+        after = new.get(shape_id)
+        if after is None:
+            deletes.append({"op": "delete", "id": shape_id})
+        elif after != before:
+            change = _shape_change(before, after)
+            if change is None:
+                # Not expressible as a partial update; replace the shape
+                deletes.append({"op": "delete", "id": shape_id})
+                creates.append({"op": "create", "shape": after})
+            else:
+                updates.append({"op": "update", "shape": change})
+    for shape_id, after in new.items():
+        if shape_id not in old:
+            creates.append({"op": "create", "shape": after})
+    return deletes + creates + updates
+
+def _shape_change(before: Dict[str, Any], after: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    before_props = before.get("props", {})
+    after_props = after.get("props", {})
+    if before["type"] != after["type"] or not before_props.keys() <= after_props.keys():
+        return None
+    change: Dict[str, Any] = {"id": after["id"], "type": after["type"]}
+    for key in ("x", "y"):
+        if before.get(key) != after.get(key):
+            change[key] = after.get(key)
+    props = {key: value for key, value in after_props.items() if before_props.get(key) != value}
+    if props:
+        change["props"] = props
+    return change
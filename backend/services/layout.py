@@ -0,0 +1,534 @@
+# backend/services/layout.py
+"""
+Editable layout for flowcharts and process diagrams.
+
+FlowchartLayout places nodes on a fixed-width grid, or in layers that follow
+the connections (see services/layered.py), and keeps that state so a diagram
+can be edited in place: added nodes take a free grid cell, removed nodes leave
+their cell free, moved nodes are pinned where they were put, and only the
+shapes of the nodes and edges involved are rebuilt. Each edit costs
+O(degree of the node + log of free cells) regardless of diagram size.
+
+Connections are routed around the node boxes (see services/routing.py) and
+drawn as one arrow per straight segment. An edit re-routes the connections of
+the nodes it touches and any other route that runs through or just around
+their old or new box.
+"""
+import heapq
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from models.diagram import Connection, Flowchart, FlowchartNode
+from services.shapes import (
+    Shape, ShapeIds, GeoShape, TextShape, ArrowShape, GEO_STYLE, GEO_PROCESS_STYLE, TITLE_STYLE
+)
+from services.diagrams import diff_shapes
+from services.layered import layered_layout
+from services.routing import ROUTE_MARGIN, route
+from services.spatial import SpatialIndex, text_size
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Styling applied while flowchart-like diagrams are built
+FLOWCHART_THEME = {"geo_style": GEO_STYLE, "rectangle_color": None}
+PROCESS_THEME = {"geo_style": GEO_PROCESS_STYLE, "rectangle_color": "light-green"}
+
+# Grid geometry
+START_X, START_Y = 100, 150
+COL_WIDTH, ROW_HEIGHT = 250, 150
+MAX_COLS = 3
+LABEL_OFFSET = 15
+# Space kept between a connection label and other boxes
+LABEL_MARGIN = 4
+# How far from a box an edit looks for routes to re-route; routes that go
+# around a box run just outside ROUTE_MARGIN
+REROUTE_MARGIN = 2 * ROUTE_MARGIN
+
+# Layered node sizing: nodes grow with their text up to a maximum width
+CHAR_WIDTH = 11
+TEXT_PADDING = 40
+MAX_NODE_WIDTH = 320
+LINE_HEIGHT = 30
+
+class LayoutEditError(ValueError):
+    """Raised for an invalid edit; carries the operations of the edits in the batch applied before it"""
+
+    def __init__(self, message: str, ops: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.ops = ops
+
+class PlacedNode:
+    """A node, where it sits and the ID of its shape"""
+
+    __slots__ = ("id", "text", "type", "x", "y", "cell", "shape_id")
+
+    def __init__(self, node_id: Any, text: str, node_type: str, shape_id: str):
+        self.id = node_id
+        self.text = text
+        self.type = node_type
+        self.x = 0
+        self.y = 0
+        # Grid cell index, or None once the node has been moved by hand
+        self.cell: Optional[int] = None
+        self.shape_id = shape_id
+
+class PlacedEdge:
+    """
+    A connection between two nodes and the IDs of its arrow and label shapes.
+
+    A routed connection is drawn as several arrows; the last segment carries
+    the arrowhead and arrow_id, the ones before it are numbered from arrow_id.
+    """
+
+    __slots__ = ("source", "target", "label", "arrow_id", "label_id", "segments")
+
+    def __init__(self, source: Any, target: Any, label: str, arrow_id: str, label_id: Optional[str]):
+        self.source = source
+        self.target = target
+        self.label = label
+        self.arrow_id = arrow_id
+        self.label_id = label_id
+        # Segments drawn before the last one
+        self.segments = 0
+
+    def segment_id(self, index: int) -> str:
+        return f"{self.arrow_id}:segment:{index}"
+
+class FlowchartLayout:
+    """
+    Grid layout of a flowchart that can be edited without moving unaffected nodes.
+
+    Args:
+        data: The flowchart (or process diagram) to lay out
+        namespace: Scopes the stable shape IDs to one diagram
+        theme: FLOWCHART_THEME or PROCESS_THEME
+        layered: Rank nodes along the connections instead of filling a grid
+    """
+
+    def __init__(self, data: Flowchart, namespace: str = "", theme: Dict[str, Any] = FLOWCHART_THEME,
+                 layered: bool = False):
+        self.theme = theme
+        self.layered = layered
+        self.ids = ShapeIds(namespace)
+        self.title = data.title
+        self.description = data.description
+        # Every shape by ID, in drawing order
+        self.shapes: Dict[str, Shape] = {}
+        self.nodes: Dict[Any, PlacedNode] = {}
+        self.edges: Dict[str, PlacedEdge] = {}
+        # Node ID -> arrow IDs of the edges that touch it
+        self.adjacent: Dict[Any, Set[str]] = {}
+        self.cells: Dict[int, Any] = {}
+        self.free_cells: List[int] = []
+        self.next_cell = 0
+        # Top-left of grid cell 0
+        self.origin = (START_X, START_Y)
+        # Nodes added so far, for default IDs and text
+        self.added = 0
+        # Shapes touched by the current edit, with their wire form before it
+        self._before: Dict[str, Optional[Dict[str, Any]]] = {}
+        # Boxes of the title, nodes and labels, so labels can be kept off them
+        self.index = SpatialIndex()
+        # Node boxes alone, which routes go around, and the segments of each route keyed on (arrow ID, index)
+        self.boxes = SpatialIndex()
+        self.routes = SpatialIndex()
+
+        self.title_id = self.ids.make("title")
+        self.set_title(self.title)
+
+        nodes = data.nodes
+        connections = data.connections
+        if layered:
+            self.cols = MAX_COLS
+            self._add_layered(nodes, connections)
+        else:
+            self.cols = min(MAX_COLS, max(1, math.ceil(math.sqrt(len(nodes)))))
+            for node in nodes:
+                self.add_node(node)
+        for conn in connections:
+            self.add_edge(conn)
+        self._before.clear()
+
+    def to_shapes(self) -> List[Shape]:
+        return list(self.shapes.values())
+
+    def to_data(self) -> Flowchart:
+        """The flowchart this layout currently shows"""
+        return Flowchart(
+            title=self.title,
+            description=self.description,
+            nodes=[FlowchartNode(id=node.id, text=node.text, type=node.type) for node in self.nodes.values()],
+            connections=[
+                Connection(source=edge.source, target=edge.target, label=edge.label) for edge in self.edges.values()
+            ],
+        )
+
+    # Edits
+
+    def apply(self, edits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply a batch of graph edits.
+
+        Args:
+            edits: Edits such as {"op": "add_node", "node": {...}}, {"op": "remove_node", "id": ...},
+                {"op": "update_node", "node": {...}}, {"op": "move_node", "id": ..., "x": ..., "y": ...},
+                {"op": "add_edge", "from": ..., "to": ..., "label": ...},
+                {"op": "remove_edge", "from": ..., "to": ..., "label": ...} and {"op": "set_title", "title": ...}
+
+        Returns:
+            Create/update/delete shape operations for the shapes that changed
+
+        Raises:
+            LayoutEditError: If an edit is invalid; the edits before it stay applied
+        """
+        self._before.clear()
+        for edit in edits:
+            try:
+                self._apply_edit(edit)
+            except (ValueError, TypeError, AttributeError) as e:
+                raise LayoutEditError(f"Invalid edit {edit!r}: {e}", self._changes()) from e
+        return self._changes()
+
+    def _apply_edit(self, edit: Dict[str, Any]) -> None:
+        # Edits arrive as client JSON; node IDs are strings, as in the validated flowchart
+        op = edit.get("op")
+        if op == "add_node":
+            node = FlowchartNode.model_validate(edit.get("node") or {})
+            if node.id in self.nodes:
+                raise ValueError(f"Node already exists: {node.id}")
+            self.add_node(node)
+        elif op == "update_node":
+            self.update_node(edit.get("node") or {})
+        elif op == "remove_node":
+            self.remove_node(_node_id(edit.get("id")))
+        elif op == "move_node":
+            self.move_node(_node_id(edit.get("id")), float(edit.get("x", 0)), float(edit.get("y", 0)))
+        elif op == "add_edge":
+            self.add_edge(Connection.model_validate(edit))
+        elif op == "remove_edge":
+            self.remove_edge(_node_id(edit.get("from")), _node_id(edit.get("to")), edit.get("label"))
+        elif op == "set_title":
+            self.set_title(edit.get("title", ""))
+        else:
+            raise ValueError(f"Unknown edit operation: {op}")
+
+    def add_node(self, node: FlowchartNode) -> None:
+        placed = self._new_node(node)
+        # Fill the lowest free cell first so a removed node's gap is reused
+        cell = heapq.heappop(self.free_cells) if self.free_cells else self._claim_next_cell()
+        self._place(placed, cell)
+        self._register(placed)
+
+    def update_node(self, node: Dict[str, Any]) -> None:
+        placed = self.nodes.get(_node_id(node.get("id")))
+        if placed is None:
+            raise ValueError(f"Unknown node: {node.get('id')}")
+        placed.text = node.get("text", placed.text)
+        placed.type = node.get("type", placed.type)
+        self._draw_node(placed)
+
+    def remove_node(self, node_id: Any) -> None:
+        placed = self.nodes.pop(node_id, None)
+        if placed is None:
+            raise ValueError(f"Unknown node: {node_id}")
+        for arrow_id in list(self.adjacent.pop(node_id, ())):
+            self._drop_edge(arrow_id)
+        if placed.cell is not None:
+            del self.cells[placed.cell]
+            heapq.heappush(self.free_cells, placed.cell)
+        box = self.boxes.boxes.get(placed.shape_id)
+        self.index.remove(placed.shape_id)
+        self.boxes.remove(placed.shape_id)
+        self._set_shape(placed.shape_id, None)
+        # Routes that went around the box may now go straight
+        if box is not None:
+            self._reroute(self._routes_near(*box))
+
+    def move_node(self, node_id: Any, x: float, y: float) -> None:
+        placed = self.nodes.get(node_id)
+        if placed is None:
+            raise ValueError(f"Unknown node: {node_id}")
+        if placed.cell is not None:
+            # A hand-placed node gives up its grid cell
+            del self.cells[placed.cell]
+            heapq.heappush(self.free_cells, placed.cell)
+            placed.cell = None
+        placed.x, placed.y = x, y
+        self._draw_node(placed)
+
+    def add_edge(self, conn: Connection) -> None:
+        source, target = conn.source, conn.target
+        if source not in self.nodes or target not in self.nodes:
+            return
+        label = conn.label or ""
+        label_id = self.ids.make("label", source, target) if label else None
+        edge = PlacedEdge(source, target, label, self.ids.make("arrow", source, target), label_id)
+        self.edges[edge.arrow_id] = edge
+        self.adjacent[source].add(edge.arrow_id)
+        self.adjacent[target].add(edge.arrow_id)
+        self._draw_edge(edge)
+
+    def remove_edge(self, source: Any, target: Any, label: Optional[str] = None) -> None:
+        for arrow_id in self.adjacent.get(source, ()):
+            edge = self.edges[arrow_id]
+            if edge.source == source and edge.target == target and (label is None or edge.label == label):
+                self._drop_edge(arrow_id)
+                return
+        raise ValueError(f"No connection from {source} to {target}")
+
+    def set_title(self, title: str) -> None:
+        self.title = title
+        self.index.insert(self.title_id, 100, 50, *text_size(title, "xl"))
+        self._set_shape(self.title_id, TextShape(100, 50, title, size="xl", style=TITLE_STYLE, id=self.title_id))
+
+    # Internals
+
+    def _new_node(self, node: FlowchartNode) -> PlacedNode:
+        self.added += 1
+        index = self.added
+        node_id = node.id if node.id is not None else str(index)
+        text = node.text if node.text is not None else f"Node {index}"
+        return PlacedNode(node_id, text, node.type, self.ids.make("node", node_id))
+
+    def _register(self, placed: PlacedNode) -> None:
+        self.nodes[placed.id] = placed
+        self.adjacent.setdefault(placed.id, set())
+        self._draw_node(placed)
+
+    def _add_layered(self, nodes: List[FlowchartNode], connections: List[Connection]) -> None:
+        placed_nodes = [self._new_node(node) for node in nodes]
+        # A repeated node ID refers to its last occurrence, as for connections
+        index = {placed.id: i for i, placed in enumerate(placed_nodes)}
+        edges = []
+        for conn in connections:
+            source, target = index.get(conn.source), index.get(conn.target)
+            if source is not None and target is not None:
+                edges.append((source, target))
+        sizes = [self._node_size(placed.type, placed.text) for placed in placed_nodes]
+
+        positions = layered_layout(sizes, edges, (START_X, START_Y))
+        bottom = START_Y
+        for placed, (x, y), (_, h) in zip(placed_nodes, positions, sizes):
+            placed.x, placed.y = x, y
+            bottom = max(bottom, y + h)
+            self._register(placed)
+        # Nodes added by later edits go in a grid below the layers
+        if placed_nodes:
+            self.origin = (START_X, bottom + ROW_HEIGHT)
+
+    def _claim_next_cell(self) -> int:
+        cell = self.next_cell
+        self.next_cell += 1
+        return cell
+
+    def _place(self, placed: PlacedNode, cell: int) -> None:
+        placed.cell = cell
+        placed.x = self.origin[0] + (cell % self.cols) * COL_WIDTH
+        placed.y = self.origin[1] + (cell // self.cols) * ROW_HEIGHT
+        self.cells[cell] = placed.id
+
+    def _node_size(self, node_type: str, text: str) -> Tuple[float, float]:
+        geo_type = _geo_type(node_type)
+        width = 160 if geo_type != "diamond" else 180
+        height = 80 if geo_type != "diamond" else 100
+        if not self.layered:
+            return width, height
+        # Diamonds and ellipses only fit text in their middle
+        scale = 1.5 if geo_type == "diamond" else 1.2 if geo_type == "ellipse" else 1
+        text_width = (len(str(text)) * CHAR_WIDTH + TEXT_PADDING) * scale
+        lines = max(1, math.ceil(text_width / MAX_NODE_WIDTH))
+        return min(MAX_NODE_WIDTH, max(width, text_width)), height + (lines - 1) * LINE_HEIGHT
+
+    def _node_shape(self, placed: PlacedNode) -> GeoShape:
+        node_type = placed.type
+        geo_type = _geo_type(node_type)
+        width, height = self._node_size(node_type, placed.text)
+
+        # Determine color based on node type
+        color = "light-blue"  # Default
+        if node_type == "start":
+            color = "blue"
+        elif node_type == "end":
+            color = "green"
+        elif node_type == "decision":
+            color = "orange"
+        rectangle_color = self.theme["rectangle_color"]
+        if rectangle_color and geo_type == "rectangle":
+            color = rectangle_color
+
+        return GeoShape(
+            placed.x, placed.y, width, height, geo_type, color, placed.text, self.theme["geo_style"], placed.shape_id
+        )
+
+    def _draw_node(self, placed: PlacedNode) -> None:
+        shape = self._node_shape(placed)
+        old_box = self.boxes.boxes.get(placed.shape_id)
+        self.index.insert(placed.shape_id, shape.x, shape.y, shape.w, shape.h)
+        self.boxes.insert(placed.shape_id, shape.x, shape.y, shape.w, shape.h)
+        self._set_shape(placed.shape_id, shape)
+
+        # Re-route the node's own connections and any route crossing its old or new box
+        affected = set(self.adjacent.get(placed.id, ()))
+        if self.routes:
+            affected.update(self._routes_near(shape.x, shape.y, shape.w, shape.h))
+            if old_box is not None:
+                affected.update(self._routes_near(*old_box))
+        self._reroute(affected)
+
+    def _routes_near(self, x: float, y: float, w: float, h: float) -> Set[str]:
+        """Arrow IDs of the routes with a segment in or just around a box"""
+        return {arrow_id for arrow_id, _ in self.routes.query(x, y, w, h, REROUTE_MARGIN)}
+
+    def _reroute(self, arrow_ids: Iterable[str]) -> None:
+        # Sorted, so labels are placed in the same order every time
+        for arrow_id in sorted(arrow_ids):
+            self._draw_edge(self.edges[arrow_id])
+
+    def _draw_label(self, edge: PlacedEdge, x: float, y: float) -> None:
+        # Nearest spot to (x, y) that keeps the label off nodes and other labels
+        x, y = self.index.place(edge.label_id, x, y, *text_size(edge.label), LABEL_MARGIN)
+        self._set_shape(edge.label_id, TextShape(x, y, edge.label, id=edge.label_id))
+
+    def _draw_edge(self, edge: PlacedEdge) -> None:
+        start_port, start_dir, end_port, end_dir = self._ports(self.nodes[edge.source], self.nodes[edge.target])
+        points = route(self.boxes, start_port, start_dir, end_port, end_dir)
+        segments = list(zip(points, points[1:]))
+        # Filed segment by segment rather than by bounds, so a long route is
+        # only found by edits near where it actually runs
+        self._unfile_route(edge)
+        for index, ((from_x, from_y), (to_x, to_y)) in enumerate(segments):
+            self.routes.insert(
+                (edge.arrow_id, index), min(from_x, to_x), min(from_y, to_y), abs(to_x - from_x), abs(to_y - from_y)
+            )
+
+        for index, ((from_x, from_y), (to_x, to_y)) in enumerate(segments[:-1]):
+            segment_id = edge.segment_id(index)
+            self._set_shape(segment_id, ArrowShape(
+                from_x, from_y, to_x - from_x, to_y - from_y, arrowhead_end="none", id=segment_id
+            ))
+        for index in range(len(segments) - 1, edge.segments):
+            self._set_shape(edge.segment_id(index), None)
+        edge.segments = len(segments) - 1
+        (from_x, from_y), (to_x, to_y) = segments[-1]
+        self._set_shape(edge.arrow_id, ArrowShape(
+            from_x, from_y, to_x - from_x, to_y - from_y, id=edge.arrow_id
+        ))
+
+        if edge.label_id:
+            # Label sits slightly off the middle of the longest segment
+            (from_x, from_y), (to_x, to_y) = max(
+                segments, key=lambda segment: abs(segment[1][0] - segment[0][0]) + abs(segment[1][1] - segment[0][1])
+            )
+            mid_x = (from_x + to_x) / 2
+            mid_y = (from_y + to_y) / 2
+            self._draw_label(edge, mid_x + LABEL_OFFSET, mid_y - LABEL_OFFSET)
+
+    def _ports(self, start: PlacedNode, end: PlacedNode) -> Tuple[Tuple[float, float], str, Tuple[float, float], str]:
+        """Where a connection leaves and enters the two boxes, and in which directions"""
+        start_w, start_h = self._node_size(start.type, start.text)
+        end_w, end_h = self._node_size(end.type, end.text)
+        if start is end:
+            # A self-loop leaves on the right and comes back in at the top
+            return (start.x + start_w, start.y + start_h / 2), "right", (start.x + start_w / 2, start.y), "down"
+        if end.y >= start.y + start_h:
+            return (start.x + start_w / 2, start.y + start_h), "down", (end.x + end_w / 2, end.y), "down"
+        if end.y + end_h <= start.y:
+            # Loops back up along the right-hand sides, clear of the downward arrows
+            return (start.x + start_w, start.y + start_h / 2), "right", (end.x + end_w, end.y + end_h / 2), "left"
+        if end.x >= start.x:
+            return (start.x + start_w, start.y + start_h / 2), "right", (end.x, end.y + end_h / 2), "right"
+        return (start.x, start.y + start_h / 2), "left", (end.x + end_w, end.y + end_h / 2), "left"
+
+    def _drop_edge(self, arrow_id: str) -> None:
+        edge = self.edges.pop(arrow_id)
+        self.adjacent.get(edge.source, set()).discard(arrow_id)
+        self.adjacent.get(edge.target, set()).discard(arrow_id)
+        if edge.label_id:
+            self.index.remove(edge.label_id)
+            self._set_shape(edge.label_id, None)
+        for index in range(edge.segments):
+            self._set_shape(edge.segment_id(index), None)
+        self._unfile_route(edge)
+        self._set_shape(arrow_id, None)
+
+    def _unfile_route(self, edge: PlacedEdge) -> None:
+        # The inner segments and the last one, which carries the arrowhead
+        for index in range(edge.segments + 1):
+            self.routes.remove((edge.arrow_id, index))
+
+    def _set_shape(self, shape_id: str, shape: Optional[Shape]) -> None:
+        if shape_id not in self._before:
+            previous = self.shapes.get(shape_id)
+            self._before[shape_id] = previous.to_wire() if previous is not None else None
+        if shape is None:
+            self.shapes.pop(shape_id, None)
+        else:
+            self.shapes[shape_id] = shape
+
+    def _changes(self) -> List[Dict[str, Any]]:
+        before = {shape_id: wire for shape_id, wire in self._before.items() if wire is not None}
+        after = {shape_id: self.shapes[shape_id].to_wire() for shape_id in self._before if shape_id in self.shapes}
+        self._before.clear()
+        return diff_shapes(before, after)
+
+def _geo_type(node_type: str) -> str:
+    # Determine shape geometry based on node type
+    if node_type == "start" or node_type == "end":
+        return "ellipse"
+    if node_type == "decision":
+        return "diamond"
+    if node_type == "input":
+        return "parallelogram"
+    return "rectangle"
+
+def _node_id(value: Any) -> Optional[str]:
+    # Clients may send numeric IDs; the layout keys nodes on strings
+    return None if value is None else str(value)
+
+def graph_edits(old: Flowchart, new: Flowchart) -> List[Dict[str, Any]]:
+    """
+    Edits that turn one version of a flowchart into another.
+    
+    Nodes are matched on ID and connections on (from, to, label), so the
+    nodes both versions share keep their place when the edits are applied.
+    """
+    edits: List[Dict[str, Any]] = []
+    if new.title != old.title:
+        edits.append({"op": "set_title", "title": new.title})
+
+    old_nodes = {node.id: node for node in old.nodes}
+    new_nodes = {node.id: node for node in new.nodes}
+    old_edges = _count_edges(old, old_nodes)
+    new_edges = _count_edges(new, new_nodes)
+
+    # Connections of a removed node go away with it
+    for (source, target, label), count in old_edges.items():
+        if source in new_nodes and target in new_nodes:
+            for _ in range(count - new_edges.get((source, target, label), 0)):
+                edits.append({"op": "remove_edge", "from": source, "to": target, "label": label})
+    for node_id in old_nodes:
+        if node_id not in new_nodes:
+            edits.append({"op": "remove_node", "id": node_id})
+
+    for node_id, node in new_nodes.items():
+        before = old_nodes.get(node_id)
+        if before is None:
+            edits.append({"op": "add_node", "node": node.model_dump(exclude_none=True)})
+        elif before.text != node.text or before.type != node.type:
+            edits.append({"op": "update_node", "node": node.model_dump(exclude_none=True)})
+
+    for (source, target, label), count in new_edges.items():
+        for _ in range(count - old_edges.get((source, target, label), 0)):
+            edits.append({"op": "add_edge", "from": source, "to": target, "label": label})
+    return edits
+
+def _count_edges(data: Flowchart, nodes: Dict[Any, FlowchartNode]) -> Dict[Tuple[Any, Any, str], int]:
+    # Connections to unknown nodes are never drawn, so they are left out
+    counts: Dict[Tuple[Any, Any, str], int] = {}
+    for conn in data.connections:
+        key = (conn.source, conn.target, conn.label or "")
+        if key[0] in nodes and key[1] in nodes:
+            counts[key] = counts.get(key, 0) + 1
+    return counts
@@ -0,0 +1,159 @@
+# backend/services/radial.py
+"""
+Radial tree layout for mind maps, computed with NumPy array operations.
+
+The tree is given as flat arrays in breadth-first order, so every depth level
+is one contiguous slice and each step below is a handful of array operations
+per level rather than a Python loop per node:
+
+1. Subtree weights (leaf counts) are summed bottom-up.
+2. Every node gets an angular sector of its parent's sector, sized by weight.
+3. Each level sits on a ring wide enough for its boxes to fit their sectors
+   and far enough out to clear the ring inside it.
+4. A final pass pushes apart any boxes that still overlap, all at once.
+"""
+import logging
+from typing import Tuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Minimum space between rings and between neighbouring boxes
+RING_GAP = 60
+NODE_GAP = 20
+
+# Overlap resolution: passes over all boxes, and how many neighbours (in x
+# order) each box is checked against per pass
+OVERLAP_PASSES = 8
+OVERLAP_WINDOW = 16
+
+def radial_layout(
+    parents: np.ndarray,
+    depths: np.ndarray,
+    widths: np.ndarray,
+    heights: np.ndarray,
+    center: Tuple[float, float] = (0, 0),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Center points for the boxes of a tree drawn around its root.
+
+    Args:
+        parents: Index of each node's parent, -1 for the root; nodes are in
+            breadth-first order with siblings next to each other, root first
+        depths: Depth of each node, 0 for the root
+        widths: Box width of each node
+        heights: Box height of each node
+        center: Where the root is drawn
+
+    Returns:
+        The x and y center of each node
+    """
+    count = len(parents)
+    if count == 0:
+        return np.zeros(0), np.zeros(0)
+    widths = widths.astype(float)
+    heights = heights.astype(float)
+    levels = np.searchsorted(depths, np.arange(depths[-1] + 2))
+
+    weights = _subtree_weights(parents, levels)
+    start, span = _sectors(parents, weights, levels)
+    angles = start + span / 2
+    cos, sin = np.cos(angles), np.sin(angles)
+
+    radii = _ring_radii(depths, levels, widths, heights, cos, sin, span)
+    x = center[0] + radii[depths] * cos
+    y = center[1] + radii[depths] * sin
+    _resolve_overlaps(x, y, widths, heights)
+    return x, y
+
+def _subtree_weights(parents: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    # A leaf weighs 1 and a parent the sum of its children, i.e. its leaf count
+    count = len(parents)
+    has_children = np.zeros(count, dtype=bool)
+    has_children[parents[1:]] = True
+    weights = np.where(has_children, 0.0, 1.0)
+    for depth in range(len(levels) - 2, 0, -1):
+        lo, hi = levels[depth], levels[depth + 1]
+        np.add.at(weights, parents[lo:hi], weights[lo:hi])
+    return weights
+
+def _sectors(parents: np.ndarray, weights: np.ndarray, levels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Start angle and angular width of each node's sector
+    count = len(parents)
+    start = np.zeros(count)
+    span = np.zeros(count)
+    span[0] = 2 * np.pi
+    for depth in range(1, len(levels) - 1):
+        lo, hi = levels[depth], levels[depth + 1]
+        level_parents = parents[lo:hi]
+        level_weights = weights[lo:hi]
+        # Weight of the earlier siblings of each node, from a cumulative sum
+        # over the level minus its value where the sibling group starts
+        before = np.cumsum(level_weights) - level_weights
+        first = np.ones(hi - lo, dtype=bool)
+        first[1:] = level_parents[1:] != level_parents[:-1]
+        group_start = np.maximum.accumulate(np.where(first, before, 0))
+        share = span[level_parents] / weights[level_parents]
+        start[lo:hi] = start[level_parents] + (before - group_start) * share
+        span[lo:hi] = level_weights * share
+    return start, span
+
+def _ring_radii(
+    depths: np.ndarray,
+    levels: np.ndarray,
+    widths: np.ndarray,
+    heights: np.ndarray,
+    cos: np.ndarray,
+    sin: np.ndarray,
+    span: np.ndarray,
+) -> np.ndarray:
+    # Extent of each box along and across the ring at its angle
+    radial_extent = np.abs(widths * cos) + np.abs(heights * sin)
+    tangent_extent = np.abs(widths * sin) + np.abs(heights * cos) + NODE_GAP
+    radii = np.zeros(len(levels) - 1)
+    inner_extent = max(widths[0], heights[0])
+    for depth in range(1, len(levels) - 1):
+        lo, hi = levels[depth], levels[depth + 1]
+        outer_extent = radial_extent[lo:hi].max()
+        clear = radii[depth - 1] + (inner_extent + outer_extent) / 2 + RING_GAP
+        # Each box's arc at radius r is r * span, which must hold the box
+        fit = (tangent_extent[lo:hi] / np.minimum(span[lo:hi], np.pi)).max()
+        radii[depth] = max(clear, fit)
+        inner_extent = outer_extent
+    return radii
+
+def _resolve_overlaps(x: np.ndarray, y: np.ndarray, widths: np.ndarray, heights: np.ndarray) -> None:
+    """Push overlapping boxes apart along their axis of least overlap; the root stays put"""
+    count = len(x)
+    window = min(OVERLAP_WINDOW, count - 1)
+    for _ in range(OVERLAP_PASSES):
+        order = np.argsort(x, kind="stable")
+        shift_x = np.zeros(count)
+        shift_y = np.zeros(count)
+        overlapping = False
+        for offset in range(1, window + 1):
+            a, b = order[:-offset], order[offset:]
+            dx = x[b] - x[a]
+            dy = y[b] - y[a]
+            over_x = (widths[a] + widths[b]) / 2 + NODE_GAP - np.abs(dx)
+            over_y = (heights[a] + heights[b]) / 2 + NODE_GAP - np.abs(dy)
+            hit = (over_x > 0) & (over_y > 0)
+            if not hit.any():
+                continue
+            overlapping = True
+            a, b, dx, dy, over_x, over_y = a[hit], b[hit], dx[hit], dy[hit], over_x[hit], over_y[hit]
+            along_x = over_x <= over_y
+            # Each box of a pair moves half the overlap away from the other
+            push_x = np.where(along_x, np.where(dx >= 0, over_x, -over_x) / 2, 0)
+            push_y = np.where(along_x, 0, np.where(dy >= 0, over_y, -over_y) / 2)
+            np.add.at(shift_x, b, push_x)
+            np.add.at(shift_x, a, -push_x)
+            np.add.at(shift_y, b, push_y)
+            np.add.at(shift_y, a, -push_y)
+        if not overlapping:
+            return
+        shift_x[0] = shift_y[0] = 0
+        x += shift_x
+        y += shift_y
@@ -0,0 +1,300 @@
+# backend/services/routing.py
+"""
+Orthogonal arrow routing around node boxes.
+
+route() joins two ports with horizontal and vertical segments that keep clear
+of the boxes in a SpatialIndex. The cheap shapes are tried first: a straight
+line, a Z through the middle and the two L-shapes. Only when all of them are
+blocked is A* run over a sparse routing graph, whose coordinates are the ports
+and the padded sides of the boxes near them, with a penalty for every bend.
+For ports far apart only the boxes along the cheap routes count as near, so
+the search stays within a corridor around them, and before searching the Z is
+tried with its middle segment moved into each gap beside those boxes.
+
+Searched routes are cached on their ports and the boxes around them, so laying
+out a diagram again only searches for routes near boxes that moved.
+"""
+import bisect
+import heapq
+import logging
+import math
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from services.cache import route_cache
+from services.spatial import SpatialIndex
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+
+# Directions a segment can run in, clockwise from "right"
+DIRECTIONS = ("right", "down", "left", "up")
+STEPS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+# Clearance kept between a route and the boxes it passes
+ROUTE_MARGIN = 12
+# Straight run out of a port before the first bend
+STUB_LENGTH = 24
+# Extra cost of a bend, in pixels of route length
+BEND_PENALTY = 40
+
+# How far past the ports (or, for long routes, the cheap routes) the search may detour
+ROUTE_PADDING = 150
+# Ports further apart than this many grid cells only search a corridor around the cheap routes
+MAX_ROUTE_CELLS = 96
+# Bounds on the A* search (points in its routing graph and points expanded);
+# beyond them the route falls back to a plain Z
+MAX_ROUTE_POINTS = 10000
+MAX_EXPANSIONS = 4000
+# Weight on the A* estimate; above 1 the search heads for the goal more
+# greedily, trading slightly longer routes for far fewer expansions
+SEARCH_WEIGHT = 2
+
+def route(index: SpatialIndex, start: Point, start_dir: str, end: Point, end_dir: str) -> Optional[List[Point]]:
+    """
+    Orthogonal route between two ports that avoids the boxes in the index.
+
+    Args:
+        index: Boxes to keep clear of, including the two boxes being joined
+        start: Port the route leaves from
+        start_dir: Direction it leaves in, one of DIRECTIONS
+        end: Port the route arrives at
+        end_dir: Direction it arrives in
+
+    Returns:
+        The corner points of the route, from start to end. When no clear
+        route is found within the search bounds this is the plain Z, which
+        may cross boxes
+    """
+    a = _stub(start, start_dir, 1)
+    b = _stub(end, end_dir, -1)
+    candidates = _candidates(a, start_dir, b)
+    for points in candidates:
+        if all(_clear(index, p, q) for p, q in zip(points, points[1:])):
+            return _simplify([start, *points, end])
+
+    left, top = min(a[0], b[0]) - ROUTE_PADDING, min(a[1], b[1]) - ROUTE_PADDING
+    right, bottom = max(a[0], b[0]) + ROUTE_PADDING, max(a[1], b[1]) + ROUTE_PADDING
+    size = index.cell_size
+    far = math.ceil((right - left) / size) * math.ceil((bottom - top) / size) > MAX_ROUTE_CELLS
+    if far:
+        # Every box between far-apart ports would make the search too big; the
+        # boxes along the cheap routes give it the gaps to detour through
+        keys = set()
+        for points in candidates:
+            for p, q in zip(points, points[1:]):
+                keys.update(index.query(
+                    min(p[0], q[0]), min(p[1], q[1]), abs(p[0] - q[0]), abs(p[1] - q[1]), ROUTE_PADDING
+                ))
+    else:
+        keys = index.query(left, top, right - left, bottom - top)
+    boxes = tuple(sorted(index.boxes[key] for key in keys))
+    key = (start, start_dir, end, end_dir, boxes)
+    points = route_cache.get(key)
+    if points is None:
+        # Far-apart ports mostly need no more than a Z through a gap, which is
+        # much cheaper to find than searching a long corridor
+        found = _slid_z(index, a, start_dir, b, boxes) if far else None
+        if found is None:
+            found = _search(index, a, start_dir, b, end_dir, boxes)
+        points = _simplify([start, *(found or candidates[0]), end])
+        route_cache.set(key, points)
+    return points
+
+def _stub(port: Point, direction: str, sign: int) -> Point:
+    # The point STUB_LENGTH out of a port, along (or against) a direction
+    step_x, step_y = STEPS[DIRECTIONS.index(direction)]
+    return port[0] + sign * step_x * STUB_LENGTH, port[1] + sign * step_y * STUB_LENGTH
+
+def _candidates(a: Point, start_dir: str, b: Point) -> List[List[Point]]:
+    """Cheap routes from a to b, the preferred one first; the first is always a Z"""
+    mid_x, mid_y = (a[0] + b[0]) / 2, (a[1] + b[1]) / 2
+    vertical_z = [a, (a[0], mid_y), (b[0], mid_y), b]
+    horizontal_z = [a, (mid_x, a[1]), (mid_x, b[1]), b]
+    vertical_l = [a, (a[0], b[1]), b]
+    horizontal_l = [a, (b[0], a[1]), b]
+    # Start along the axis the route leaves its port on
+    if start_dir in ("down", "up"):
+        return [vertical_z, vertical_l, horizontal_l, horizontal_z]
+    return [horizontal_z, horizontal_l, vertical_l, vertical_z]
+
+def _clear(index: SpatialIndex, p: Point, q: Point) -> bool:
+    return index.is_free(min(p[0], q[0]), min(p[1], q[1]), abs(p[0] - q[0]), abs(p[1] - q[1]), ROUTE_MARGIN)
+
+def _side_lines(boxes: Sequence[Tuple[float, float, float, float]]) -> Tuple[Set[float], Set[float]]:
+    """x and y of the lines just outside the boxes' sides"""
+    # One past the margin, so a route along a box side is clear of it
+    gap = ROUTE_MARGIN + 1
+    xs = {*(x - gap for x, _, _, _ in boxes), *(x + w + gap for x, _, w, _ in boxes)}
+    ys = {*(y - gap for _, y, _, _ in boxes), *(y + h + gap for _, y, _, h in boxes)}
+    return xs, ys
+
+def _slid_z(
+    index: SpatialIndex,
+    a: Point,
+    start_dir: str,
+    b: Point,
+    boxes: Sequence[Tuple[float, float, float, float]],
+) -> Optional[List[Point]]:
+    """The shortest clear Z from a to b whose middle segment runs along a box side, if any"""
+    side_xs, side_ys = _side_lines(boxes)
+    vertical_first = start_dir in ("down", "up")
+    slides = []
+    for horizontal, middles in ((True, sorted(side_xs)), (False, sorted(side_ys))):
+        # Both legs must reach the middle segment; how far they can reach bounds where it goes
+        low_a, high_a = _reach(index, a, horizontal, middles)
+        low_b, high_b = _reach(index, b, horizontal, middles)
+        low, high = max(low_a, low_b), min(high_a, high_b)
+        axis = 0 if horizontal else 1
+        near, far = min(a[axis], b[axis]), max(a[axis], b[axis])
+        for middle in middles[bisect.bisect_left(middles, low):bisect.bisect_right(middles, high)]:
+            # Ordered by how much longer than the plain Z they are, then the axis the route leaves on
+            slides.append((2 * max(near - middle, middle - far, 0), vertical_first == horizontal, middle, horizontal))
+    slides.sort()
+    for _, _, middle, horizontal in slides:
+        if horizontal:
+            p, q = (middle, a[1]), (middle, b[1])
+        else:
+            p, q = (a[0], middle), (b[0], middle)
+        if _clear(index, p, q):
+            return [a, p, q, b]
+    return None
+
+def _reach(index: SpatialIndex, point: Point, horizontal: bool, values: List[float]) -> Tuple[float, float]:
+    """
+    The lowest and highest of the sorted values a straight segment from point
+    along one axis can run to while clear of the boxes.
+
+    A segment blocked at some value stays blocked further out, so each side is
+    a binary search.
+    """
+    axis = 0 if horizontal else 1
+
+    def clear_to(value: float) -> bool:
+        end = (value, point[1]) if horizontal else (point[0], value)
+        return _clear(index, point, end)
+
+    # Count the clear values going up from the point, then going down
+    first = bisect.bisect_right(values, point[axis])
+    low, high = first, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if clear_to(values[middle]):
+            low = middle + 1
+        else:
+            high = middle
+    highest = values[low - 1] if low > first else point[axis]
+    last = bisect.bisect_left(values, point[axis])
+    low, high = 0, last
+    while low < high:
+        middle = (low + high) // 2
+        if clear_to(values[middle]):
+            high = middle
+        else:
+            low = middle + 1
+    lowest = values[low] if low < last else point[axis]
+    return lowest, highest
+
+def _search(
+    index: SpatialIndex,
+    a: Point,
+    start_dir: str,
+    b: Point,
+    end_dir: str,
+    boxes: Sequence[Tuple[float, float, float, float]],
+) -> Optional[List[Point]]:
+    """A* over the grid of lines through the ports and just outside the boxes' sides"""
+    side_xs, side_ys = _side_lines(boxes)
+    xs = sorted({a[0], b[0], *side_xs})
+    ys = sorted({a[1], b[1], *side_ys})
+    if len(xs) * len(ys) > MAX_ROUTE_POINTS:
+        return None
+    column = {x: i for i, x in enumerate(xs)}
+    row = {y: j for j, y in enumerate(ys)}
+    goal = (column[b[0]], row[b[1]])
+    final = DIRECTIONS.index(end_dir)
+
+    def estimate(i: int, j: int, direction: int) -> float:
+        dx, dy = b[0] - xs[i], b[1] - ys[j]
+        distance = abs(dx) + abs(dy)
+        # Unless the goal lies straight ahead, at least one more bend is needed
+        step_x, step_y = STEPS[direction]
+        if dx * step_y != dy * step_x or dx * step_x + dy * step_y < 0:
+            distance += BEND_PENALTY
+        return distance
+
+    # Whether the segment from grid point (i, j) to the next one right or down
+    # is clear, by (i, j, vertical); each is checked at most once
+    clear: Dict[Tuple[int, int, bool], bool] = {}
+
+    first = (column[a[0]], row[a[1]], DIRECTIONS.index(start_dir))
+    best: Dict[Tuple[int, int, int], float] = {first: 0}
+    came_from: Dict[Tuple[int, int, int], Tuple[int, int, int]] = {}
+    # Ties go to the route furthest along, which keeps the search narrow
+    frontier = [(estimate(*first), 0.0, first)]
+    expansions = 0
+    while frontier:
+        _, negative_cost, state = heapq.heappop(frontier)
+        cost = -negative_cost
+        if cost > best[state]:
+            continue
+        i, j, direction = state
+        if (i, j) == goal:
+            return _path(state, came_from, xs, ys)
+        expansions += 1
+        if expansions > MAX_EXPANSIONS:
+            break
+        for turn, (step_x, step_y) in enumerate(STEPS):
+            if turn == (direction + 2) % 4:
+                continue
+            next_i, next_j = i + step_x, j + step_y
+            if not (0 <= next_i < len(xs) and 0 <= next_j < len(ys)):
+                continue
+            p, q = (xs[i], ys[j]), (xs[next_i], ys[next_j])
+            segment = (min(i, next_i), min(j, next_j), step_x == 0)
+            is_clear = clear.get(segment)
+            if is_clear is None:
+                is_clear = clear[segment] = _clear(index, p, q)
+            if not is_clear:
+                continue
+            next_cost = cost + abs(q[0] - p[0]) + abs(q[1] - p[1])
+            if turn != direction:
+                next_cost += BEND_PENALTY
+            if (next_i, next_j) == goal and turn != final:
+                # Arriving sideways means one more bend into the port
+                next_cost += BEND_PENALTY
+            next_state = (next_i, next_j, turn)
+            if next_cost < best.get(next_state, math.inf):
+                best[next_state] = next_cost
+                came_from[next_state] = state
+                heapq.heappush(frontier, (next_cost + SEARCH_WEIGHT * estimate(*next_state), -next_cost, next_state))
+    logger.debug(f"No route found from {a} to {b} after {expansions} expansions")
+    return None
+
+def _path(
+    state: Tuple[int, int, int],
+    came_from: Dict[Tuple[int, int, int], Tuple[int, int, int]],
+    xs: List[float],
+    ys: List[float],
+) -> List[Point]:
+    points = [(xs[state[0]], ys[state[1]])]
+    while state in came_from:
+        state = came_from[state]
+        points.append((xs[state[0]], ys[state[1]]))
+    points.reverse()
+    return points
+
+def _simplify(points: List[Point]) -> List[Point]:
+    """Drop repeated points and the middle one of any three in a line"""
+    simple: List[Point] = []
+    for point in points:
+        if simple and point == simple[-1]:
+            continue
+        if len(simple) >= 2:
+            (x0, y0), (x1, y1) = simple[-2], simple[-1]
+            if (x0 == x1 == point[0]) or (y0 == y1 == point[1]):
+                simple[-1] = point
+                continue
+        simple.append(point)
+    return simple
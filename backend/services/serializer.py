@@ -0,0 +1,81 @@
+# backend/services/serializer.py
+"""
+JSON encoding for WebSocket frames.
+
+Uses orjson when it is installed and falls back to the stdlib encoder. Frames
+are encoded once into an EncodedFrame, which can be sent to any number of
+sockets, and shape lists can be pre-encoded (e.g. by the layout cache) and
+spliced into a frame without being encoded again.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from services.shapes import encode_shape
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# "auto" uses orjson when available; "json" forces the stdlib encoder
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "auto").lower()
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=encode_shape).encode("utf-8")
+
+def _orjson_dumps(obj: Any) -> bytes:
+    try:
+        return orjson.dumps(obj, default=encode_shape)
+    except orjson.JSONEncodeError:
+        # orjson is stricter (e.g. integers beyond 64 bits); the stdlib handles those
+        return _stdlib_dumps(obj)
+
+if JSON_SERIALIZER != "json" and orjson is not None:
+    dumps = _orjson_dumps
+    SERIALIZER_NAME = "orjson"
+else:
+    if JSON_SERIALIZER not in ("auto", "json"):
+        logger.warning(f"Unknown JSON_SERIALIZER '{JSON_SERIALIZER}', using the stdlib encoder")
+    dumps = _stdlib_dumps
+    SERIALIZER_NAME = "json"
+
+class EncodedFrame:
+    """A message encoded once, ready to be sent as a text frame to any socket"""
+
+    __slots__ = ("data", "_text")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        # WebSocket text frames take a str; decode once and share it
+        if self._text is None:
+            self._text = self.data.decode("utf-8")
+        return self._text
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+def encode_frame(message: Dict[str, Any], shapes: Optional[bytes] = None) -> EncodedFrame:
+    """
+    Encode a WebSocket message.
+
+    Args:
+        message: The message fields
+        shapes: An already encoded JSON array, added to the message as "shapes"
+
+    Returns:
+        The encoded frame
+    """
+    data = dumps(message)
+    if shapes is not None:
+        separator = b"," if len(data) > 2 else b""
+        data = data[:-1] + separator + b'"shapes":' + shapes + b"}"
+    return EncodedFrame(data)
@@ -0,0 +1,150 @@
+# backend/services/shapes.py
+"""
+Compact shape records produced by the layout generators.
+
+Generators build these small __slots__ objects instead of nested dicts, with
+the constant props (font, alignment, fill) shared through style presets. They
+are turned into TLDraw wire JSON only once, when a frame is encoded: pass
+encode_shape as the `default` hook of json.dumps.
+
+Shape IDs are derived from what a shape represents (e.g. "node 3", "arrow
+from 2 to 3") rather than from its position in the output, so regenerating
+a slightly changed diagram keeps the IDs of the shapes that carried over.
+"""
+from typing import Any, Dict, List
+
+# Shared extra props; presets are never mutated
+GEO_STYLE: Dict[str, str] = {"align": "middle", "font": "draw"}
+GEO_SOLID_STYLE: Dict[str, str] = {"align": "middle", "font": "draw", "fill": "solid"}
+GEO_SOLID_DRAW_STYLE: Dict[str, str] = {"align": "middle", "font": "draw", "fill": "solid", "dash": "draw"}
+GEO_DRAW_STYLE: Dict[str, str] = {"align": "middle", "font": "draw", "dash": "draw"}
+GEO_PROCESS_STYLE: Dict[str, str] = {"align": "middle", "font": "draw", "dash": "solid"}
+TEXT_STYLE: Dict[str, str] = {}
+TITLE_STYLE: Dict[str, str] = {"align": "middle"}
+
+def shape_id(namespace: str, *parts: Any) -> str:
+    """Stable TLDraw shape ID for the diagram element identified by parts, e.g. shape:ns:node:3"""
+    prefix = f"shape:{namespace}:" if namespace else "shape:"
+    return prefix + ":".join(map(str, parts))
+
+class ShapeIds:
+    """
+    Hands out stable shape IDs within one diagram.
+
+    Repeated IDs (e.g. two arrows between the same nodes) get an occurrence
+    suffix, so every shape in a diagram has a unique ID.
+    """
+
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._prefix = shape_id(namespace, "")
+        self._seen: Dict[str, int] = {}
+
+    def make(self, *parts: Any) -> str:
+        # Same format as shape_id, inlined because it runs for every shape
+        base = self._prefix + ":".join(map(str, parts))
+        count = self._seen.get(base, 0)
+        self._seen[base] = count + 1
+        return f"{base}#{count}" if count else base
+
+class Shape:
+    """Base record for one TLDraw shape"""
+
+    __slots__ = ("id", "x", "y")
+    type = ""
+
+    def to_wire(self) -> Dict[str, Any]:
+        wire = {"type": self.type, "x": self.x, "y": self.y, "props": self.wire_props()}
+        if self.id:
+            wire["id"] = self.id
+        return wire
+
+    def wire_props(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and self.to_wire() == other.to_wire()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_wire()!r})"
+
+class GeoShape(Shape):
+    """A box, ellipse, diamond or other geo shape with a text label"""
+
+    __slots__ = ("w", "h", "geo", "color", "text", "style")
+    type = "geo"
+
+    def __init__(self, x: float, y: float, w: float, h: float, geo: str, color: str, text: str,
+                 style: Dict[str, str] = GEO_STYLE, id: str = ""):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.geo = geo
+        self.color = color
+        self.text = text
+        self.style = style
+
+    def wire_props(self) -> Dict[str, Any]:
+        return {"w": self.w, "h": self.h, "geo": self.geo, "color": self.color, "text": self.text, **self.style}
+
+class TextShape(Shape):
+    """A free-standing text label"""
+
+    __slots__ = ("text", "size", "color", "style")
+    type = "text"
+
+    def __init__(self, x: float, y: float, text: str, size: str = "s", color: str = "black",
+                 style: Dict[str, str] = TEXT_STYLE, id: str = ""):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.text = text
+        self.size = size
+        self.color = color
+        self.style = style
+
+    def wire_props(self) -> Dict[str, Any]:
+        return {"text": self.text, "font": "draw", "size": self.size, "color": self.color, **self.style}
+
+class ArrowShape(Shape):
+    """An arrow from (x, y) to (x + end_x, y + end_y); routed connections use "none" heads on inner segments"""
+
+    __slots__ = ("end_x", "end_y", "color", "dash", "size", "arrowhead_end")
+    type = "arrow"
+
+    def __init__(self, x: float, y: float, end_x: float, end_y: float, color: str = "black",
+                 dash: str = "draw", size: str = "m", arrowhead_end: str = "arrow", id: str = ""):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.end_x = end_x
+        self.end_y = end_y
+        self.color = color
+        self.dash = dash
+        self.size = size
+        self.arrowhead_end = arrowhead_end
+
+    def wire_props(self) -> Dict[str, Any]:
+        props = {
+            "start": {"x": 0, "y": 0},
+            "end": {"x": self.end_x, "y": self.end_y},
+            "color": self.color,
+            "dash": self.dash,
+            "size": self.size,
+        }
+        # TLDraw's default head is left implicit to keep frames small
+        if self.arrowhead_end != "arrow":
+            props["arrowheadEnd"] = self.arrowhead_end
+        return props
+
+def encode_shape(obj: Any) -> Dict[str, Any]:
+    """json.dumps `default` hook that writes shape records as TLDraw wire JSON"""
+    if isinstance(obj, Shape):
+        return obj.to_wire()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def shapes_to_wire(shapes: List[Any]) -> List[Dict[str, Any]]:
+    """Wire dicts for a list of shapes; plain dicts (e.g. from the disk cache) pass through"""
+    return [shape.to_wire() if isinstance(shape, Shape) else shape for shape in shapes]
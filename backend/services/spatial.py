@@ -0,0 +1,195 @@
+# backend/services/spatial.py
+"""
+Uniform-grid spatial index over shape bounding boxes.
+
+Layouts use it to keep labels and boxes off each other without comparing
+every pair of shapes: a box is filed under every grid cell it touches, so an
+overlap query only looks at the few shapes in the cells its rectangle covers.
+Inserting, removing and querying a box are O(1) on average for boxes no
+bigger than a cell, which keeps placing n labels near-linear.
+"""
+import logging
+import math
+from typing import Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Box = Tuple[float, float, float, float]
+
+# Grid cell size in pixels; about the size of a node box
+DEFAULT_CELL_SIZE = 200
+
+# Candidate spots tried by find_free, in rings of half-box steps around the wanted spot
+FREE_SLOT_RINGS = 4
+
+# Rough text metrics of TLDraw's draw font, per text size
+TEXT_METRICS = {"s": (10, 26), "m": (13, 32), "l": (17, 40), "xl": (22, 50)}
+TEXT_PADDING = 8
+
+def text_size(text: str, size: str = "s") -> Tuple[float, float]:
+    """Approximate width and height of a single-line text shape"""
+    char_width, line_height = TEXT_METRICS.get(size, TEXT_METRICS["s"])
+    return len(str(text)) * char_width + TEXT_PADDING, line_height
+
+def _ring_offsets(rings: int) -> List[Tuple[int, int]]:
+    # Every (dx, dy) step within the rings, nearest first
+    offsets = [(dx, dy) for dx in range(-rings, rings + 1) for dy in range(-rings, rings + 1)]
+    offsets.sort(key=lambda offset: (offset[0] ** 2 + offset[1] ** 2, offset[1], offset[0]))
+    return offsets
+
+FREE_SLOT_OFFSETS = _ring_offsets(FREE_SLOT_RINGS)
+
+class SpatialIndex:
+    """
+    Axis-aligned boxes keyed by shape ID, bucketed on a uniform grid.
+
+    Args:
+        cell_size: Width and height of a grid cell
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.boxes: Dict[Hashable, Box] = {}
+        self.cells: Dict[Tuple[int, int], Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.boxes
+
+    def insert(self, key: Hashable, x: float, y: float, w: float, h: float) -> None:
+        """Add a box, replacing any box already stored under the key"""
+        if key in self.boxes:
+            self.remove(key)
+        self.boxes[key] = (x, y, w, h)
+        for cell in self._cells(x, y, w, h):
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                self.cells[cell] = {key}
+            else:
+                bucket.add(key)
+
+    def remove(self, key: Hashable) -> None:
+        """Drop a box; unknown keys are ignored"""
+        box = self.boxes.pop(key, None)
+        if box is None:
+            return
+        for cell in self._cells(*box):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.cells[cell]
+
+    def query(self, x: float, y: float, w: float, h: float, margin: float = 0) -> List[Hashable]:
+        """Keys of the stored boxes that overlap the rectangle grown by margin on every side"""
+        found = []
+        seen: Set[Hashable] = set()
+        for cell in self._cells(x - margin, y - margin, w + 2 * margin, h + 2 * margin):
+            for key in self.cells.get(cell, ()):
+                if key not in seen:
+                    seen.add(key)
+                    if _overlaps(self.boxes[key], x, y, w, h, margin):
+                        found.append(key)
+        return found
+
+    def is_free(self, x: float, y: float, w: float, h: float, margin: float = 0) -> bool:
+        """Whether the rectangle, grown by margin, overlaps no stored box"""
+        # Inlined cell walk and overlap test; this is the hot loop of find_free
+        left, top = x - margin, y - margin
+        right, bottom = x + w + margin, y + h + margin
+        size = self.cell_size
+        cells = self.cells
+        boxes = self.boxes
+        for col in range(math.floor(left / size), math.floor(right / size) + 1):
+            for row in range(math.floor(top / size), math.floor(bottom / size) + 1):
+                bucket = cells.get((col, row))
+                if bucket:
+                    for key in bucket:
+                        box_x, box_y, box_w, box_h = boxes[key]
+                        if box_x < right and left < box_x + box_w and box_y < bottom and top < box_y + box_h:
+                            return False
+        return True
+
+    def find_free(self, x: float, y: float, w: float, h: float, margin: float = 0,
+                  rings: int = FREE_SLOT_RINGS) -> Tuple[float, float]:
+        """
+        The free spot nearest to (x, y) for a w x h box.
+
+        Spots are tried in rings of half-box steps around (x, y), up to
+        `rings` rings out; if none is free the box stays at (x, y).
+
+        Returns:
+            The top-left corner to use
+        """
+        return self._nearest_free(x, y, w, h, margin, rings) or (x, y)
+
+    def find_free_along(self, x: float, y: float, w: float, h: float, direction: Tuple[float, float],
+                        margin: float = 0, rings: int = FREE_SLOT_RINGS) -> Tuple[float, float]:
+        """
+        The free spot nearest to (x, y) for a w x h box, never an occupied one.
+
+        Like find_free, but when no spot within `rings` rings is free the box
+        is pushed from (x, y) along direction, in half-box steps, until it
+        clears every stored box.
+
+        Returns:
+            The top-left corner to use
+        """
+        spot = self._nearest_free(x, y, w, h, margin, rings)
+        if spot is not None:
+            return spot
+        length = math.hypot(*direction)
+        unit_x, unit_y = (direction[0] / length, direction[1] / length) if length else (0.0, 1.0)
+        step = abs(unit_x) * (w + margin) / 2 + abs(unit_y) * (h + margin) / 2
+        # The stored boxes are finite, so the box clears them all after a bounded number of steps
+        distance = step
+        while True:
+            candidate_x = x + unit_x * distance
+            candidate_y = y + unit_y * distance
+            if self.is_free(candidate_x, candidate_y, w, h, margin):
+                return candidate_x, candidate_y
+            distance += step
+
+    def place(self, key: Hashable, x: float, y: float, w: float, h: float, margin: float = 0,
+              rings: int = FREE_SLOT_RINGS,
+              direction: Optional[Tuple[float, float]] = None) -> Tuple[float, float]:
+        """
+        Insert a box at the free spot nearest to (x, y) and return its top-left corner.
+
+        With a direction the box is pushed along it when the rings around
+        (x, y) are full (see find_free_along), so it never overlaps another box.
+        """
+        self.remove(key)
+        if direction is None:
+            x, y = self.find_free(x, y, w, h, margin, rings)
+        else:
+            x, y = self.find_free_along(x, y, w, h, direction, margin, rings)
+        self.insert(key, x, y, w, h)
+        return x, y
+
+    def _nearest_free(self, x: float, y: float, w: float, h: float, margin: float,
+                      rings: int) -> Optional[Tuple[float, float]]:
+        step_x = (w + margin) / 2
+        step_y = (h + margin) / 2
+        for dx, dy in FREE_SLOT_OFFSETS[:(2 * rings + 1) ** 2]:
+            candidate_x = x + dx * step_x
+            candidate_y = y + dy * step_y
+            if self.is_free(candidate_x, candidate_y, w, h, margin):
+                return candidate_x, candidate_y
+        return None
+
+    def _cells(self, x: float, y: float, w: float, h: float) -> Iterator[Tuple[int, int]]:
+        size = self.cell_size
+        first_col, last_col = math.floor(x / size), math.floor((x + w) / size)
+        first_row, last_row = math.floor(y / size), math.floor((y + h) / size)
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                yield col, row
+
+def _overlaps(box: Box, x: float, y: float, w: float, h: float, margin: float) -> bool:
+    left, top, width, height = box
+    return (left < x + w + margin and x - margin < left + width
+            and top < y + h + margin and y - margin < top + height)
@@ -0,0 +1,184 @@
+# backend/services/streaming.py
+import json
+import logging
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for a JSON object that arrives in arbitrary text chunks.
+
+    Text before the first '{' (explanations, code fences) is skipped. Whenever a
+    member of the top-level object or an item of a top-level array is complete,
+    an event is produced so callers can act on it before the rest arrives.
+
+    Events are tuples of (kind, key, value) where kind is:
+        "member": a complete top-level member (key is the member name)
+        "item": a complete item of the top-level array stored under key
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.root_start = -1
+        self.result: Optional[Dict[str, Any]] = None
+        # Stack of open containers: [kind, start_index, key_in_parent, pending_key, expecting_key]
+        self._stack: List[List[Any]] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, text: str) -> List[Tuple[str, str, Any]]:
+        """
+        Feed the next chunk of text into the parser.
+
+        Args:
+            text: The next piece of the LLM output
+
+        Returns:
+            A list of events for values completed by this chunk
+        """
+        events: List[Tuple[str, str, Any]] = []
+        if self.done or not text:
+            return events
+
+        self.buffer += text
+        buffer = self.buffer
+        stack = self._stack
+        i = self.pos
+        end = len(buffer)
+
+        while i < end:
+            ch = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(i, events)
+                i += 1
+                continue
+
+            if not stack:
+                # Skip anything before the root object
+                if ch == "{":
+                    self.root_start = i
+                    stack.append(["obj", i, None, None, True])
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == "{" or ch == "[":
+                parent = stack[-1]
+                key = parent[3] if parent[0] == "obj" else None
+                stack.append(["obj" if ch == "{" else "arr", i, key, None, ch == "{"])
+            elif ch == "}" or ch == "]":
+                frame = stack.pop()
+                self._close_container(frame, i + 1, events)
+                if self.done:
+                    self.pos = i + 1
+                    return events
+            elif ch == ":":
+                stack[-1][4] = False
+            elif ch == ",":
+                if stack[-1][0] == "obj":
+                    stack[-1][4] = True
+            i += 1
+
+        self.pos = i
+        return events
+
+    def _close_string(self, index: int, events: List[Tuple[str, str, Any]]) -> None:
+        frame = self._stack[-1]
+        raw = self.buffer[self._string_start:index + 1]
+        if frame[0] == "obj" and frame[4]:
+            # This string was a member name
+            try:
+                frame[3] = json.loads(raw)
+            except json.JSONDecodeError:
+                frame[3] = raw[1:-1]
+            return
+        self._complete_value(frame, frame[3], raw, events)
+
+    def _close_container(self, frame: List[Any], end: int, events: List[Tuple[str, str, Any]]) -> None:
+        if not self._stack:
+            # The root object is complete
+            try:
+                self.result = json.loads(self.buffer[frame[1]:end])
+            except json.JSONDecodeError as e:
+                logger.warning(f"Streamed JSON could not be parsed: {e}")
+                self.result = {}
+            return
+        self._complete_value(self._stack[-1], frame[2], self.buffer[frame[1]:end], events)
+
+    def _complete_value(self, parent: List[Any], key: Optional[str], raw: str,
+                        events: List[Tuple[str, str, Any]]) -> None:
+        depth = len(self._stack)
+        if depth == 1 and parent[0] == "obj":
+            kind = "member"
+        elif depth == 2 and parent[0] == "arr" and parent[2] is not None:
+            kind = "item"
+            key = parent[2]
+        else:
+            return
+        try:
+            events.append((kind, key, json.loads(raw)))
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping malformed streamed value for {key}")
+
+class ProgressiveDiagram:
+    """
+    Builds a diagram incrementally from streamed LLM text and reports every
+    time a node, branch, phase or connection object completes.
+    """
+
+    def __init__(self):
+        self.parser = IncrementalJSONParser()
+        self.data: Dict[str, Any] = {}
+        self.chunks: List[str] = []
+        # Total time spent parsing, across all chunks
+        self.parse_seconds = 0.0
+
+    def feed(self, text: str) -> bool:
+        """
+        Feed the next chunk of streamed text.
+
+        Args:
+            text: The next piece of the LLM output
+
+        Returns:
+            True if new diagram objects completed and the partial diagram should be redrawn
+        """
+        self.chunks.append(text)
+        changed = False
+        started = time.perf_counter()
+        events = self.parser.feed(text)
+        self.parse_seconds += time.perf_counter() - started
+        for kind, key, value in events:
+            if kind == "item":
+                self.data.setdefault(key, []).append(value)
+            else:
+                self.data[key] = value
+            changed = changed or isinstance(value, dict)
+
+        return changed and not self.parser.done
+
+    def snapshot(self) -> Dict[str, Any]:
+        """A copy of the diagram so far that later chunks will not modify"""
+        return {key: list(value) if isinstance(value, list) else value for key, value in self.data.items()}
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
@@ -1,198 +1,82 @@
 # backend/services/tldraw.py
-import json
 import re
 import random
 import math
-from typing import List, Dict, Any, Optional, Tuple, Union
+import numpy as np
+from typing import Callable, List, Dict, Any, Optional, Tuple, Union
 import logging
 
+from models.diagram import Flowchart, MindMap, MindMapNode
+from services.shapes import (
+    Shape, ShapeIds, GeoShape, TextShape, ArrowShape,
+    GEO_SOLID_STYLE, GEO_SOLID_DRAW_STYLE, GEO_DRAW_STYLE, TITLE_STYLE
+)
+from services.layout import FlowchartLayout, FLOWCHART_THEME, PROCESS_THEME
+from services.radial import radial_layout
+from services.spatial import SpatialIndex, text_size
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def generate_flowchart(llm_response: Union[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+# Space kept between mind map boxes, and between labels and other boxes
+BOX_MARGIN = 10
+LABEL_MARGIN = 4
+# Rings of nearby spots a box tries before it is pushed outward along its branch
+BOX_SEARCH_RINGS = 2
+
+def generate_flowchart(llm_response: Union[str, Flowchart], namespace: str = "") -> List[Shape]:
     """
     Generate TLDraw shapes for a flowchart based on the LLM response.
     
     Args:
         llm_response: The response from the LLM (either text or JSON)
+        namespace: Scopes the stable shape IDs to one diagram
         
     Returns:
         A list of TLDraw shapes
     """
-    try:
-        # Check if response is already JSON
-        if isinstance(llm_response, dict):
-            flowchart_data = llm_response
-        else:
-            # Try to parse JSON from the text response
-            try:
-                # Look for JSON content in the response
-                json_start = llm_response.find('{')
-                json_end = llm_response.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = llm_response[json_start:json_end]
-                    flowchart_data = json.loads(json_str)
-                else:
-                    # Fall back to text parsing
-                    return parse_flowchart_from_text(llm_response)
-            except (json.JSONDecodeError, AttributeError):
-                # Fall back to text parsing
-                return parse_flowchart_from_text(llm_response)
-        
-        # Create a title shape
-        shapes = []
-        title = flowchart_data.get("title", "Flowchart")
-        shapes.append({
-            "type": "text",
-            "x": 100,
-            "y": 50,
-            "props": {
-                "text": title,
-                "font": "draw",
-                "size": "xl",
-                "color": "black",
-                "align": "middle"
-            }
-        })
-        
-        # Track node positions for connecting arrows
-        node_positions = {}
-        
-        # Generate shapes from nodes
-        nodes = flowchart_data.get("nodes", [])
-        start_x, start_y = 100, 150
-        col_width, row_height = 250, 150
-        
-        # Calculate grid layout
-        cols = min(3, max(1, math.ceil(math.sqrt(len(nodes)))))
-        
-        for i, node in enumerate(nodes):
-            # Basic grid positioning
-            col = i % cols
-            row = i // cols
-            
-            x = start_x + col * col_width
-            y = start_y + row * row_height
-            
-            node_id = node.get("id", str(i+1))
-            node_text = node.get("text", f"Node {i+1}")
-            node_type = node.get("type", "process")
-            
-            # Determine shape geometry based on node type
-            geo_type = "rectangle"  # Default
-            if node_type == "start" or node_type == "end":
-                geo_type = "ellipse"
-            elif node_type == "decision":
-                geo_type = "diamond"
-            elif node_type == "input":
-                geo_type = "parallelogram"
-                
-            # Determine color based on node type
-            color = "light-blue"  # Default
-            if node_type == "start":
-                color = "blue"
-            elif node_type == "end":
-                color = "green"
-            elif node_type == "decision":
-                color = "orange"
-            
-            # Create shape
-            shape = {
-                "type": "geo",
-                "x": x,
-                "y": y,
-                "props": {
-                    "w": 160 if geo_type != "diamond" else 180,
-                    "h": 80 if geo_type != "diamond" else 100,
-                    "geo": geo_type,
-                    "color": color,
-                    "text": node_text,
-                    "align": "middle",
-                    "font": "draw"
-                }
-            }
-            
-            shapes.append(shape)
-            
-            # Store position for connections
-            node_positions[node_id] = (x, y)
+    return build_flowchart(llm_response, FLOWCHART_THEME, namespace)
+
+def generate_layered_flowchart(llm_response: Union[str, Flowchart], namespace: str = "") -> List[Shape]:
+    """Generate a flowchart whose nodes are ranked along its connections"""
+    return build_flowchart(llm_response, FLOWCHART_THEME, namespace, layered=True)
+
+def build_flowchart(llm_response: Union[str, Flowchart], theme: Dict[str, Any],
+                    namespace: str = "", layered: bool = False) -> List[Shape]:
+    """
+    Lay out a flowchart with the given theme.
+    
+    Args:
+        llm_response: The parsed flowchart, or the raw LLM text if it held no JSON
+        theme: Geo style preset and optional rectangle color override
+        namespace: Scopes the stable shape IDs to one diagram
+        layered: Use the layered layout instead of the grid
         
-        # Create connection arrows
-        connections = flowchart_data.get("connections", [])
-        for conn in connections:
-            from_id = conn.get("from")
-            to_id = conn.get("to")
-            label = conn.get("label", "")
-            
-            if from_id not in node_positions or to_id not in node_positions:
-                continue
-                
-            from_x, from_y = node_positions[from_id]
-            to_x, to_y = node_positions[to_id]
-            
-            # Add label text if present
-            if label:
-                # Calculate mid-point for label
-                mid_x = (from_x + to_x) / 2
-                mid_y = (from_y + to_y) / 2
-                
-                # Offset label slightly
-                offset = 15
-                label_shape = {
-                    "type": "text",
-                    "x": mid_x + offset,
-                    "y": mid_y - offset,
-                    "props": {
-                        "text": label,
-                        "font": "draw",
-                        "size": "s",
-                        "color": "black"
-                    }
-                }
-                shapes.append(label_shape)
-            
-            # Create arrow
-            arrow = {
-                "type": "arrow",
-                "x": from_x + 80,
-                "y": from_y + 40,
-                "props": {
-                    "start": {
-                        "x": 0,
-                        "y": 0,
-                    },
-                    "end": {
-                        "x": to_x - from_x,
-                        "y": to_y - from_y,
-                    },
-                    "color": "black",
-                    "dash": "draw",
-                    "size": "m"
-                }
-            }
-            
-            shapes.append(arrow)
+    Returns:
+        A list of TLDraw shapes
+    """
+    ids = ShapeIds(namespace)
+    try:
+        if not isinstance(llm_response, Flowchart):
+            # Fall back to text parsing
+            return parse_flowchart_from_text(llm_response, theme, namespace)
         
-        return shapes
+        # Place the nodes and connect them
+        return FlowchartLayout(llm_response, namespace, theme, layered).to_shapes()
     
     except Exception as e:
         logger.error(f"Error generating flowchart: {e}")
         # Return a simple error shape
-        return [{
-            "type": "text",
-            "x": 100,
-            "y": 100,
-            "props": {
-                "text": f"Error generating diagram: {str(e)}",
-                "color": "red",
-                "font": "draw",
-                "size": "m"
-            }
-        }]
+        return [TextShape(100, 100, f"Error generating diagram: {str(e)}", size="m", color="red",
+                          id=ids.make("error"))]
 
-def parse_flowchart_from_text(text: str) -> List[Dict[str, Any]]:
+def parse_flowchart_from_text(text: str, theme: Dict[str, Any] = FLOWCHART_THEME,
+                              namespace: str = "") -> List[Shape]:
     """Legacy method to parse flowchart from text when JSON parsing fails"""
     nodes, connections = parse_flowchart_response(text)
+    ids = ShapeIds(namespace)
+    geo_style = theme["geo_style"]
+    rectangle_color = theme["rectangle_color"]
     
     shapes = []
     node_positions = {}
@@ -216,23 +100,19 @@ def parse_flowchart_from_text(text: str) -> List[Dict[str, Any]]:
         elif "end" in node.lower() or "finish" in node.lower():
             shape_type = "ellipse"
         
+        color = ("blue" if "start" in node.lower() else
+                 "green" if "end" in node.lower() else
+                 "orange" if shape_type == "diamond" else "light-blue")
+        if rectangle_color and shape_type == "rectangle":
+            color = rectangle_color
+        
         # Create the shape
-        shape = {
-            "type": "geo",
-            "x": x,
-            "y": y,
-            "props": {
-                "w": 160 if shape_type != "diamond" else 180,
-                "h": 80 if shape_type != "diamond" else 100,
-                "geo": shape_type,
-                "color": "blue" if "start" in node.lower() else 
-                        "green" if "end" in node.lower() else
-                        "orange" if shape_type == "diamond" else "light-blue",
-                "text": node,
-                "align": "middle",
-                "font": "draw"
-            }
-        }
+        shape = GeoShape(
+            x, y,
+            160 if shape_type != "diamond" else 180,
+            80 if shape_type != "diamond" else 100,
+            shape_type, color, node, geo_style, ids.make("node", node_id)
+        )
         
         shapes.append(shape)
     
@@ -249,24 +129,9 @@ def parse_flowchart_from_text(text: str) -> List[Dict[str, Any]]:
         to_x, to_y = node_positions[to_node_id]
         
         # Create an arrow
-        arrow = {
-            "type": "arrow",
-            "x": from_x + 80,
-            "y": from_y + 40,
-            "props": {
-                "start": {
-                    "x": 0,
-                    "y": 0,
-                },
-                "end": {
-                    "x": to_x - from_x,
-                    "y": to_y - from_y,
-                },
-                "color": "black",
-                "dash": "draw",
-                "size": "m"
-            }
-        }
+        arrow = ArrowShape(
+            from_x + 80, from_y + 40, to_x - from_x, to_y - from_y, id=ids.make("arrow", from_node_id, to_node_id)
+        )
         
         shapes.append(arrow)
     
@@ -302,100 +167,90 @@ def parse_flowchart_response(text: str) -> Tuple[List[str], List[Tuple[str, str]
     
     return nodes, connections
 
-def generate_process_diagram(llm_response: Union[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+def generate_process_diagram(llm_response: Union[str, Flowchart], namespace: str = "") -> List[Shape]:
     """Generate a process diagram from LLM response"""
-    # For process diagrams, we can reuse the flowchart logic with some styling differences
-    try:
-        shapes = generate_flowchart(llm_response)
-        
-        # Customize for process diagram appearance
-        for shape in shapes:
-            if shape["type"] == "geo":
-                shape["props"]["dash"] = "solid"
-                if shape["props"]["geo"] == "rectangle":
-                    shape["props"]["color"] = "light-green"
-        
-        return shapes
-    except Exception as e:
-        logger.error(f"Error generating process diagram: {e}")
-        return [{
-            "type": "text",
-            "x": 100,
-            "y": 100,
-            "props": {
-                "text": f"Error generating process diagram: {str(e)}",
-                "color": "red",
-                "font": "draw",
-                "size": "m"
-            }
-        }]
+    # For process diagrams, we reuse the flowchart layout with the process theme
+    return build_flowchart(llm_response, PROCESS_THEME, namespace)
+
+def generate_layered_process_diagram(llm_response: Union[str, Flowchart], namespace: str = "") -> List[Shape]:
+    """Generate a process diagram whose steps are ranked along its connections"""
+    return build_flowchart(llm_response, PROCESS_THEME, namespace, layered=True)
+
+# Theme and layout mode behind each flowchart-like generator, so a stored
+# diagram can be rebuilt as an editable FlowchartLayout
+FLOWCHART_LAYOUTS: Dict[Callable[..., List[Shape]], Tuple[Dict[str, Any], bool]] = {
+    generate_flowchart: (FLOWCHART_THEME, False),
+    generate_layered_flowchart: (FLOWCHART_THEME, True),
+    generate_process_diagram: (PROCESS_THEME, False),
+    generate_layered_process_diagram: (PROCESS_THEME, True),
+}
+
+# Stands in for a mind map without a central node
+DEFAULT_CENTRAL_NODE = MindMapNode(id="center", text="Central Topic", color="blue")
 
-def generate_mind_map(llm_response: Union[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _text(text: Optional[str], default: str) -> str:
+    # Only a missing text gets the placeholder; an empty one stays empty
+    return default if text is None else text
+
+def generate_mind_map(llm_response: Union[str, MindMap], namespace: str = "") -> List[Shape]:
     """Generate a mind map from LLM response"""
+    return build_mind_map(llm_response, namespace)
+
+def generate_radial_mind_map(llm_response: Union[str, MindMap], namespace: str = "") -> List[Shape]:
+    """Generate a mind map with the radial tree layout, to any depth"""
+    return build_mind_map(llm_response, namespace, radial=True)
+
+def build_mind_map(llm_response: Union[str, MindMap], namespace: str = "",
+                   radial: bool = False) -> List[Shape]:
+    """
+    Lay out a mind map.
+    
+    Args:
+        llm_response: The parsed mind map, or the raw LLM text if it held no JSON
+        namespace: Scopes the stable shape IDs to one diagram
+        radial: Use the radial tree layout instead of a fixed circle of branches
+        
+    Returns:
+        A list of TLDraw shapes
+    """
+    ids = ShapeIds(namespace)
     try:
-        # Check if response is already JSON
-        if isinstance(llm_response, dict):
-            mind_map_data = llm_response
-        else:
-            # Try to parse JSON from the text response
-            try:
-                # Look for JSON content in the response
-                json_start = llm_response.find('{')
-                json_end = llm_response.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = llm_response[json_start:json_end]
-                    mind_map_data = json.loads(json_str)
-                else:
-                    # Fall back to text parsing
-                    return parse_mindmap_from_text(llm_response)
-            except (json.JSONDecodeError, AttributeError):
-                # Fall back to text parsing
-                return parse_mindmap_from_text(llm_response)
+        if not isinstance(llm_response, MindMap):
+            # Fall back to text parsing
+            return parse_mindmap_from_text(llm_response, namespace)
+        mind_map_data = llm_response
+        
+        if radial:
+            return build_radial_mind_map(mind_map_data, ids)
         
         shapes = []
         center_x, center_y = 400, 300
+        # Boxes placed so far, so later boxes and labels can avoid them
+        index = SpatialIndex()
         
         # Add title
-        title = mind_map_data.get("title", "Mind Map")
-        shapes.append({
-            "type": "text",
-            "x": center_x - 100,
-            "y": 50,
-            "props": {
-                "text": title,
-                "font": "draw",
-                "size": "xl",
-                "color": "black",
-                "align": "middle"
-            }
-        })
+        title = mind_map_data.title
+        shapes.append(TextShape(center_x - 100, 50, title, size="xl", style=TITLE_STYLE, id=ids.make("title")))
+        index.insert(shapes[-1].id, center_x - 100, 50, *text_size(title, "xl"))
         
         # Create central node
-        central_node = mind_map_data.get("centralNode", {"text": "Central Topic", "color": "blue", "id": "center"})
-        central_shape = {
-            "type": "geo",
-            "x": center_x - 100,
-            "y": center_y - 50,
-            "props": {
-                "w": 200,
-                "h": 100,
-                "geo": "ellipse",
-                "color": central_node.get("color", "blue"),
-                "text": central_node.get("text", "Central Topic"),
-                "align": "middle",
-                "font": "draw",
-                "fill": "solid"
-            }
-        }
+        central_node = mind_map_data.central_node or DEFAULT_CENTRAL_NODE
+        central_id = central_node.id or "center"
+        central_shape = GeoShape(
+            center_x - 100, center_y - 50, 200, 100, "ellipse",
+            central_node.color or "blue", _text(central_node.text, "Central Topic"), GEO_SOLID_STYLE,
+            ids.make("node", central_id)
+        )
         shapes.append(central_shape)
+        index.insert(central_shape.id, center_x - 100, center_y - 50, 200, 100)
         
         # Track node positions for connections
         node_positions = {
-            central_node.get("id", "center"): (center_x, center_y)
+            central_id: (center_x, center_y)
         }
         
         # Create branch nodes in a radial layout
-        branches = mind_map_data.get("branches", [])
+        branches = mind_map_data.branches
         num_branches = len(branches)
         radius = 250
         
@@ -405,54 +260,34 @@ def generate_mind_map(llm_response: Union[str, Dict[str, Any]]) -> List[Dict[str
             branch_x = center_x + radius * math.cos(angle)
             branch_y = center_y + radius * math.sin(angle)
             
-            branch_id = branch.get("id", f"branch{i+1}")
-            branch_text = branch.get("text", f"Branch {i+1}")
-            branch_color = branch.get("color", get_color_for_branch(i))
+            branch_id = branch.id or f"branch{i+1}"
+            branch_text = _text(branch.text, f"Branch {i+1}")
+            branch_color = branch.color or get_color_for_branch(i)
             
-            # Create branch shape
-            branch_shape = {
-                "type": "geo",
-                "x": branch_x - 80,
-                "y": branch_y - 40,
-                "props": {
-                    "w": 160,
-                    "h": 80,
-                    "geo": "rectangle",
-                    "color": branch_color,
-                    "text": branch_text,
-                    "align": "middle",
-                    "font": "draw",
-                    "fill": "solid"
-                }
-            }
+            # Create branch shape, moved to a free spot (outward if none is near) if it would cover another box
+            branch_shape = GeoShape(
+                branch_x - 80, branch_y - 40, 160, 80, "rectangle", branch_color, branch_text, GEO_SOLID_STYLE,
+                ids.make("node", branch_id)
+            )
+            branch_shape.x, branch_shape.y = index.place(
+                branch_shape.id, branch_shape.x, branch_shape.y, 160, 80, BOX_MARGIN, BOX_SEARCH_RINGS,
+                (math.cos(angle), math.sin(angle))
+            )
+            branch_x, branch_y = branch_shape.x + 80, branch_shape.y + 40
             shapes.append(branch_shape)
             
             # Store position for connections
             node_positions[branch_id] = (branch_x, branch_y)
             
             # Connect to central node
-            arrow = {
-                "type": "arrow",
-                "x": center_x,
-                "y": center_y,
-                "props": {
-                    "start": {
-                        "x": 0,
-                        "y": 0,
-                    },
-                    "end": {
-                        "x": branch_x - center_x,
-                        "y": branch_y - center_y,
-                    },
-                    "color": branch_color,
-                    "dash": "draw",
-                    "size": "m"
-                }
-            }
+            arrow = ArrowShape(
+                center_x, center_y, branch_x - center_x, branch_y - center_y, branch_color,
+                id=ids.make("edge", central_id, branch_id)
+            )
             shapes.append(arrow)
             
             # Create sub-topic nodes
-            sub_nodes = branch.get("nodes", [])
+            sub_nodes = branch.nodes
             num_sub_nodes = len(sub_nodes)
             
             for j, sub_node in enumerate(sub_nodes):
@@ -462,58 +297,37 @@ def generate_mind_map(llm_response: Union[str, Dict[str, Any]]) -> List[Dict[str
                 sub_x = branch_x + sub_radius * math.cos(sub_angle)
                 sub_y = branch_y + sub_radius * math.sin(sub_angle)
                 
-                sub_id = sub_node.get("id", f"{branch_id}-{j+1}")
-                sub_text = sub_node.get("text", f"Sub-topic {j+1}")
-                sub_color = sub_node.get("color", branch_color)
+                sub_id = sub_node.id or f"{branch_id}-{j+1}"
+                sub_text = _text(sub_node.text, f"Sub-topic {j+1}")
+                sub_color = sub_node.color or branch_color
                 
-                # Create sub-node shape
-                sub_shape = {
-                    "type": "geo",
-                    "x": sub_x - 70,
-                    "y": sub_y - 35,
-                    "props": {
-                        "w": 140,
-                        "h": 70,
-                        "geo": "rectangle",
-                        "color": sub_color,
-                        "text": sub_text,
-                        "align": "middle",
-                        "font": "draw",
-                        "dash": "draw"
-                    }
-                }
+                # Create sub-node shape, moved to a free spot (outward if none is near) if it would cover another box
+                sub_shape = GeoShape(
+                    sub_x - 70, sub_y - 35, 140, 70, "rectangle", sub_color, sub_text, GEO_DRAW_STYLE,
+                    ids.make("node", sub_id)
+                )
+                sub_shape.x, sub_shape.y = index.place(
+                    sub_shape.id, sub_shape.x, sub_shape.y, 140, 70, BOX_MARGIN, BOX_SEARCH_RINGS,
+                    (math.cos(sub_angle), math.sin(sub_angle))
+                )
+                sub_x, sub_y = sub_shape.x + 70, sub_shape.y + 35
                 shapes.append(sub_shape)
                 
                 # Store position for connections
                 node_positions[sub_id] = (sub_x, sub_y)
                 
                 # Connect to branch
-                arrow = {
-                    "type": "arrow",
-                    "x": branch_x,
-                    "y": branch_y,
-                    "props": {
-                        "start": {
-                            "x": 0,
-                            "y": 0,
-                        },
-                        "end": {
-                            "x": sub_x - branch_x,
-                            "y": sub_y - branch_y,
-                        },
-                        "color": sub_color,
-                        "dash": "draw",
-                        "size": "s"
-                    }
-                }
+                arrow = ArrowShape(
+                    branch_x, branch_y, sub_x - branch_x, sub_y - branch_y, sub_color, size="s",
+                    id=ids.make("edge", branch_id, sub_id)
+                )
                 shapes.append(arrow)
         
         # Add cross-connections
-        connections = mind_map_data.get("connections", [])
-        for conn in connections:
-            from_id = conn.get("from")
-            to_id = conn.get("to")
-            label = conn.get("label", "")
+        for conn in mind_map_data.connections:
+            from_id = conn.source
+            to_id = conn.target
+            label = conn.label
             
             if from_id not in node_positions or to_id not in node_positions:
                 continue
@@ -527,81 +341,129 @@ def generate_mind_map(llm_response: Union[str, Dict[str, Any]]) -> List[Dict[str
                 mid_x = (from_x + to_x) / 2
                 mid_y = (from_y + to_y) / 2
                 
-                # Add label text
-                label_shape = {
-                    "type": "text",
-                    "x": mid_x - 40,
-                    "y": mid_y - 10,
-                    "props": {
-                        "text": label,
-                        "font": "draw",
-                        "size": "s",
-                        "color": "black"
-                    }
-                }
-                shapes.append(label_shape)
+                # Add label text where it does not cover a box or another label
+                label_id = ids.make("label", from_id, to_id)
+                label_x, label_y = index.place(label_id, mid_x - 40, mid_y - 10, *text_size(label), LABEL_MARGIN)
+                shapes.append(TextShape(label_x, label_y, label, id=label_id))
             
             # Create connection arrow
-            conn_arrow = {
-                "type": "arrow",
-                "x": from_x,
-                "y": from_y,
-                "props": {
-                    "start": {
-                        "x": 0,
-                        "y": 0,
-                    },
-                    "end": {
-                        "x": to_x - from_x,
-                        "y": to_y - from_y,
-                    },
-                    "color": "gray",
-                    "dash": "dashed",
-                    "size": "s"
-                }
-            }
+            conn_arrow = ArrowShape(
+                from_x, from_y, to_x - from_x, to_y - from_y, "gray", "dashed", "s", id=ids.make("link", from_id, to_id)
+            )
             shapes.append(conn_arrow)
         
         return shapes
     
     except Exception as e:
         logger.error(f"Error generating mind map: {e}")
-        return [{
-            "type": "text",
-            "x": 100,
-            "y": 100,
-            "props": {
-                "text": f"Error generating mind map: {str(e)}",
-                "color": "red",
-                "font": "draw",
-                "size": "m"
-            }
-        }]
+        return [TextShape(100, 100, f"Error generating mind map: {str(e)}", size="m", color="red",
+                          id=ids.make("error"))]
 
-def parse_mindmap_from_text(text: str) -> List[Dict[str, Any]]:
+def build_radial_mind_map(mind_map_data: MindMap, ids: ShapeIds) -> List[Shape]:
+    """
+    Radial tree layout of a mind map, with sub-topics nested to any depth under "nodes".
+    
+    Positions come from services.radial, which sizes each sector by the
+    number of leaves below it and resolves overlaps across all boxes.
+    """
+    center_x, center_y = 400, 300
+    title = mind_map_data.title
+    title_id = ids.make("title")
+    
+    # Flatten the tree breadth-first: (node, id, text, color, parent index, depth)
+    central_node = mind_map_data.central_node or DEFAULT_CENTRAL_NODE
+    nodes = [(
+        central_node, central_node.id or "center", _text(central_node.text, "Central Topic"),
+        central_node.color or "blue", -1, 0
+    )]
+    index = 0
+    while index < len(nodes):
+        node, node_id, _, color, _, depth = nodes[index]
+        if depth == 0:
+            for i, branch in enumerate(mind_map_data.branches):
+                nodes.append((
+                    branch, branch.id or f"branch{i+1}", _text(branch.text, f"Branch {i+1}"),
+                    branch.color or get_color_for_branch(i), index, 1
+                ))
+        else:
+            for i, sub_node in enumerate(node.nodes):
+                nodes.append((
+                    sub_node, sub_node.id or f"{node_id}-{i+1}", _text(sub_node.text, f"Sub-topic {i+1}"),
+                    sub_node.color or color, index, depth + 1
+                ))
+        index += 1
+    
+    parents = np.fromiter((node[4] for node in nodes), dtype=np.int64, count=len(nodes))
+    depths = np.fromiter((node[5] for node in nodes), dtype=np.int64, count=len(nodes))
+    # Central node, main branches and deeper sub-topics get smaller boxes
+    widths = np.select([depths == 0, depths == 1], [200, 160], 140)
+    heights = np.select([depths == 0, depths == 1], [100, 80], 70)
+    xs, ys = radial_layout(parents, depths, widths, heights, (center_x, center_y))
+    # Title goes above the top-most box
+    title_y = min(50, float((ys - heights / 2).min()) - 80)
+    xs = xs.round(1).tolist()
+    ys = ys.round(1).tolist()
+    widths = widths.tolist()
+    heights = heights.tolist()
+    shapes: List[Shape] = [TextShape(center_x - 100, title_y, title, size="xl", style=TITLE_STYLE, id=title_id)]
+    
+    # Labels are kept off the boxes and each other
+    index = SpatialIndex()
+    index.insert(title_id, center_x - 100, title_y, *text_size(title, "xl"))
+    
+    # Connectors first so the boxes are drawn over their ends
+    node_positions = {}
+    for i, (_, node_id, _, color, parent, depth) in enumerate(nodes):
+        node_positions[node_id] = (xs[i], ys[i])
+        if parent >= 0:
+            parent_id = nodes[parent][1]
+            shapes.append(ArrowShape(
+                xs[parent], ys[parent], xs[i] - xs[parent], ys[i] - ys[parent], color,
+                size="m" if depth == 1 else "s", id=ids.make("edge", parent_id, node_id)
+            ))
+    for i, (_, node_id, text, color, _, depth) in enumerate(nodes):
+        shapes.append(GeoShape(
+            xs[i] - widths[i] / 2, ys[i] - heights[i] / 2, widths[i], heights[i],
+            "ellipse" if depth == 0 else "rectangle", color, text,
+            GEO_SOLID_STYLE if depth <= 1 else GEO_DRAW_STYLE, ids.make("node", node_id)
+        ))
+        index.insert(shapes[-1].id, shapes[-1].x, shapes[-1].y, widths[i], heights[i])
+    
+    # Add cross-connections
+    for conn in mind_map_data.connections:
+        from_id = conn.source
+        to_id = conn.target
+        label = conn.label
+        if from_id not in node_positions or to_id not in node_positions:
+            continue
+        from_x, from_y = node_positions[from_id]
+        to_x, to_y = node_positions[to_id]
+        if label:
+            mid_x = (from_x + to_x) / 2
+            mid_y = (from_y + to_y) / 2
+            label_id = ids.make("label", from_id, to_id)
+            label_x, label_y = index.place(label_id, mid_x - 40, mid_y - 10, *text_size(label), LABEL_MARGIN)
+            shapes.append(TextShape(label_x, label_y, label, id=label_id))
+        shapes.append(ArrowShape(
+            from_x, from_y, to_x - from_x, to_y - from_y, "gray", "dashed", "s", id=ids.make("link", from_id, to_id)
+        ))
+    
+    return shapes
+
+def parse_mindmap_from_text(text: str, namespace: str = "") -> List[Shape]:
     """Legacy method to parse mind map from text when JSON parsing fails"""
     topics = extract_mind_map_topics(text)
+    ids = ShapeIds(namespace)
     
     shapes = []
     center_x, center_y = 400, 300
     
     # Create central node
     central_topic = topics[0] if topics else "Central Topic"
-    central_shape = {
-        "type": "geo",
-        "x": center_x - 100,
-        "y": center_y - 50,
-        "props": {
-            "w": 200,
-            "h": 100,
-            "geo": "ellipse",
-            "color": "violet",
-            "text": central_topic,
-            "align": "middle",
-            "font": "draw",
-            "fill": "solid"
-        }
-    }
+    central_shape = GeoShape(
+        center_x - 100, center_y - 50, 200, 100, "ellipse", "violet", central_topic, GEO_SOLID_STYLE,
+        ids.make("node", "center")
+    )
     shapes.append(central_shape)
     
     # Create branch nodes in a radial layout
@@ -613,43 +475,18 @@ def parse_mindmap_from_text(text: str) -> List[Dict[str, Any]]:
         x = center_x + radius * math.cos(angle)
         y = center_y + radius * math.sin(angle)
         
-        branch_shape = {
-            "type": "geo",
-            "x": x - 80,
-            "y": y - 40,
-            "props": {
-                "w": 160,
-                "h": 80,
-                "geo": "rectangle",
-                "color": get_color_for_branch(i),
-                "text": topics[i + 1] if i + 1 < len(topics) else f"Topic {i+1}",
-                "align": "middle",
-                "font": "draw",
-                "fill": "solid",
-                "dash": "draw"
-            }
-        }
+        branch_shape = GeoShape(
+            x - 80, y - 40, 160, 80, "rectangle", get_color_for_branch(i),
+            topics[i + 1] if i + 1 < len(topics) else f"Topic {i+1}", GEO_SOLID_DRAW_STYLE,
+            ids.make("node", f"branch{i+1}")
+        )
         shapes.append(branch_shape)
         
         # Connect to central node
-        arrow = {
-            "type": "arrow",
-            "x": center_x,
-            "y": center_y,
-            "props": {
-                "start": {
-                    "x": 0,
-                    "y": 0,
-                },
-                "end": {
-                    "x": x - center_x,
-                    "y": y - center_y,
-                },
-                "color": get_color_for_branch(i),
-                "dash": "draw",
-                "size": "m"
-            }
-        }
+        arrow = ArrowShape(
+            center_x, center_y, x - center_x, y - center_y, get_color_for_branch(i),
+            id=ids.make("edge", "center", f"branch{i+1}")
+        )
         shapes.append(arrow)
     
     return shapes
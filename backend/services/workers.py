@@ -0,0 +1,95 @@
+# backend/services/workers.py
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from models.diagram import Flowchart, MindMap
+from services.metrics import time_stage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Where the layout stage runs: "inline" (on the event loop), "thread" or "process"
+LAYOUT_EXECUTION_MODE = os.getenv("LAYOUT_EXECUTION_MODE", "thread").lower()
+# Diagrams with fewer items than this are laid out inline, where a pool hop would cost more than it saves
+LAYOUT_INLINE_THRESHOLD = int(os.getenv("LAYOUT_INLINE_THRESHOLD", "100"))
+# Number of workers; 0 sizes the pool from the CPU count
+LAYOUT_POOL_SIZE = int(os.getenv("LAYOUT_POOL_SIZE", "0"))
+
+_executor: Optional[Executor] = None
+
+def get_pool_size(mode: str) -> int:
+    """Number of layout workers for the given execution mode"""
+    if LAYOUT_POOL_SIZE > 0:
+        return LAYOUT_POOL_SIZE
+    cpus = os.cpu_count() or 1
+    if mode == "process":
+        return max(1, cpus - 1)
+    return min(32, cpus + 4)
+
+def start_layout_pool() -> Optional[Executor]:
+    """Create the layout worker pool. Called on application startup."""
+    global _executor
+    if _executor is not None or LAYOUT_EXECUTION_MODE == "inline":
+        return _executor
+
+    size = get_pool_size(LAYOUT_EXECUTION_MODE)
+    if LAYOUT_EXECUTION_MODE == "process":
+        _executor = ProcessPoolExecutor(max_workers=size)
+    else:
+        if LAYOUT_EXECUTION_MODE != "thread":
+            logger.warning(f"Unknown LAYOUT_EXECUTION_MODE '{LAYOUT_EXECUTION_MODE}', using a thread pool")
+        _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="layout")
+    logger.info(f"Layout pool ready ({LAYOUT_EXECUTION_MODE}, {size} workers)")
+    return _executor
+
+def shutdown_layout_pool() -> None:
+    """Stop the layout worker pool. Called on application shutdown."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+def layout_size(llm_response: Any) -> int:
+    """
+    Estimate how much layout work a response needs.
+
+    Args:
+        llm_response: The parsed LLM response (diagram model or text)
+
+    Returns:
+        The number of nodes and connections, or the number of lines for text fallbacks
+    """
+    if isinstance(llm_response, str):
+        return llm_response.count("\n") + 1
+    if isinstance(llm_response, Flowchart):
+        # Process diagrams list their steps as nodes too
+        return len(llm_response.nodes) + len(llm_response.connections)
+    if isinstance(llm_response, MindMap):
+        size = len(llm_response.connections)
+        for branch in llm_response.branches:
+            size += 1 + len(branch.nodes)
+        return size
+    return 0
+
+async def run_layout(generator: Callable[[Any, str], List[Any]], llm_response: Any,
+                     namespace: str = "") -> List[Any]:
+    """
+    Run a shape generator inline or on the layout pool, depending on size.
+
+    Args:
+        generator: One of the generate_* functions from services.tldraw
+        llm_response: The parsed LLM response passed to the generator
+        namespace: Scopes the generated shape IDs to one diagram
+
+    Returns:
+        A list of TLDraw shapes
+    """
+    executor = _executor
+    with time_stage("layout"):
+        if executor is None or layout_size(llm_response) < LAYOUT_INLINE_THRESHOLD:
+            return generator(llm_response, namespace)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, generator, llm_response, namespace)